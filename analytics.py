@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Performance analytics of a finished backtest, computed with numpy over
+the trade ledger (closed orders as columns, see order.TradeLedger) and
+the per bar equity curve (see metrics.MetricsAccumulator.equity_curve).
+
+analyze(backtester) returns all of them as a dict. Every function is a
+handful of array operations, cheap enough to be used as a metric in
+parameter sweeps (see optimizer.py). Drawdowns of the marked to market
+equity curve are named mtm_max_drawdown*, so that they don't clash with
+the closed trade max_drawdown of AlgoTradingBacktesting.statistics().
+"""
+
+import numpy as np
+import pandas
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def returns_from_equity(equity, capital):
+    """
+    Returns per period of an equity (profit) curve, relative to a fixed
+    capital.
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    if len(equity) < 2:
+        return np.zeros(0)
+    return np.diff(equity) / capital
+
+
+def daily_equity(equity, times):
+    """
+    Equity at the end of every day. times is the datetime64 time of each
+    bar, ascending.
+    """
+    days = np.asarray(times).astype('datetime64[D]')
+    last_of_day = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+    return np.asarray(equity, dtype=np.float64)[last_of_day], days[last_of_day]
+
+
+def daily_returns(equity, times, capital):
+    """
+    Returns per day, relative to a fixed capital. The first day's return is
+    measured from zero profit.
+    """
+    equity, days = daily_equity(equity, times)
+    return np.diff(np.concatenate([[0.0], equity])) / capital, days
+
+
+def sharpe_ratio(returns, periods_per_year=TRADING_DAYS_PER_YEAR):
+    """
+    Annualized Sharpe ratio (risk free rate 0) of returns per period.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if len(returns) < 2:
+        return np.nan
+    std = returns.std(ddof=1)
+    if std == 0:
+        return np.nan
+    return np.sqrt(periods_per_year) * returns.mean() / std
+
+
+def sortino_ratio(returns, periods_per_year=TRADING_DAYS_PER_YEAR):
+    """
+    Annualized Sortino ratio (target return 0) of returns per period.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if len(returns) < 2:
+        return np.nan
+    downside = np.sqrt(np.mean(np.minimum(returns, 0.0) ** 2))
+    if downside == 0:
+        return np.nan
+    return np.sqrt(periods_per_year) * returns.mean() / downside
+
+
+def drawdown(equity):
+    """
+    Maximum drawdown of an equity (profit) curve, starting from zero, and
+    the longest drawdown duration - the most periods spent below a
+    previous peak.
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    if not len(equity):
+        return 0.0, 0
+    peak = np.maximum.accumulate(np.maximum(equity, 0.0))
+    underwater = equity < peak
+    max_drawdown = (peak - equity).max()
+
+    # Lengths of runs of underwater periods
+    edges = np.diff(np.concatenate([[0], underwater.view(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    max_duration = (ends - starts).max() if len(starts) else 0
+    return max_drawdown, int(max_duration)
+
+
+def profit_factor(profit):
+    """
+    Gross profit of winning trades over gross loss of losing ones.
+    """
+    profit = np.asarray(profit, dtype=np.float64)
+    loss = -profit[profit < 0].sum()
+    if loss == 0:
+        return np.inf if (profit > 0).any() else np.nan
+    return profit[profit > 0].sum() / loss
+
+
+def expectancy(profit):
+    """
+    Average profit per trade - win rate * average win + loss rate *
+    average loss.
+    """
+    profit = np.asarray(profit, dtype=np.float64)
+    return profit.mean() if len(profit) else 0.0
+
+
+def trade_analytics(ledger, capital, times=None):
+    """
+    Analytics of closed orders in a TradeLedger. Holding time is in bars,
+    and also in seconds when times (datetime64 time of each bar) is given.
+    Turnover is the value traded (entries and exits) relative to capital.
+    """
+    profit = ledger.column('profit')
+    quantity = ledger.column('quantity')
+    entry_index = ledger.column('entry_index')
+    exit_index = ledger.column('exit_index')
+    traded_value = quantity * (ledger.column('entry_price') + ledger.column('exit_price'))
+    wins = profit >= 0
+
+    stats = {'win_rate': wins.mean() if len(profit) else np.nan,
+             'average_win': profit[wins].mean() if wins.any() else 0.0,
+             'average_loss': profit[~wins].mean() if (~wins).any() else 0.0,
+             'profit_factor': profit_factor(profit),
+             'expectancy': expectancy(profit),
+             'average_holding_bars': (exit_index - entry_index).mean() if len(profit) else np.nan,
+             'turnover': traded_value.sum() / capital}
+    if times is not None:
+        seconds = np.asarray(times).astype('datetime64[s]').astype(np.int64)
+        holding = seconds[exit_index] - seconds[entry_index]
+        stats['average_holding_seconds'] = holding.mean() if len(profit) else np.nan
+    return stats
+
+
+def bar_times(backtester):
+    """
+    datetime64 time of every bar of a backtest, or None if it isn't known
+    (e.g. the timeline is bar numbers and there is no CandleSeries).
+    """
+    timeline = backtester.timeline
+    if isinstance(timeline, np.ndarray) and timeline.dtype.kind == 'M':
+        return timeline
+    if backtester.candles is not None:
+        return backtester.candles.datetimes
+    return None
+
+
+def exposure(backtester):
+    """
+    Per bar gross value (at entry price) of open orders over the last
+    backtested segment (backtester.segment).
+    """
+    start, stop = backtester.segment or (0, None)
+    return backtester.metrics.exposure_curve(len(backtester.candles_close))[start:stop]
+
+
+def default_capital(backtester):
+    """
+    Capital returns are relative to when none is given - the peak exposure,
+    i.e. the most money tied up in open orders at once. 1.0 if no order was
+    open.
+    """
+    bar_exposure = exposure(backtester)
+    peak = bar_exposure.max() if len(bar_exposure) else 0.0
+    return peak if peak > 0 else 1.0
+
+
+def analyze(backtester, capital=None, periods_per_year=TRADING_DAYS_PER_YEAR,
+            include_returns=False):
+    """
+    All analytics of a finished AlgoTradingBacktesting backtest, as a dict.
+    Returns are relative to capital (default: default_capital). Sharpe and
+    Sortino ratios are of daily returns when bar times are known, otherwise
+    of returns per bar (annualized with periods_per_year either way). Only
+    the bars of the last backtested segment (backtester.segment) are looked
+    at. With include_returns=True, 'returns' holds those returns as a
+    pandas Series indexed by day (or by bar).
+    """
+    metrics = backtester.metrics
+    start, stop = backtester.segment or (0, None)
+    equity, _ = metrics.equity_curve(backtester.candles_close)
+    if capital is None:
+        capital = default_capital(backtester)
+    # Profit made within the segment, i.e. relative to the end of the bar
+    # before it
+    equity = equity[start:stop] - (equity[start - 1] if start > 0 else 0.0)
+    times = bar_times(backtester)
+    if times is not None:
+        returns, periods = daily_returns(equity, times[start:stop], capital)
+    else:
+        returns = returns_from_equity(equity, capital)
+        periods = np.arange(start + 1, start + 1 + len(returns))
+    max_drawdown, max_drawdown_duration = drawdown(equity)
+    bar_exposure = exposure(backtester)
+    max_exposure = bar_exposure.max() if len(bar_exposure) else 0.0
+
+    stats = {'capital': capital,
+             'net_profit': equity[-1] if len(equity) else 0.0,
+             'return_percent': 100.0 * equity[-1] / capital if len(equity) else 0.0,
+             'sharpe_ratio': sharpe_ratio(returns, periods_per_year),
+             'sortino_ratio': sortino_ratio(returns, periods_per_year),
+             'mtm_max_drawdown': max_drawdown,
+             'mtm_max_drawdown_percent': 100.0 * max_drawdown / capital,
+             'mtm_max_drawdown_duration': max_drawdown_duration,
+             'max_exposure': max_exposure}
+    stats.update(trade_analytics(backtester.ledger, capital, times))
+    if include_returns:
+        stats['returns'] = pandas.Series(returns, index=periods)
+    return stats
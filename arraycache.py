@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+A cache of numpy arrays bounded by their total size, used for computed
+columns shared between backtests (spec expressions, see spec.py, and
+indicator arrays, see batch.py).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ArrayCache(object):
+    """
+    Arrays keyed by any hashable key, evicting the least recently used ones
+    when they take more than max_bytes.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def get(self, key, compute):
+        """
+        Array of key, computed with compute() if it isn't cached.
+        """
+        try:
+            values = self.arrays.pop(key)
+            self.hits += 1
+        except KeyError:
+            values = compute()
+            self.misses += 1
+            self.nbytes += np.asarray(values).nbytes
+        self.arrays[key] = values       # most recently used last
+        self.evict()
+        return values
+
+    def evict(self):
+        # The most recently used array stays even if it alone is too big
+        while self.nbytes > self.max_bytes and len(self.arrays) > 1:
+            _, values = self.arrays.popitem(last=False)
+            self.nbytes -= np.asarray(values).nbytes
+            self.evictions += 1
+
+    def discard(self, key):
+        """
+        Drop the array of key, if cached.
+        """
+        if key in self.arrays:
+            self.nbytes -= np.asarray(self.arrays.pop(key)).nbytes
+
+    def clear(self):
+        self.arrays.clear()
+        self.nbytes = 0
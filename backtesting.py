@@ -4,60 +4,178 @@
 """
 
 from abc import ABCMeta, abstractmethod
-from itertools import chain
-import time
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from order import BuyOrder, SellOrder
+import numpy as np
+import events
+from events import INFO
+from metrics import MetricsAccumulator
+from order import (BUY, SELL, BuyOrder, SellOrder, ClosedOrders, OrderColumns, TradeLedger,
+                   check_triggers, reserve_order_ids)
+from orderbook import OrderBook
+from parameters import set_parameters
+from plotting import BacktestPlot, DEFAULT_MAX_POINTS, headless
+from resample import resampler
+from vectorized import trigger_array, resolve_exits
+
+# Number of candles converted to python objects at a time by backtest()
+BACKTEST_CHUNK_SIZE = 65536
+
+
+def as_list(values):
+    """
+    Convert a slice of a candle column (numpy array or list) to a list of
+    python objects, which are much faster to work with one at a time.
+    """
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return list(values)
 
 
 class AlgoTradingBacktesting:
     __metaclass__ = ABCMeta
 
-    def __init__(self):
+    # Fill and cost models (see costs.py). None fills at candle extremes
+    # without costs.
+    fill_model = None
+    cost_model = None
+
+    def __init__(self, candles=None, **params):
+        # Strategy parameters (class attributes of subclasses) can be
+        # overridden per instance, e.g. Strategy2(ema_fast_window=5)
+        set_parameters(self, params)
+
         # Store timeline for backtesting.
         # Timeframe can be anything - days, minutes, etc.
         self.timeline = []
 
-        # Candles corresponding to each entry in self.timeline
+        # Candles corresponding to each entry in self.timeline.
+        # When data is read into a CandleSeries (see candles.py), self.candles
+        # holds it and candles_* are views on its columns.
+        self.candles = None
         self.candles_open = []
         self.candles_close = []
         self.candles_high = []
         self.candles_low = []
 
-        # For keeping track of orders
-        self.open_orders = []
-        self.closed_orders = []
+        # For keeping track of orders. open_orders is indexed by stop loss
+        # and target triggers (see orderbook.py).
+        self.open_orders = OrderBook()
+        self.closed_orders = ClosedOrders()
+        self.ledger = TradeLedger()     # closed orders as columns
+        self.metrics = MetricsAccumulator()
 
         # Used during backtesting
+        self.current_index = None
         self.current_time = None
         self.current_candle_open = None
         self.current_candle_close = None
         self.current_candle_high = None
         self.current_candle_low = None
 
-        # Read data into self.timeline and self.datapoints
-        self.read_data()
+        # Streaming indicators, updated with every candle before strategy()
+        self.indicators = []
+
+        # Range of bars (start, stop) of the last backtest
+        self.segment = None
+
+        # State of self.crossover()
+        self.initialize_crossover()
+
+        # Read data into self.timeline and self.datapoints, unless candles
+        # (a CandleSeries) are given - e.g. just warm up history for a live
+        # run (see live.py)
+        if candles is None:
+            self.read_data()
+        else:
+            self.set_candles(candles)
 
     @abstractmethod
     def read_data(self):
         """
-        Implement this method to read input data into 2 variables -
-        1. timeline
-        2. datapoints
+        Implement this method to read input data into self.timeline and
+        candles_*, e.g. self.set_candles(load_candles(path)) (see
+        dataloader.py).
+        """
+
+    def set_candles(self, candles, timeline=None):
+        """
+        Use a CandleSeries as input data. candles_* become views on its
+        columns. timeline defaults to candles.datetimes.
+        """
+        self.candles = candles
+        self.timeline = candles.datetimes if timeline is None else timeline
+        self.candles_open = candles.open
+        self.candles_close = candles.close
+        self.candles_high = candles.high
+        self.candles_low = candles.low
+
+    def history(self, i):
+        """
+        Candles upto and including bar i, as a CandleSeries of views (no copy).
+        """
+        return self.candles[:i+1]
+
+    def timeframe(self, seconds, offset=0):
+        """
+        self.candles resampled to a higher timeframe of 'seconds' (see
+        resample.py), computed once and shared by backtests of the same
+        candles. Read the latest complete candle at bar i through
+        timeframe.completed_index[i].
+        """
+        return resampler(self.candles).timeframe(seconds, offset)
+
+    def add_indicator(self, indicator):
+        """
+        Register a streaming indicator (see indicators.py).
+        It gets updated with every candle before self.strategy is called,
+        so strategy can read indicator.value without slicing the history.
         """
+        self.indicators.append(indicator)
+        return indicator
 
     def buy_trade(self, entry_price, quantity=1,
                   stop_loss_trigger=None, target_trigger=None):
         buyorder = BuyOrder(entry_price, quantity, self.current_time,
                             stop_loss_trigger, target_trigger)
+        buyorder.entry_index = self.current_index
         self.open_orders.append(buyorder)
+        self.metrics.on_open(buyorder)
 
     def sell_trade(self, entry_price, quantity=1,
                    stop_loss_trigger=None, target_trigger=None):
         sellorder = SellOrder(entry_price, quantity, self.current_time,
                               stop_loss_trigger, target_trigger)
+        sellorder.entry_index = self.current_index
         self.open_orders.append(sellorder)
+        self.metrics.on_open(sellorder)
+
+    def record_close(self, order):
+        """
+        Book keeping for an order which has just been closed at bar
+        self.current_index.
+        """
+        order.exit_index = self.current_index
+        self.closed_orders.append(order)
+        self.ledger.append(order)
+        self.metrics.on_close(order)
+
+    def initialize_crossover(self):
+        self.prev_val1 = 0
+        self.prev_val2 = 0
+
+    def crossover(self, val1, val2):
+        cmp1 = cmp(val1, val2)
+        cmp2 = cmp(self.prev_val1, self.prev_val2)
+        if (not (self.prev_val1 == 0 and self.prev_val2 == 0)):         # don't trigger crossover when called first time
+            self.prev_val1, self.prev_val2 = val1, val2
+            if cmp1 > cmp2:
+                return 1
+            elif cmp1 < cmp2:
+                return -1
+            else:
+                return 0
+        else:
+            self.prev_val1, self.prev_val2 = val1, val2
+            return 0
 
     @abstractmethod
     def strategy(self, i, candle_open, candle_close, candle_low, candle_high):
@@ -71,154 +189,270 @@ class AlgoTradingBacktesting:
         4. When sell condition is met, call self.sell_trade
         """
 
-    def backtest(self):
+    def backtest(self, start=0, stop=None, profiler=None, checkpointer=None):
         """
         Call this method to start backtesting
+        Only bars start..stop-1 are backtested if given (indicators then
+        start cold at bar start).
+        With a profiler (see profiling.py), every bar is timed by stage.
+        With a checkpointer (see checkpoint.py), the state is saved every
+        checkpointer.every bars from start.
+        """
+        n = len(self.candles_open)
+        stop = n if stop is None else min(stop, n)
+        self.segment = (start, stop)
+        if profiler is None:
+            process_candle = self.backtest_candle
+        else:
+            process_candle = profiler.start(self)
+        next_save = None if checkpointer is None else start + checkpointer.every
+        chunk_start = start
+        try:
+            while chunk_start < stop:
+                chunk_stop = min(chunk_start + BACKTEST_CHUNK_SIZE, stop)
+                if next_save is not None and next_save < chunk_stop:
+                    chunk_stop = next_save
+                chunk = zip(xrange(chunk_start, chunk_stop),
+                            as_list(self.timeline[chunk_start:chunk_stop]),
+                            as_list(self.candles_open[chunk_start:chunk_stop]),
+                            as_list(self.candles_close[chunk_start:chunk_stop]),
+                            as_list(self.candles_high[chunk_start:chunk_stop]),
+                            as_list(self.candles_low[chunk_start:chunk_stop]))
+                for candle in chunk:
+                    process_candle(*candle)
+                if chunk_stop == next_save:
+                    checkpointer.save(self)
+                    next_save += checkpointer.every
+                chunk_start = chunk_stop
+        finally:
+            if profiler is not None:
+                profiler.stop()
+
+    def backtest_candle(self, i, time, candle_open, candle_close,
+                        candle_high, candle_low):
+        """
+        Process candle i - try to close open orders, update indicators
+        and execute strategy.
+        """
+        self.set_current_candle(i, time, candle_open, candle_close,
+                                candle_high, candle_low)
+        self.close_triggered_orders()
+        self.update_indicators()
+
+        # Execute strategy (which will generate create open orders)
+        self.strategy(i, candle_open, candle_close, candle_high, candle_low)
+
+    def set_current_candle(self, i, time, candle_open, candle_close,
+                           candle_high, candle_low):
+        self.current_index = i
+        self.current_time = time
+        self.current_candle_open = candle_open
+        self.current_candle_close = candle_close
+        self.current_candle_high = candle_high
+        self.current_candle_low = candle_low
+
+    def close_triggered_orders(self):
         """
-        for i in xrange(len(self.candles_open)):
-            self.current_time = self.timeline[i]
-            self.current_candle_open = self.candles_open[i]
-            self.current_candle_close = self.candles_close[i]
-            self.current_candle_high = self.candles_high[i]
-            self.current_candle_low = self.candles_low[i]
-
-            # Try to close, open orders
-            for i, order in reversed(list(enumerate(self.open_orders))):
-                if order.try_to_close(self.current_candle_high,
-                                      self.current_candle_low,
-                                      self.current_time):
-                    self.closed_orders.append(self.open_orders.pop(i))
-
-            # Execute strategy (which will generate create open orders)
-            self.strategy(i, self.current_candle_open,
-                             self.current_candle_close,
-                             self.current_candle_high,
-                             self.current_candle_low)
+        Try to close, open orders. Only orders whose triggers are hit by
+        the current candle are returned by the order book.
+        """
+        orders = self.open_orders.pop_triggered(self.current_candle_high,
+                                                self.current_candle_low)
+        if not orders:
+            return
+        fill_time = None if self.fill_model is None else self.current_bar_time()
+        for order in orders:
+            order.try_to_close(self.current_candle_high,
+                               self.current_candle_low,
+                               self.current_time,
+                               self.fill_model, self.cost_model, fill_time)
+            self.record_close(order)
+
+    def fill_times(self, bars):
+        """
+        Times of bars (an index array) as given to fill models - from
+        self.candles when data was read into a CandleSeries, as timeline
+        may hold bar numbers (e.g. Strategy2), else from timeline.
+        """
+        if self.candles is not None:
+            return self.candles.time[bars]
+        return np.asarray(self.timeline)[bars]
 
-    def get_statistics(self, i=None):
+    def current_bar_time(self):
+        """
+        Time of the current bar (see fill_times). Bars beyond self.candles,
+        as in live runs, have their time in self.current_time.
+        """
+        i = self.current_index
+        if self.candles is not None and i < len(self.candles):
+            return self.candles.time[i]
+        return self.current_time
+
+    def close_open_orders(self):
         """
-        Get various statistics.
+        Close all open orders at the close of the last processed bar
+        (self.current_index), latest placed order first - e.g. to book
+        positions still open at the end of a backtested range.
+        """
+        i = self.current_index
+        price = self.candles_close[i]
+        time = self.timeline[i]
+        orders = list(self.open_orders)
+        self.open_orders = OrderBook()
+        for order in reversed(orders):
+            costs = 0.0 if self.cost_model is None else self.cost_model.order_costs(order, price)
+            order.close(price, time, costs)
+            self.record_close(order)
+
+    def update_indicators(self):
+        """
+        Update indicators with current candle
+        """
+        for indicator in self.indicators:
+            indicator.update_candle(self.current_candle_open,
+                                    self.current_candle_close,
+                                    self.current_candle_high,
+                                    self.current_candle_low)
+
+    def signals(self):
+        """
+        Implement this method to backtest with self.backtest_vectorized.
+        Compute signals over whole candle arrays (see array functions in
+        indicators.py) and return a tuple (entries, stop_loss, target) -
+        1. entries[i] > 0 buys entries[i] quantity at candles_close[i],
+           entries[i] < 0 sells -entries[i] quantity, 0 does nothing
+        2. stop_loss[i] and target[i] are triggers for the order entered
+           at bar i (NaN for no trigger). Either may be None altogether.
+        """
+        raise NotImplementedError('signals() is needed for backtest_vectorized()')
+
+    def backtest_vectorized(self, start=0, stop=None, signals=None):
+        """
+        Call this method to backtest using self.signals instead of
+        self.strategy. Fills, stop loss and target hits are worked out in
+        bulk with numpy and give the same orders as self.backtest would.
+        Only bars start..stop-1 are backtested if given - signals are still
+        computed over all candles, so indicators are warmed up by the bars
+        before start. Precomputed signals (the return value of
+        self.signals()) can be passed in.
+        """
+        entries, stop_loss, target = self.signals() if signals is None else signals
+        n = len(self.candles_close)
+        stop = n if stop is None else min(stop, n)
+        self.segment = (start, stop)
+        entries = np.asarray(entries)
+        entry_index = np.flatnonzero(entries[start:stop]) + start
+        is_buy = entries[entry_index] > 0
+        stop_loss = trigger_array(stop_loss, n)[entry_index]
+        target = trigger_array(target, n)[entry_index]
+        exit_index, exit_price, stop_loss_hit = resolve_exits(entry_index, is_buy,
+                                                              stop_loss, target,
+                                                              self.candles_high,
+                                                              self.candles_low, stop)
+        entry_prices = np.asarray(self.candles_close, dtype=np.float64)[entry_index]
+        quantities = np.abs(entries[entry_index])
+
+        # Fill prices and costs of all closed orders at once
+        closed = np.flatnonzero(exit_index >= 0)
+        if self.fill_model is not None:
+            bars = exit_index[closed]
+            exit_price[closed] = self.fill_model.exit_price(
+                is_buy[closed], stop_loss_hit[closed], stop_loss[closed], target[closed],
+                np.asarray(self.candles_high, dtype=np.float64)[bars],
+                np.asarray(self.candles_low, dtype=np.float64)[bars],
+                self.fill_times(bars))
+        costs = np.zeros(len(entry_index))
+        if self.cost_model is not None:
+            costs[closed] = self.cost_model.costs(is_buy[closed], quantities[closed],
+                                                  entry_prices[closed], exit_price[closed])
+
+        # Record orders in bulk - closed ones go to the ledger, metrics and
+        # closed_orders as columns, and Order objects are only built for
+        # orders left open. Triggers of -inf are missing ones.
+        check_triggers(is_buy, entry_prices, stop_loss, target)
+        stop_loss = np.where(stop_loss == -np.inf, np.nan, stop_loss)
+        target = np.where(target == -np.inf, np.nan, target)
+        m = len(entry_index)
+        ids = reserve_order_ids(m)
+        sides = np.where(is_buy, BUY, SELL)
+        profit = np.where(is_buy, exit_price - entry_prices, entry_prices - exit_price)
+        profit = profit * quantities - costs
+        profit_percent = (100.0 * profit / quantities) / entry_prices
+
+        # Closed in the sequence backtest() would close them - by exit bar
+        # and, within a bar, latest order first
+        closed = closed[np.lexsort((-closed, exit_index[closed]))]
+        self.metrics.extend(ids, entry_index, sides * quantities, entry_prices, exit_index,
+                            closed, profit, profit_percent)
+        self.ledger.extend(id=ids[closed], side=sides[closed], quantity=quantities[closed],
+                           entry_index=entry_index[closed], exit_index=exit_index[closed],
+                           entry_price=entry_prices[closed], exit_price=exit_price[closed],
+                           profit=profit[closed], profit_percent=profit_percent[closed],
+                           costs=costs[closed])
+        timeline = np.asarray(self.timeline)
+        self.closed_orders.extend_columns(
+            id=ids[closed], side=sides[closed], quantity=quantities[closed],
+            entry_price=entry_prices[closed], entry_time=timeline[entry_index[closed]],
+            entry_index=entry_index[closed], stop_loss_trigger=stop_loss[closed],
+            target_trigger=target[closed], exit_price=exit_price[closed],
+            exit_time=timeline[exit_index[closed]], exit_index=exit_index[closed],
+            profit=profit[closed], profit_percent=profit_percent[closed], costs=costs[closed])
+        still_open = np.flatnonzero(exit_index < 0)
+        opened = OrderColumns(id=ids[still_open], side=sides[still_open],
+                              quantity=quantities[still_open],
+                              entry_price=entry_prices[still_open],
+                              entry_time=timeline[entry_index[still_open]],
+                              entry_index=entry_index[still_open],
+                              stop_loss_trigger=stop_loss[still_open],
+                              target_trigger=target[still_open])
+        for k in xrange(len(opened)):
+            self.open_orders.append(opened[k])
+
+        if events.sink.enabled(INFO):
+            for k in xrange(m):
+                events.sink.log(INFO, '[ID: %s] %s %d@%f (New order)', ids[k],
+                                'Buying' if is_buy[k] else 'Selling', quantities[k],
+                                entry_prices[k])
+            for k in closed.tolist():
+                events.sink.log(INFO, '[ID: %s] %sing %d@%f. Profit booked: %f %%',
+                                ids[k], 'buy' if is_buy[k] else 'sell', quantities[k],
+                                exit_price[k], profit_percent[k])
+        self.current_index = stop - 1
+
+    def statistics(self, i=None):
+        """
+        Get various statistics as a dict.
         If i is None, provide end of simulation statistics
         If i in not None, provide statistics generated upto self.timeline[i]
+        Statistics are looked up in self.metrics, which is kept up to date
+        as orders open and close, so this is cheap for any i.
         """
-        executed_trades = 0
-        open_trades = 0
-        profitable_trades = 0
-        loss_making_trades = 0
-
         if i is None:
-            i = -1          # till last element of self.timeline
-
-        # Code for recreating scenario of executed and open trades for
-        # given time 'i' (ie self.timeline[i])
-        for j, order in enumerate(chain(self.closed_orders, self.open_orders)):
-            if (order.exit_time is not None and order.exit_time <= self.timeline[i]):
-                executed_trades += 1
-                if order.profit >= 0:
-                    profitable_trades += 1
-                else:
-                    loss_making_trades += 1
-            elif (order.entry_time < self.timeline[i] and (order.exit_time is None or order.exit_time > self.timeline[i])):
-                open_trades += 1
-            else:
-                break
+            # till the last processed bar (beyond self.timeline in live runs)
+            i = self.current_index if self.current_index is not None else -1
+        if i < 0:
+            i += len(self.timeline)
+        return self.metrics.statistics(i)
 
+    def get_statistics(self, i=None):
+        """
+        Get various statistics, formatted for printing.
+        If i is None, provide end of simulation statistics
+        If i in not None, provide statistics generated upto self.timeline[i]
+        """
         return """
 Statistics:
 ---------------------------
-Executed trades: %d
-Open trades: %d
-Profitable trades: %d
-Loss making trades: %d
-             """ % (executed_trades, open_trades, profitable_trades, loss_making_trades)
+Executed trades: %(executed_trades)d
+Open trades: %(open_trades)d
+Profitable trades: %(profitable_trades)d
+Loss making trades: %(loss_making_trades)d
+             """ % self.statistics(i)
 
     def print_statistics(self):
         print self.get_statistics()
 
-    def __preplot_process(self):
-        self.profit_percents = []
-#        self.buy_quantities = []
-#        self.sell_quantities = []
-
-        # This confusing piece of code below generates the list
-        # self.profit_percents, holding proft_percents corresponding to
-        # every entry in timeline.
-        j = 0
-        total_profit = 0
-        total_orders = len(self.closed_orders)
-        max_j = total_orders - 1
-        max_entry_price = 1e-10     # a very small value; not using 0 to avoid divide by zero error
-        for i, _time in enumerate(self.timeline):
-            if j <= max_j and _time == self.closed_orders[j].exit_time:
-                total_profit += self.closed_orders[j].profit
-#                if self.closed_orders[j].type == 'buy':
-#                    self.buy_quantities.append(self.closed_orders[j].quantity)
-#                    self.sell_quantities.append(0)
-#                else:
-#                    self.sell_quantities.append(-self.closed_orders[j].quantity)
-#                    self.buy_quantities.append(0)
-                j += 1
-                if j <= max_j:
-                    while True:
-                        if self.closed_orders[j].exit_time == _time:
-                            total_profit += (self.close_orders[j].profit)
-                            max_entry_price = self.closed_orders[j].entry_price if self.closed_orders[j].entry_price > max_entry_price else max_entry_price
-#                            if self.closed_orders[j].type == 'buy':
-#                                self.buy_quantities[i] = self.buy_quantities[i] + self.closed_orders[j].quantity
-#                            else:
-#                                self.sell_quantities[i] = self.sell_quantities[i] - self.closed_orders[j].quantity
-                            j += 1
-                        else:
-                            break
-#            else:
-#                self.buy_quantities.append(0)
-#                self.sell_quantities.append(0)
-
-            if j <= max_j:
-                max_entry_price = self.closed_orders[j].entry_price if self.closed_orders[j].entry_price > max_entry_price else max_entry_price
-            profit_percent = 100.0*total_profit/(max_entry_price)
-            self.profit_percents.append(profit_percent)
-
-
-        # Plotting
-        f, (self.ax1, self.ax2) = plt.subplots(2, 1)
-
-        ylim1_min = min(self.candles_close)
-        ylim1_max = max(self.candles_close)
-        ylim2_min = min(self.profit_percents)
-        ylim2_max = max(self.profit_percents)
-
-        # Subplots
-        tick_label_frequency = 10
-        self.ax1.set_xlabel('Date')
-        self.ax1.set_ylabel('Stock price')
-        self.ax1.set_xlim([self.timeline[0], self.timeline[-1]])
-        self.ax1.set_ylim([ylim1_min, ylim1_max])
-        if hasattr(self, 'timeline_labels'):
-            self.ax1.set_xticks(self.timeline[::len(self.timeline)/tick_label_frequency])
-            self.ax1.set_xticklabels(self.timeline_labels[::len(self.timeline)/tick_label_frequency])
-#        self.ax1.set_title('Close candle price vs Timeline')
-#        self.ax1.grid(b=True, which='both', axis='both')
-
-        self.ax2.set_xlabel('Date')
-        self.ax2.set_ylabel('Percentage profit')
-        self.ax2.set_xlim([self.timeline[0], self.timeline[-1]])
-        self.ax2.set_ylim([ylim2_min, ylim2_max])
-        if hasattr(self, 'timeline_labels'):
-            self.ax2.set_xticks(self.timeline[::len(self.timeline)/tick_label_frequency])
-            self.ax2.set_xticklabels(self.timeline_labels[::len(self.timeline)/tick_label_frequency])
-#        self.ax2.set_title('Profit percent vs Timeline')
-#        self.ax2.grid(b=True, which='both', axis='both')
-
-        # For showing statistics on plot
-        self.plot_text = Rectangle((0, 0), 1.5, 1, fc="w", fill=False, edgecolor='none', linewidth=0)
-
-        # open plot as maximized
-        mng = plt.get_current_fig_manager()
-        mng.window.showMaximized()
-        plt.tight_layout()
-
-    def plot(self):
+    def plot(self, path=None, max_points=DEFAULT_MAX_POINTS):
         """
         Creates 2 plots -
         1. Stock Price vs Date
@@ -226,56 +460,29 @@ Loss making trades: %d
 
         Generates the plot which will be generated at the end of
         self.animation method
+        The plot is shown in a window, or saved to path if given (format
+        from the extension, e.g. .png or .svg). On a headless matplotlib
+        backend it is always saved, to '<class name>.png' by default.
         """
+        plot = BacktestPlot(self, max_points, interactive=path is None and not headless())
+        if plot.interactive:
+            plot.show()
+        else:
+            plot.save(path or '%s.png' % self.__class__.__name__)
 
-        self.__preplot_process()
-
-        # Stock price
-        self.ax1.plot(self.timeline, self.candles_close, color='b')
-
-        # Percentage profit with statistics
-        self.ax2.plot(self.timeline, self.profit_percents, color='b')
-        self.ax2.legend([self.plot_text], [self.get_statistics()], loc='upper left')
-
-        # Buy/sell bar charts
-#        self.ax3.plot(self.timeline, self.buy_quantities, color='g')
-#        self.ax3.plot(self.timeline, self.sell_quantities, color='r')
-
-
-        plt.show()
-
-    def animate(self):
+    def animate(self, path=None, frames=100, max_points=DEFAULT_MAX_POINTS):
         """
         Animates 2 plots -
         1. Stock Price vs Date
         2. Profit percentage vs Date
 
-        Speed of animation can be controlled by playing with 3rd argument of xrange
+        Speed of animation can be controlled with the number of frames.
+        The animation is shown in a window, or saved to path if given (.mp4
+        or .gif). On a headless matplotlib backend it is always saved, to
+        '<class name>.mp4' by default.
         """
-        self.__preplot_process()
-
-        # interactive plot mode 'on'
-        plt.ion()
-
-        ax1_plot = None
-        ax2_plot = None
-        animation_frames = 100
-        step = len(self.timeline)/animation_frames  if len(self.timeline)/animation_frames >= 1 else 1
-
-        for i in chain(xrange(0, len(self.timeline), step), [len(self.timeline)-1]):
-            # Stock price
-            if ax1_plot:
-                ax1_plot.remove()
-            ax1_plot, = self.ax1.plot(self.timeline[:i], self.candles_close[:i], color='b')
-
-            # Percentage profit with statistics
-            if ax2_plot:
-                ax2_plot.remove()
-            ax2_plot, = self.ax2.plot(self.timeline[:i], self.profit_percents[:i], color='b')
-            self.ax2.legend([self.plot_text], [self.get_statistics(i)], loc='upper left')
-
-            plt.pause(0.01)
-
-        for i in xrange(20):
-            # Wait for 10 sec and then exit
-            time.sleep(1)
+        plot = BacktestPlot(self, max_points, interactive=path is None and not headless())
+        if plot.interactive:
+            plot.animate(frames=frames)
+        else:
+            plot.animate(path or '%s.mp4' % self.__class__.__name__, frames)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Running many strategies over the same candles in one pass.
+
+    runner = BatchRunner(load_candles('pycon-tatasteel-data.csv'))
+    runner.add(Strategy1)
+    runner.add(Strategy2)
+    runner.add(Strategy2, target_percent=0.5)
+    runner.run()
+    print runner.report()
+
+Candles are loaded once and given to every strategy (candles=...). All
+strategies are stepped together, bar by bar, each with its own order
+book, ledger and statistics. Streaming indicators with an array
+equivalent (EMA, SMA) are not updated per strategy - their values are
+computed once over the whole series with the array functions of
+indicators.py (which give identical values) and kept in an
+IndicatorCache, shared by all strategies using the same indicator with
+the same parameters on the same series. Other indicators are updated as
+usual. Cached arrays are converted to python values a chunk of bars at a
+time, like the candles in AlgoTradingBacktesting.backtest().
+
+Cached indicators are value-only: the runner sets indicator.value at
+every bar and never calls update(), so their other state (window, running
+sums, ...) stays as it was when they were created. Strategies run by a
+BatchRunner should only read .value of EMA and SMA indicators.
+"""
+
+import weakref
+
+import pandas
+
+from arraycache import ArrayCache
+from backtesting import BACKTEST_CHUNK_SIZE, as_list
+from indicators import EMA, SMA, ema_array, sma_array
+
+# Streaming indicators and their array functions
+ARRAY_FUNCTIONS = {EMA: ema_array, SMA: sma_array}
+
+
+class IndicatorCache(ArrayCache):
+    """
+    Indicator arrays keyed by (candles, indicator, params, series) - an
+    ArrayCache of max_bytes. Candles are told apart by id(); the arrays of
+    a CandleSeries are dropped when it is garbage collected, so its id can
+    not be mistaken for another's.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        ArrayCache.__init__(self, max_bytes)
+        self.candles = {}               # id(candles) -> weakref to candles
+
+    def indicator(self, function, candles, series_name, *params):
+        """
+        function(getattr(candles, series_name), *params) - e.g.
+        indicator(ema_array, candles, 'close', 15).
+        """
+        owner = id(candles)
+        if owner not in self.candles:
+            self.candles[owner] = weakref.ref(candles, lambda _: self.release(owner))
+        return self.get((owner, function.__name__, params, series_name),
+                        lambda: function(getattr(candles, series_name), *params))
+
+    def release(self, owner):
+        """
+        Drop the arrays of the candles with id owner.
+        """
+        self.candles.pop(owner, None)
+        for key in [key for key in self.arrays if key[0] == owner]:
+            self.discard(key)
+
+    def clear(self):
+        ArrayCache.clear(self)
+        self.candles.clear()
+
+
+def indicator_values(cache, candles, indicator):
+    """
+    Values of a streaming indicator at every bar as an array (NaN where it
+    is not ready), from the cache. None if the indicator has no array
+    equivalent.
+    """
+    function = ARRAY_FUNCTIONS.get(type(indicator))
+    if function is None:
+        return None
+    return cache.indicator(function, candles, indicator.source, indicator.window)
+
+
+def as_values(values):
+    """
+    A slice of an indicator array as a list of python floats, None where
+    the indicator is not ready.
+    """
+    return [None if value != value else value for value in values.tolist()]
+
+
+class BatchRunner(object):
+    """
+    Steps strategies (AlgoTradingBacktesting subclasses) over the same
+    candles together. cache is an IndicatorCache, shared across runners
+    if given. Indicators with an array function only get their value set
+    (see above).
+    """
+    def __init__(self, candles, cache=None):
+        self.candles = candles
+        self.cache = IndicatorCache() if cache is None else cache
+        self.strategies = []
+        self.names = []
+
+    def add(self, strategy_class, name=None, **params):
+        """
+        Add a strategy with parameters. Returns the backtester.
+        """
+        backtester = strategy_class(candles=self.candles, **params)
+        self.strategies.append(backtester)
+        if name is None:
+            name = strategy_class.__name__
+            if params:
+                name += '(%s)' % ', '.join('%s=%r' % item for item in sorted(params.items()))
+        self.names.append(name)
+        return backtester
+
+    def plan(self):
+        """
+        For every strategy - (backtester, [(indicator, values)] of cached
+        indicators, [indicator] of indicators updated per bar). Arrays of
+        values are shared between strategies.
+        """
+        arrays = {}
+        plans = []
+        for backtester in self.strategies:
+            cached = []
+            streaming = []
+            for indicator in backtester.indicators:
+                function = ARRAY_FUNCTIONS.get(type(indicator))
+                if function is None:
+                    streaming.append(indicator)
+                    continue
+                key = (function.__name__, indicator.window, indicator.source)
+                if key not in arrays:
+                    arrays[key] = indicator_values(self.cache, self.candles, indicator)
+                cached.append((indicator, arrays[key]))
+            plans.append((backtester, cached, streaming))
+        return plans
+
+    def run(self, start=0, stop=None):
+        """
+        Backtest all strategies on bars start..stop-1 in one pass.
+        """
+        candles = self.candles
+        n = len(candles)
+        stop = n if stop is None else min(stop, n)
+        plans = self.plan()
+        for backtester in self.strategies:
+            backtester.segment = (start, stop)
+        timeline = candles.datetimes
+        for chunk_start in xrange(start, stop, BACKTEST_CHUNK_SIZE):
+            chunk_stop = min(chunk_start + BACKTEST_CHUNK_SIZE, stop)
+            chunk = zip(xrange(chunk_start, chunk_stop),
+                        as_list(timeline[chunk_start:chunk_stop]),
+                        as_list(candles.open[chunk_start:chunk_stop]),
+                        as_list(candles.close[chunk_start:chunk_stop]),
+                        as_list(candles.high[chunk_start:chunk_stop]),
+                        as_list(candles.low[chunk_start:chunk_stop]))
+            chunk_values = {}
+            chunk_plans = []
+            for backtester, cached, streaming in plans:
+                for _, values in cached:
+                    if id(values) not in chunk_values:
+                        chunk_values[id(values)] = as_values(values[chunk_start:chunk_stop])
+                chunk_plans.append((backtester,
+                                    [(indicator, chunk_values[id(values)])
+                                     for indicator, values in cached],
+                                    streaming))
+            for i, time, candle_open, candle_close, candle_high, candle_low in chunk:
+                k = i - chunk_start
+                for backtester, cached, streaming in chunk_plans:
+                    backtester.set_current_candle(i, time, candle_open, candle_close,
+                                                  candle_high, candle_low)
+                    backtester.close_triggered_orders()
+                    for indicator, values in cached:
+                        indicator.value = values[k]
+                    for indicator in streaming:
+                        indicator.update_candle(candle_open, candle_close,
+                                                candle_high, candle_low)
+                    backtester.strategy(i, candle_open, candle_close, candle_high, candle_low)
+        return self.strategies
+
+    def report(self, i=None):
+        """
+        Statistics of every strategy (at bar i, default: the last bar run)
+        as a DataFrame, one row per strategy.
+        """
+        rows = []
+        for name, backtester in zip(self.names, self.strategies):
+            row = {'strategy': name}
+            row.update(backtester.statistics(i))
+            rows.append(row)
+        return pandas.DataFrame(rows).set_index('strategy')
+
+    def print_statistics(self):
+        for name, backtester in zip(self.names, self.strategies):
+            print name
+            backtester.print_statistics()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Benchmarks of the backtesting engine on synthetic data.
+
+For every size (number of 1 minute bars) a synthetic series is generated
+and each stage is timed -
+1. write_csv / read_csv / load_cached: parsing a CSV, and loading it again
+   from the binary cache (see dataloader.py)
+2. indicators / indicators_vectorized: streaming EMAs updated bar by bar,
+   and ema_array over the whole close column
+3. backtest / backtest_vectorized: Strategy2 on the synthetic candles
+4. order_book: matching a synthetic order load (one bracket order per bar)
+   with OrderBook.pop_triggered
+5. statistics: get_statistics at 1000 bars
+6. plot_prep: per bar profit curve used by plot() / animate()
+along with throughput (bars per second), peak memory (maximum resident set
+size) and per bar latency percentiles of backtest. Each size runs in a
+new process, so peak memory is that of the size alone.
+
+Reports are JSON, and compare() lines up two of them stage by stage -
+
+    python benchmark.py --sizes 10000 100000 1000000 --output new.json
+    python benchmark.py --sizes 10000 100000 --output new.json --compare old.json
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pandas
+
+import events
+from candles import CandleSeries
+from dataloader import load_candles, load_candles_uncached, read_csv
+from indicators import EMA, ema_array
+from order import BuyOrder, SellOrder
+from orderbook import OrderBook
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+BARS_PER_DAY = 375                  # NSE session, 09:15 to 15:30
+SESSION_START = 9 * 3600 + 15 * 60
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+clock = timeit.default_timer
+
+
+def synthetic_candles(n, price=500.0, drift=0.0, volatility=0.001, seed=0,
+                      start='2010-01-04'):
+    """
+    n 1 minute candles of a geometric brownian motion with per bar drift
+    and volatility, in sessions of BARS_PER_DAY bars on business days.
+    Prices are rounded to a 0.05 tick.
+    """
+    rng = np.random.RandomState(seed)
+    returns = drift - 0.5 * volatility ** 2 + volatility * rng.standard_normal(n)
+    close = price * np.exp(np.cumsum(returns))
+    open = np.concatenate([[price], close[:-1]])
+    wick = np.abs(rng.standard_normal((2, n))) * volatility * 0.5
+    high = np.maximum(open, close) * (1 + wick[0])
+    low = np.minimum(open, close) * (1 - wick[1])
+    tick = lambda values: np.round(values * 20) / 20
+    volume = rng.lognormal(10, 1, n).astype(np.int64)
+
+    bars = np.arange(n)
+    days = np.busday_offset(np.datetime64(start, 'D'), bars // BARS_PER_DAY, roll='forward')
+    time = (days.astype('datetime64[s]').astype(np.int64)
+            + SESSION_START + 60 * (bars % BARS_PER_DAY))
+    return CandleSeries(time, tick(open), tick(high), tick(low), tick(close), volume)
+
+
+def synthetic_orders(candles, stop_loss_percent=1.0, target_percent=0.3, seed=0):
+    """
+    A synthetic order load - one bracket order (random side) per bar, as
+    arrays (is_buy, entry_price, stop_loss, target).
+    """
+    rng = np.random.RandomState(seed)
+    is_buy = rng.randint(0, 2, len(candles)).astype(bool)
+    price = candles.close
+    side = np.where(is_buy, 1, -1)
+    stop_loss = price * (1 - side * stop_loss_percent / 100.0)
+    target = price * (1 + side * target_percent / 100.0)
+    return is_buy, price, stop_loss, target
+
+
+def write_csv(candles, path):
+    times = candles.datetimes.astype(str)
+    pandas.DataFrame({'Date': times, 'SYN O': candles.open, 'SYN H': candles.high,
+                      'SYN L': candles.low, 'SYN C': candles.close, 'SYN V': candles.volume},
+                     columns=['Date', 'SYN O', 'SYN H', 'SYN L', 'SYN C', 'SYN V']
+                     ).to_csv(path, index=False)
+
+
+def timed(function, *args):
+    started = clock()
+    result = function(*args)
+    return clock() - started, result
+
+
+def match_order_book(candles, orders):
+    is_buy, price, stop_loss, target = [values.tolist() for values in orders]
+    book = OrderBook()
+    closed = 0
+    for i, high, low in zip(xrange(len(candles)), candles.high.tolist(),
+                            candles.low.tolist()):
+        for order in book.pop_triggered(high, low):
+            order.try_to_close(high, low, i)
+            closed += 1
+        order_class = BuyOrder if is_buy[i] else SellOrder
+        book.append(order_class(price[i], 1, i, stop_loss[i], target[i]))
+    return closed
+
+
+def update_indicators(candles):
+    fast, slow = EMA(3), EMA(15)
+    for value in candles.close.tolist():
+        fast.update(value)
+        slow.update(value)
+
+
+def backtest_latencies(backtester):
+    """
+    backtest() bar by bar, timing every bar.
+    """
+    latencies = np.zeros(len(backtester.candles_close))
+    bars = zip(xrange(len(latencies)), backtester.timeline.tolist(),
+               backtester.candles_open.tolist(), backtester.candles_close.tolist(),
+               backtester.candles_high.tolist(), backtester.candles_low.tolist())
+    backtest_candle = backtester.backtest_candle
+    for bar in bars:
+        started = clock()
+        backtest_candle(*bar)
+        latencies[bar[0]] = clock() - started
+    return latencies
+
+
+def benchmark_size(n, seed=0):
+    """
+    Time every stage on n synthetic bars. Returns a dict of stage: seconds,
+    throughput, latency percentiles and peak memory.
+    """
+    from strategy2 import Strategy2
+    events.set_sink(events.NullSink())
+    stages = {}
+    candles = synthetic_candles(n, seed=seed)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'synthetic.csv')
+        stages['write_csv'], _ = timed(write_csv, candles, path)
+        stages['read_csv'], _ = timed(read_csv, path)
+        load_candles(path)          # creates the cache
+        stages['load_cached'], _ = timed(load_candles_uncached, path, None, None, True, None)
+    finally:
+        shutil.rmtree(directory)
+
+    stages['indicators'], _ = timed(update_indicators, candles)
+    stages['indicators_vectorized'], _ = timed(lambda: (ema_array(candles.close, 3),
+                                                        ema_array(candles.close, 15)))
+
+    backtester = Strategy2(candles=candles)
+    stages['backtest'], _ = timed(backtester.backtest)
+    vectorized = Strategy2(candles=candles)
+    stages['backtest_vectorized'], _ = timed(vectorized.backtest_vectorized)
+    stages['order_book'], closed = timed(match_order_book, candles, synthetic_orders(candles, seed=seed))
+    points = np.linspace(0, n - 1, 1000).astype(int).tolist()
+    stages['statistics'], _ = timed(lambda: [backtester.get_statistics(i) for i in points])
+    stages['plot_prep'], _ = timed(backtester.metrics.realized_curves, n)
+
+    latencies = backtest_latencies(Strategy2(candles=candles))
+    return {'bars': n,
+            'seconds': stages,
+            'bars_per_second': dict((stage, n / seconds if seconds else None)
+                                    for stage, seconds in stages.items()
+                                    if stage not in ('statistics',)),
+            'latency_us': dict(('p%s' % p, value * 1e6) for p, value in
+                               zip(LATENCY_PERCENTILES,
+                                   np.percentile(latencies, LATENCY_PERCENTILES))),
+            'orders': {'backtest': len(backtester.closed_orders) + len(backtester.open_orders),
+                       'order_book_closed': closed},
+            'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, seed=0):
+    """
+    Benchmark every size, each in a new process. Returns the report.
+    """
+    results = []
+    for n in sizes:
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            results.append(pool.apply(benchmark_size, (n, seed)))
+        finally:
+            pool.close()
+            pool.join()
+    return {'revision': revision(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'results': results}
+
+
+def compare(old, new, tolerance=0.1, min_seconds=0.01):
+    """
+    Stage times of two reports side by side, for sizes in both. Returns a
+    DataFrame with the ratio new / old, flagging ratios above
+    1 + tolerance as regressions (except for stages taking under
+    min_seconds, whose timings are mostly noise).
+    """
+    old_results = dict((result['bars'], result) for result in old['results'])
+    rows = []
+    for result in new['results']:
+        if result['bars'] not in old_results:
+            continue
+        previous = old_results[result['bars']]
+        for stage, seconds in sorted(result['seconds'].items()):
+            if stage not in previous['seconds']:
+                continue
+            ratio = seconds / previous['seconds'][stage] if previous['seconds'][stage] else np.nan
+            rows.append({'bars': result['bars'], 'stage': stage,
+                         'old': previous['seconds'][stage], 'new': seconds,
+                         'ratio': ratio,
+                         'regression': ratio > 1 + tolerance and seconds >= min_seconds})
+    return pandas.DataFrame(rows, columns=['bars', 'stage', 'old', 'new', 'ratio', 'regression'])
+
+
+def report_table(report):
+    """
+    Stage times (seconds) of a report, one column per size.
+    """
+    return pandas.DataFrame(dict((result['bars'], result['seconds'])
+                                 for result in report['results']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the backtesting engine')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.seed)
+    print report_table(report)
+    for result in report['results']:
+        print '%d bars: peak memory %.1f MB, backtest latency (us) %s' % (
+            result['bars'], result['peak_memory_mb'],
+            ', '.join('%s %.1f' % item for item in sorted(result['latency_us'].items())))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(json.load(f), report, args.tolerance)
+        print comparison
+        if comparison['regression'].any():
+            sys.exit(1)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Columnar storage for OHLCV candles.
+"""
+
+import numpy as np
+
+
+class CandleSeries(object):
+    """
+    OHLCV candles stored as contiguous numpy columns -
+    1. time: int64, epoch seconds
+    2. open, high, low, close: float64
+    3. volume: int64
+
+    Slicing a CandleSeries (series[a:b]) returns another CandleSeries whose
+    columns are views on the same memory, so a strategy can look at the
+    history up to bar i (series[:i+1]) without copying it.
+    """
+    fields = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time, open, high, low, close, volume=None):
+        self.time = np.ascontiguousarray(time, dtype=np.int64)
+        self.open = np.ascontiguousarray(open, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        if volume is None:
+            volume = np.zeros(len(self.time), dtype=np.int64)
+        self.volume = np.ascontiguousarray(volume, dtype=np.int64)
+
+        for field in self.fields:
+            if len(getattr(self, field)) != len(self.time):
+                raise ValueError('Column %s has %d entries, expected %d'
+                                 % (field, len(getattr(self, field)), len(self.time)))
+
+    @classmethod
+    def from_datetimes(cls, datetimes, open, high, low, close, volume=None):
+        """
+        Create a CandleSeries with a sequence of datetime objects (or a
+        datetime64 array) as timeline.
+        """
+        time = np.asarray(datetimes, dtype='datetime64[s]').astype(np.int64)
+        return cls(time, open, high, low, close, volume)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, key):
+        """
+        series[i] returns candle i as a tuple (time, open, high, low, close,
+        volume). series[a:b] returns a CandleSeries of views.
+        """
+        if isinstance(key, slice):
+            return CandleSeries(*[getattr(self, field)[key] for field in self.fields])
+        return tuple(getattr(self, field)[key] for field in self.fields)
+
+    def __repr__(self):
+        return '<CandleSeries: %d candles>' % len(self)
+
+    @property
+    def datetimes(self):
+        """
+        Timeline as a datetime64[s] array (a view on self.time, no copy).
+        """
+        return self.time.view('datetime64[s]')
+
+    def labels(self, format):
+        """
+        Timestamps formatted with 'format', computed lazily (see TimeLabels).
+        """
+        return TimeLabels(self.datetimes, format)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, field).nbytes for field in self.fields)
+
+
+class TimeLabels(object):
+    """
+    Formatted labels for an array of datetime64 values. Labels are only
+    formatted when accessed, so asking for the few tick labels of a plot
+    (labels[::step]) does not format the whole timeline.
+    """
+    def __init__(self, datetimes, format):
+        self.datetimes = datetimes
+        self.format = format
+
+    def __len__(self):
+        return len(self.datetimes)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [date.strftime(self.format) for date in self.datetimes[key].tolist()]
+        return self.datetimes[key].tolist().strftime(self.format)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Fill and transaction cost models.
+
+A fill model decides the price at which an order whose stop loss or
+target is hit gets closed. A cost model works out the charges of an
+order's round trip (entry and exit), which are deducted from its profit.
+Both are set on a backtest as parameters -
+
+    Strategy2(fill_model=TriggerFill(), cost_model=IndianEquityCosts())
+
+and are used by BuyOrder/SellOrder.try_to_close and by
+backtest_vectorized, which applies them to all orders at once. Models
+work on numpy arrays as well as on single values, so costs of a whole
+trade ledger can also be computed after the fact (ledger_costs), e.g. to
+compare cost assumptions without rerunning backtests.
+"""
+
+import numpy as np
+
+from parameters import set_parameters
+
+
+class FillModel(object):
+    """
+    Fills at the candle extreme - candle_low for a buy order's stop loss
+    and a sell order's target, candle_high otherwise. This is how orders
+    have always been filled, and what try_to_close does without a fill
+    model.
+    """
+    def exit_price(self, is_buy, stop_loss_hit, stop_loss, target,
+                   candle_high, candle_low, time=None):
+        """
+        Exit price of orders closed by a candle (at time, the candle's
+        entry in the timeline). stop_loss_hit tells which trigger closed
+        them (the stop loss is checked first).
+        """
+        return np.where(is_buy == stop_loss_hit, candle_low, candle_high)
+
+
+class TriggerFill(FillModel):
+    """
+    Fills at the trigger price, or at the candle's extreme nearest to it
+    if the whole candle is beyond the trigger (the price gapped through
+    it). Orders closed by a missing trigger (None, NaN or -inf) fill at
+    the candle extreme.
+    """
+    def exit_price(self, is_buy, stop_loss_hit, stop_loss, target,
+                   candle_high, candle_low, time=None):
+        trigger = np.asarray(np.where(stop_loss_hit, stop_loss, target), dtype=np.float64)
+        return np.where(np.isfinite(trigger),
+                        np.clip(trigger, candle_low, candle_high),
+                        FillModel.exit_price(self, is_buy, stop_loss_hit, stop_loss, target,
+                                             candle_high, candle_low))
+
+
+class SlippageFill(FillModel):
+    """
+    Fills of another fill model (default: trigger price) made worse by
+    'slippage_percent' of the price - lower when selling to exit a buy
+    order, higher when buying to exit a sell order.
+    """
+    def __init__(self, slippage_percent=0.05, fill_model=None):
+        self.slippage_percent = slippage_percent
+        self.fill_model = TriggerFill() if fill_model is None else fill_model
+
+    def exit_price(self, is_buy, stop_loss_hit, stop_loss, target,
+                   candle_high, candle_low, time=None):
+        price = self.fill_model.exit_price(is_buy, stop_loss_hit, stop_loss, target,
+                                           candle_high, candle_low, time)
+        return price * (1 - np.where(is_buy, 1, -1) * self.slippage_percent / 100.0)
+
+
+class CostModel(object):
+    """
+    Costs of orders' round trips. Override leg_costs.
+    """
+    def leg_costs(self, is_buy_leg, quantity, price):
+        """
+        Charges of buying (is_buy_leg) or selling quantity at price.
+        """
+        return np.zeros(np.broadcast(is_buy_leg, quantity, price).shape)
+
+    def costs(self, is_buy, quantity, entry_price, exit_price):
+        """
+        Total charges of entering and exiting orders. A buy order buys on
+        entry and sells on exit, a sell order the other way round.
+        """
+        is_buy = np.asarray(is_buy, dtype=bool)
+        return (self.leg_costs(is_buy, quantity, entry_price)
+                + self.leg_costs(~is_buy, quantity, exit_price))
+
+    def order_costs(self, order, exit_price):
+        """
+        Round trip charges of an order exiting at exit_price, as a float.
+        """
+        return float(self.costs(order.side > 0, order.quantity,
+                                order.entry_price, exit_price))
+
+
+class IndianEquityCosts(CostModel):
+    """
+    Charges of trading NSE equity - brokerage, STT, exchange transaction
+    charges, SEBI fees, stamp duty, GST, plus slippage as a cost.
+    Rates are parameters (percent of turnover unless noted); defaults are
+    those of a discount broker, for intraday trades, or delivery trades
+    with delivery=True.
+    """
+    brokerage_percent = 0.03
+    max_brokerage = 20.0            # Rs per executed order
+    exchange_percent = 0.00345      # NSE transaction charges
+    sebi_percent = 0.0001           # Rs 10 per crore
+    gst_percent = 18.0              # on brokerage, exchange and SEBI charges
+    slippage_percent = 0.0
+
+    intraday_stt_sell_percent = 0.025
+    intraday_stamp_buy_percent = 0.003
+    delivery_stt_percent = 0.1      # both sides
+    delivery_stamp_buy_percent = 0.015
+    delivery_brokerage_percent = 0.0
+
+    def __init__(self, delivery=False, **params):
+        self.delivery = delivery
+        set_parameters(self, params)
+
+    def leg_costs(self, is_buy_leg, quantity, price):
+        is_buy_leg = np.asarray(is_buy_leg, dtype=bool)
+        turnover = np.asarray(quantity, dtype=np.float64) * price
+        if self.delivery:
+            brokerage = np.minimum(turnover * self.delivery_brokerage_percent / 100.0,
+                                   self.max_brokerage)
+            stt = turnover * self.delivery_stt_percent / 100.0
+            stamp = np.where(is_buy_leg, turnover * self.delivery_stamp_buy_percent / 100.0, 0.0)
+        else:
+            brokerage = np.minimum(turnover * self.brokerage_percent / 100.0,
+                                   self.max_brokerage)
+            stt = np.where(is_buy_leg, 0.0, turnover * self.intraday_stt_sell_percent / 100.0)
+            stamp = np.where(is_buy_leg, turnover * self.intraday_stamp_buy_percent / 100.0, 0.0)
+        exchange = turnover * self.exchange_percent / 100.0
+        sebi = turnover * self.sebi_percent / 100.0
+        gst = (brokerage + exchange + sebi) * self.gst_percent / 100.0
+        slippage = turnover * self.slippage_percent / 100.0
+        return brokerage + stt + exchange + sebi + stamp + gst + slippage
+
+
+def ledger_costs(ledger, cost_model):
+    """
+    Round trip costs of every order in a TradeLedger, computed at once.
+    """
+    return cost_model.costs(ledger.column('side') > 0, ledger.column('quantity'),
+                            ledger.column('entry_price'), ledger.column('exit_price'))
+
+
+def net_profit(ledger, cost_model):
+    """
+    Profit and profit percent of every order in a ledger of costless
+    orders, after costs of cost_model.
+    """
+    profit = ledger.column('profit') - ledger_costs(ledger, cost_model)
+    return profit, 100.0 * profit / ledger.column('quantity') / ledger.column('entry_price')
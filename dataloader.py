@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Loading OHLCV data from CSV files into a CandleSeries.
+
+Parsing a large CSV is slow, so the first load of a file writes its columns
+in numpy's binary .npy format into a cache directory next to it
+('<file>.cache'). Later loads memory-map these columns, which takes
+milliseconds irrespective of the file size. The cache is rebuilt whenever
+the source file changes (detected by size, mtime and, if only the mtime
+differs, a SHA-1 of its contents).
+
+Timestamps are parsed in bulk. The format is detected once from a sample
+of values, and purely numeric formats (like '%d/%m/%y %H:%M') are parsed
+with numpy operations over the whole column instead of one strptime per
+row.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas
+
+import events
+from candles import CandleSeries
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache'
+META_FILE = 'meta.json'
+
+# Candles loaded by load_candles in this process -
+# {key: (source_info, CandleSeries)}
+loaded_candles = {}
+
+# Formats tried (in this order) when detecting the timestamp format.
+# Day first formats come before month first ones, as in Indian market data.
+DATE_FORMATS = (
+    '%d/%m/%y %H:%M',
+    '%d/%m/%y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d-%m-%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M',
+    '%m/%d/%y %H:%M',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%Y%m%d %H:%M:%S',
+    '%d-%b-%Y %H:%M',
+    '%d-%b-%y %H:%M',
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%d/%m/%y',
+    '%d-%b-%Y',
+)
+DATE_FORMAT_SAMPLES = 100
+
+# strptime directives which parse_datetimes handles with numpy
+NUMERIC_DIRECTIVES = 'dmyYHMS'
+
+# Header names recognised for each column (compared in lower case), and
+# suffixes used by exports like 'TATASTEEL-EQ O'
+COLUMN_NAMES = {
+    'time': ('date', 'time', 'datetime', 'timestamp'),
+    'open': ('open', 'o'),
+    'high': ('high', 'h'),
+    'low': ('low', 'l'),
+    'close': ('close', 'c'),
+    'volume': ('volume', 'v'),
+}
+
+
+def detect_columns(header):
+    """
+    Map each of 'time', 'open', 'high', 'low', 'close', 'volume' to a
+    column name in header. 'volume' is optional.
+    """
+    columns = {}
+    for name in header:
+        key = name.strip().lower()
+        for field, aliases in COLUMN_NAMES.iteritems():
+            if field in columns:
+                continue
+            if key in aliases or key.rsplit(' ', 1)[-1] in aliases:
+                columns[field] = name
+                break
+    for field in ('time', 'open', 'high', 'low', 'close'):
+        if field not in columns:
+            raise ValueError('Could not find %s column in %s' % (field, header))
+    return columns
+
+
+def file_hash(path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def detect_date_format(values):
+    """
+    Return the first of DATE_FORMATS which parses an evenly spread sample
+    of values.
+    """
+    step = max(1, len(values) // DATE_FORMAT_SAMPLES)
+    samples = [str(value).strip() for value in values[::step]]
+    for date_format in DATE_FORMATS:
+        try:
+            for sample in samples:
+                dt.datetime.strptime(sample, date_format)
+        except ValueError:
+            continue
+        return date_format
+    raise ValueError('Unknown timestamp format: %r' % samples[0])
+
+
+def split_numbers(strings, count):
+    """
+    Split every string of a bytes array (dtype 'S') into runs of digits,
+    returning an int64 array of shape (len(strings), count). Returns None
+    if some string does not have exactly 'count' numbers.
+
+    Works on the raw characters as a 2D uint8 array, one character
+    position at a time, so the python overhead is per column of
+    characters instead of per string.
+    """
+    n = len(strings)
+    chars = strings.view(np.uint8).reshape(n, strings.itemsize)
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    starts = is_digit.copy()
+    starts[:, 1:] &= ~is_digit[:, :-1]
+    if (starts.sum(axis=1) != count).any():
+        return None
+    token = np.cumsum(starts, axis=1) - 1
+
+    numbers = np.zeros((n, count), dtype=np.int64)
+    rows = np.arange(n)
+    for j in xrange(strings.itemsize):
+        digit = is_digit[:, j]
+        r = rows[digit]
+        t = token[digit, j]
+        numbers[r, t] = numbers[r, t] * 10 + (chars[digit, j] - ord('0'))
+    return numbers
+
+
+def parse_numeric_datetimes(values, date_format):
+    """
+    Parse values with a format made only of NUMERIC_DIRECTIVES.
+    Returns a datetime64[s] array, or None if values do not fit the format.
+    """
+    directives = re.findall('%(.)', date_format)
+    numbers = split_numbers(np.asarray(values, dtype='S'), len(directives))
+    if numbers is None:
+        return None
+    fields = dict((directive, numbers[:, k]) for k, directive in enumerate(directives))
+    n = len(numbers)
+    zeros = np.zeros(n, dtype=np.int64)
+
+    if 'Y' in fields:
+        years = fields['Y']
+    else:
+        # Same pivot as strptime: 69-99 -> 1969-1999, 0-68 -> 2000-2068
+        years = fields['y'] + np.where(fields['y'] < 69, 2000, 1900)
+    months = fields.get('m', zeros + 1)
+    days = fields.get('d', zeros + 1)
+    hours = fields.get('H', zeros)
+    minutes = fields.get('M', zeros)
+    seconds = fields.get('S', zeros)
+    if ((months < 1) | (months > 12) | (days < 1) | (days > 31) | (hours > 23) |
+            (minutes > 59) | (seconds > 61)).any():
+        return None
+
+    dates = (years - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+    dates = (dates + (months - 1).astype('timedelta64[M]')).astype('datetime64[D]')
+    # Reject days which overflow into the next month (like 31/06)
+    if ((dates + (days - 1).astype('timedelta64[D]')).astype('datetime64[M]') !=
+            dates.astype('datetime64[M]')).any():
+        return None
+    dates = dates + (days - 1).astype('timedelta64[D]')
+    return dates.astype('datetime64[s]') + (hours * 3600 + minutes * 60 + seconds).astype('timedelta64[s]')
+
+
+def parse_datetimes(values, date_format=None):
+    """
+    Parse a column of timestamps into a datetime64[s] array.
+    The format is detected if date_format is None. Numeric columns are
+    taken as epoch seconds (or milliseconds, if too large for seconds).
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iuf':
+        epochs = values.astype(np.int64)
+        if len(epochs) and np.abs(epochs).max() > 10**11:
+            epochs = epochs // 1000
+        return epochs.astype('datetime64[s]')
+
+    if date_format is None:
+        date_format = detect_date_format(values)
+    if all(directive in NUMERIC_DIRECTIVES
+           for directive in re.findall('%(.)', date_format)):
+        datetimes = parse_numeric_datetimes(values, date_format)
+        if datetimes is not None:
+            return datetimes
+    # Not a numeric format (or some values do not fit it) - let pandas
+    # parse it, which also reports values that cannot be parsed.
+    return pandas.to_datetime(values, format=date_format).values.astype('datetime64[s]')
+
+
+def read_csv(path, date_format=None, columns=None):
+    """
+    Parse an OHLCV CSV file into a CandleSeries in ascending time order.
+    The timestamp format is detected if date_format is None.
+    """
+    csv = pandas.read_csv(path)
+    if columns is None:
+        columns = detect_columns(csv.columns)
+    data = [parse_datetimes(csv[columns['time']].values, date_format).astype(np.int64),
+            csv[columns['open']].values,
+            csv[columns['high']].values,
+            csv[columns['low']].values,
+            csv[columns['close']].values,
+            csv[columns['volume']].values if 'volume' in columns else None]
+
+    # Files with latest candle first are reversed with views, so that the
+    # only copy made is the one into the CandleSeries columns.
+    if len(data[0]) > 1 and data[0][0] > data[0][-1]:
+        data = [None if column is None else column[::-1] for column in data]
+    return CandleSeries(*data)
+
+
+def source_info(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_cache(path, cache_dir, date_format=None, columns=None):
+    """
+    Memory-map cached columns of path. Returns None if cache is missing,
+    stale or was parsed with a different date_format or columns.
+    """
+    try:
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    if meta.get('date_format') != date_format or meta.get('columns') != columns:
+        return None
+
+    info = source_info(path)
+    if info['size'] != meta['size']:
+        return None
+    if info['mtime'] != meta['mtime']:
+        if file_hash(path) != meta['sha1']:
+            return None
+        # Contents are unchanged (file was touched or copied). Remember the
+        # new mtime to avoid hashing the file again next time.
+        meta['mtime'] = info['mtime']
+        try:
+            with open(os.path.join(cache_dir, META_FILE), 'w') as f:
+                json.dump(meta, f)
+        except IOError:
+            pass
+
+    try:
+        columns = [np.load(os.path.join(cache_dir, field + '.npy'), mmap_mode='r')
+                   for field in CandleSeries.fields]
+    except IOError:
+        return None
+    return CandleSeries(*columns)
+
+
+def write_cache(path, cache_dir, candles, date_format=None, columns=None):
+    """
+    Write columns of candles into cache_dir. meta.json is written last, so
+    an interrupted write leaves no valid cache behind. date_format and
+    columns are the read_csv options the candles were parsed with.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for field in CandleSeries.fields:
+        np.save(os.path.join(cache_dir, field + '.npy'), getattr(candles, field))
+
+    meta = source_info(path)
+    meta['sha1'] = file_hash(path)
+    meta['version'] = CACHE_VERSION
+    meta['candles'] = len(candles)
+    meta['date_format'] = date_format
+    meta['columns'] = columns
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(meta_path + '.tmp', meta_path)
+
+
+def load_candles(path, date_format=None, columns=None,
+                 cache=True, cache_dir=None):
+    """
+    Load an OHLCV CSV file as a CandleSeries (ascending time order).
+    The timestamp format is detected if date_format is None.
+
+    With cache=True, columns are memory-mapped from the binary cache
+    (default '<path>.cache'), which is created or refreshed as needed, and
+    rebuilt if it was parsed with a different date_format or columns.
+    Memory-mapped columns are read-only.
+
+    Loaded candles are remembered for as long as the file is unchanged, so
+    loading the same file again in this process (or in a process forked
+    from it, like optimizer workers) returns the same CandleSeries.
+    """
+    key = (os.path.abspath(path), date_format,
+           None if columns is None else tuple(sorted(columns.items())),
+           cache, cache_dir)
+    info = source_info(path)
+    if key in loaded_candles and loaded_candles[key][0] == info:
+        return loaded_candles[key][1]
+    candles = load_candles_uncached(path, date_format, columns, cache, cache_dir)
+    loaded_candles[key] = (info, candles)
+    return candles
+
+
+def load_candles_uncached(path, date_format, columns, cache, cache_dir):
+    if not cache:
+        return read_csv(path, date_format, columns)
+
+    if cache_dir is None:
+        cache_dir = path + CACHE_SUFFIX
+    candles = read_cache(path, cache_dir, date_format, columns)
+    if candles is not None:
+        return candles
+
+    candles = read_csv(path, date_format, columns)
+    try:
+        write_cache(path, cache_dir, candles, date_format, columns)
+    except (IOError, OSError) as e:
+        events.sink.log(events.WARNING, 'WARNING: Could not write cache for %s: %s', path, e)
+        return candles
+    return read_cache(path, cache_dir, date_format, columns) or candles
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Event logging for orders and strategies.
+
+Messages are logged as a format string plus arguments -
+    events.sink.log(events.INFO, 'Buying %d@%f', quantity, price)
+and are only formatted by sinks which actually display them, so a
+backtest run with a NullSink (or with a level above INFO) pays little
+more than a function call per event.
+
+The current sink is the module level 'sink'. Always refer to it as
+events.sink, as set_sink replaces it.
+"""
+
+import json
+import sys
+
+# Levels
+DEBUG = 10
+INFO = 20           # order and strategy events
+WARNING = 30
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING'}
+
+
+class Sink(object):
+    """
+    Base class for sinks. Events below self.level are dropped.
+    """
+    level = INFO
+
+    def __init__(self, level=None):
+        if level is not None:
+            self.level = level
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        if level >= self.level:
+            self.write(level, message, args)
+
+    def write(self, level, message, args):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(Sink):
+    """
+    Drops every event.
+    """
+    level = float('inf')
+
+    def log(self, level, message, *args):
+        pass
+
+
+class TextSink(Sink):
+    """
+    Writes formatted, human readable events to a stream - sys.stdout (as
+    it is at the time of writing) by default.
+    """
+    def __init__(self, stream=None, level=None):
+        Sink.__init__(self, level)
+        self.stream = stream
+
+    def write(self, level, message, args):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write((message % args if args else message) + '\n')
+
+    def flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.flush()
+
+
+class MemorySink(Sink):
+    """
+    Keeps unformatted events in memory. messages() formats them on demand.
+    """
+    def __init__(self, level=None):
+        Sink.__init__(self, level)
+        self.events = []
+
+    def write(self, level, message, args):
+        self.events.append((level, message, args))
+
+    def messages(self, level=DEBUG):
+        return [message % args if args else message
+                for event_level, message, args in self.events
+                if event_level >= level]
+
+
+class JSONLSink(Sink):
+    """
+    Writes events to a file as JSON lines {"level", "message", "args"},
+    unformatted and in batches of 'buffer_size' events. Read them back,
+    formatted, with read_jsonl.
+    """
+    def __init__(self, path, level=None, buffer_size=10000):
+        Sink.__init__(self, level)
+        self.file = open(path, 'w')
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def write(self, level, message, args):
+        self.buffer.append((level, message, args))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(''.join(json.dumps({'level': level, 'message': message, 'args': args},
+                                               default=str) + '\n'
+                                    for level, message, args in self.buffer))
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_jsonl(path, level=DEBUG):
+    """
+    Formatted messages of a file written by JSONLSink.
+    """
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            if event['level'] >= level:
+                args = tuple(event['args'])
+                yield event['message'] % args if args else event['message']
+
+
+sink = TextSink()
+
+
+def set_sink(new_sink):
+    """
+    Make new_sink the current sink, returning the previous one.
+    """
+    global sink
+    previous = sink
+    sink = new_sink
+    return previous
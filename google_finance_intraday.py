@@ -1,16 +1,179 @@
-#!/usr/bin/env python 
+#!/usr/bin/env python
 """
 Retrieve intraday stock data from Google Finance.
 """
 
-import csv
 import datetime
-import re
+import json
+import os
+from multiprocessing.pool import ThreadPool
 
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-def get_intraday(ticker, period=60, days=1):
+URL = 'http://www.google.com/finance/getprices'
+COLUMNS = ['Close', 'High', 'Low', 'Open', 'Volume']
+TIMEOUT = 10        # seconds, for connecting and for reading
+
+_session = None
+
+
+def make_session(pool_size=16, retries=3, backoff_factor=0.5):
+    """
+    Create a requests.Session with a connection pool of pool_size
+    connections per host, which retries failed connections and 5xx
+    responses with exponential backoff.
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def http_get(url, params=None, timeout=TIMEOUT):
+    """
+    Default HTTP layer - GET url on a shared, pooled session and return the
+    response body. Any function with this signature can be passed as
+    http_get to the functions below, e.g. to use a stub in tests.
+    """
+    global _session
+    if _session is None:
+        _session = make_session()
+    response = _session.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_prices(ticker, period=60, days=1, http_get=http_get, url=URL):
+    """
+    Raw getprices response for a ticker.
+    """
+    return http_get(url, params={'i': period, 'p': '%dd' % days,
+                                 'f': 'd,o,h,l,c,v', 'df': 'cpct', 'q': ticker})
+
+
+def parse_prices(content, period):
+    """
+    Parse a getprices response.
+
+    Rows start with either 'a<epoch seconds>' (an anchor, usually the first
+    bar of a day) or the number of periods since the last anchor. Rows are
+    split and converted with numpy at once rather than one by one.
+
+    Returns
+    -------
+    times : numpy.ndarray
+        datetime64[s] local time of each bar.
+    values : numpy.ndarray
+        (bars, 5) array of Close, High, Low, Open and Volume.
+    """
+    lines = [line for line in content.splitlines()
+             if line[:1] == 'a' or line[:1].isdigit()]
+    if not lines:
+        return np.zeros(0, dtype='datetime64[s]'), np.zeros((0, len(COLUMNS)))
+
+    heads, tails = zip(*[line.split(',', 1) for line in lines])
+    values = np.array(','.join(tails).split(','), dtype=np.float64).reshape(len(lines), -1)
+
+    is_anchor = np.array([head[0] == 'a' for head in heads])
+    offsets = np.array([0 if head[0] == 'a' else int(head) for head in heads], dtype=np.int64)
+    anchor_rows = np.flatnonzero(is_anchor)
+    anchors = [int(heads[row][1:]) for row in anchor_rows]
+    # Local time of each anchor, as fromtimestamp gives it
+    anchors = np.array([(datetime.datetime.fromtimestamp(anchor)
+                         - datetime.datetime(1970, 1, 1)).total_seconds()
+                        for anchor in anchors], dtype=np.int64)
+
+    # Rows before the first anchor have nothing to count from
+    first = anchor_rows[0] if len(anchor_rows) else len(lines)
+    anchor_of_row = np.cumsum(is_anchor)[first:] - 1
+    times = anchors[anchor_of_row] + period * offsets[first:]
+    return times.astype('datetime64[s]'), values[first:]
+
+
+def to_dataframe(times, values):
+    if len(times):
+        return pd.DataFrame(values, index=pd.DatetimeIndex(times, name='Date'),
+                            columns=COLUMNS)
+    else:
+        return pd.DataFrame([], index=pd.DatetimeIndex([], name='Date'))
+
+
+class IntradayCache(object):
+    """
+    Bars on disk, one file per ticker, period and day -
+        <cache_dir>/<ticker>/<period>/<YYYY-MM-DD>.npz
+    plus meta.json recording when each ticker/period was last fetched, so
+    that later requests only fetch the days since then.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def directory(self, ticker, period):
+        return os.path.join(self.cache_dir, ticker, str(period))
+
+    def days(self, ticker, period):
+        directory = self.directory(ticker, period)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.npz'))
+
+    def last_fetched(self, ticker, period):
+        path = os.path.join(self.directory(ticker, period), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return datetime.datetime.strptime(json.load(f)['last_fetched'], '%Y-%m-%d').date()
+
+    def read(self, ticker, period, days):
+        """
+        Bars of the last 'days' cached days.
+        """
+        directory = self.directory(ticker, period)
+        times, values = [], []
+        for day in self.days(ticker, period)[-days:]:
+            data = np.load(os.path.join(directory, day + '.npz'))
+            times.append(data['times'])
+            values.append(data['values'])
+        if not times:
+            return np.zeros(0, dtype='datetime64[s]'), np.zeros((0, len(COLUMNS)))
+        return np.concatenate(times), np.concatenate(values)
+
+    def write(self, ticker, period, times, values, fetched_on):
+        """
+        Merge bars into their day files - bars already cached are replaced
+        by the newly fetched ones.
+        """
+        directory = self.directory(ticker, period)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        days = times.astype('datetime64[D]')
+        for day in np.unique(days):
+            path = os.path.join(directory, str(day) + '.npz')
+            new = days == day
+            day_times, day_values = times[new], values[new]
+            if os.path.exists(path):
+                old = np.load(path)
+                keep = ~np.in1d(old['times'], day_times)
+                day_times = np.concatenate([old['times'][keep], day_times])
+                day_values = np.concatenate([old['values'][keep], day_values])
+                order = np.argsort(day_times, kind='mergesort')
+                day_times, day_values = day_times[order], day_values[order]
+            temporary = path + '.tmp.npz'
+            np.savez(temporary, times=day_times, values=day_values)
+            os.rename(temporary, path)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'last_fetched': fetched_on.isoformat()}, f)
+
+
+def get_intraday(ticker, period=60, days=1, http_get=http_get, cache_dir=None, url=URL):
     """
     Retrieve intraday stock data from Google Finance.
 
@@ -22,6 +185,13 @@ def get_intraday(ticker, period=60, days=1):
         Interval between stock values in seconds.
     days : int
         Number of days of data to retrieve.
+    http_get : function
+        HTTP layer, see http_get.
+    cache_dir : str
+        If given, bars are cached on disk there (see IntradayCache) and only
+        the days since the last fetch are downloaded.
+    url : str
+        getprices endpoint.
 
     Returns
     -------
@@ -30,26 +200,57 @@ def get_intraday(ticker, period=60, days=1):
         closing price, and volume. The index contains the times associated with
         the retrieved price values.
     """
+    if cache_dir is None:
+        return to_dataframe(*parse_prices(fetch_prices(ticker, period, days, http_get, url),
+                                          period))
 
-    uri = 'http://www.google.com/finance/getprices' \
-          '?i={period}&p={days}d&f=d,o,h,l,c,v&df=cpct&q={ticker}'.format(ticker=ticker,
-                                                                          period=period,
-                                                                          days=days)
-    page = requests.get(uri)
-    reader = csv.reader(page.content.splitlines())
-    columns = ['Close', 'High', 'Low', 'Open', 'Volume']
-    rows = []
-    times = []
-    for row in reader:
-        if re.match('^[a\d]', row[0]):
-            if row[0].startswith('a'):
-                start = datetime.datetime.fromtimestamp(int(row[0][1:]))
-                times.append(start)
-            else:
-                times.append(start+datetime.timedelta(seconds=period*int(row[0])))
-            rows.append(map(float, row[1:]))
-    if len(rows):
-        return pd.DataFrame(rows, index=pd.DatetimeIndex(times, name='Date'),
-                            columns=columns)
-    else:
-        return pd.DataFrame(rows, index=pd.DatetimeIndex(times, name='Date'))
+    cache = IntradayCache(cache_dir)
+    today = datetime.date.today()
+    last_fetched = cache.last_fetched(ticker, period)
+    fetch_days = days
+    if last_fetched is not None and len(cache.days(ticker, period)) >= days:
+        # Top up - the day of the last fetch may have been incomplete
+        fetch_days = min(days, (today - last_fetched).days + 1)
+    times, values = parse_prices(fetch_prices(ticker, period, fetch_days, http_get, url), period)
+    cache.write(ticker, period, times, values, today)
+    return to_dataframe(*cache.read(ticker, period, days))
+
+
+def get_intraday_batch(tickers, period=60, days=1, http_get=http_get, cache_dir=None,
+                       url=URL, threads=8, errors='raise'):
+    """
+    Retrieve intraday stock data of many tickers concurrently.
+
+    Parameters
+    ----------
+    tickers : list of str
+        Company ticker symbols.
+    period, days, http_get, cache_dir, url
+        See get_intraday.
+    threads : int
+        Number of concurrent requests. The default http_get shares one
+        pooled session between them.
+    errors : str
+        'raise' to raise the first error, 'ignore' to leave tickers which
+        failed out of the result.
+
+    Returns
+    -------
+    data : dict
+        Ticker to DataFrame, see get_intraday.
+    """
+    def fetch(ticker):
+        try:
+            return ticker, get_intraday(ticker, period, days, http_get, cache_dir, url)
+        except Exception:
+            if errors == 'raise':
+                raise
+            return ticker, None
+
+    pool = ThreadPool(min(threads, len(tickers)) or 1)
+    try:
+        results = pool.map(fetch, tickers)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((ticker, df) for ticker, df in results if df is not None)
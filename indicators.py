@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Streaming (incremental) technical indicators.
+
+Every indicator keeps just enough state to update itself with one new candle
+at a time, so the cost of an update does not grow with the length of the
+history already seen. Register indicators with
+AlgoTradingBacktesting.add_indicator and read their 'value' attribute
+inside strategy().
+
+Array versions (sma_array, ema_array, crossover_array) compute the same
+values over a whole column at once, for the vectorized backtest mode.
+
+SMA, EMA and WMA also accept numpy arrays in update() and then work
+elementwise, e.g. on one value per symbol of a portfolio (see
+portfolio.py). CrossoverArray is the elementwise Crossover.
+"""
+
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from itertools import islice
+import math
+
+import numpy as np
+
+
+class Indicator(object):
+    """
+    Base class for streaming indicators.
+
+    'source' is the candle field fed to update() - one of 'open', 'close',
+    'high' or 'low'. 'value' is None until enough candles have been seen.
+    """
+    __metaclass__ = ABCMeta
+    source = 'close'
+
+    def __init__(self, source=None):
+        if source is not None:
+            self.source = source
+        self.value = None
+
+    @abstractmethod
+    def update(self, value):
+        """
+        Feed one value to the indicator and return the updated 'value'.
+        """
+
+    def update_candle(self, candle_open, candle_close, candle_high, candle_low):
+        """
+        Feed one candle to the indicator. Called by the backtesting engine.
+        """
+        if self.source == 'close':
+            return self.update(candle_close)
+        elif self.source == 'open':
+            return self.update(candle_open)
+        elif self.source == 'high':
+            return self.update(candle_high)
+        elif self.source == 'low':
+            return self.update(candle_low)
+        raise ValueError('Unknown indicator source: %s' % self.source)
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+
+class SMA(Indicator):
+    """
+    Simple Moving Average over the last 'window' values.
+    Gives the same result as sum(data[-window:]) / float(window).
+    """
+    def __init__(self, window, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.values = deque(maxlen=window)
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) == self.window:
+            self.value = sum(self.values) / float(self.window)
+        return self.value
+
+
+class EMA(Indicator):
+    """
+    Exponential Moving Average, as computed by the strategies' ema() helper:
+    seeded with the SMA of the 'window' values preceding the last 'window'
+    values, then smoothed over the last 'window' values.
+
+    Only the last 2*window values are kept, so an update costs O(window)
+    irrespective of how many candles have been seen, and the result is
+    bit for bit identical to ema(data[:i+1], window).
+
+    The seed moves with the window, so this is a windowed filter rather than
+    the usual recursive EMA: the previous value cannot be carried forward in
+    O(1) without subtracting the dropped values' weighted contributions,
+    which would accumulate rounding error and could flip crossovers.
+    """
+    def __init__(self, window, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.c = 2.0 / (window + 1)
+        self.values = deque(maxlen=2*window)
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) == 2*self.window:
+            window = self.window
+            c = self.c
+            values = self.values
+            current_ema = sum(islice(values, window)) / float(window)
+            for value in islice(values, window, None):
+                current_ema = (c * value) + ((1 - c) * current_ema)
+            self.value = current_ema
+        return self.value
+
+
+class WMA(Indicator):
+    """
+    Linearly Weighted Moving Average over the last 'window' values
+    (most recent value has weight 'window', oldest has weight 1).
+    """
+    def __init__(self, window, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.denominator = window * (window + 1) / 2.0
+        self.values = deque(maxlen=window)
+        self.total = 0.0          # sum of values in window
+        self.numerator = 0.0      # weighted sum of values in window
+
+    def update(self, value):
+        if len(self.values) == self.window:
+            self.numerator += self.window * value - self.total
+            self.total += value - self.values[0]
+        else:
+            self.numerator += (len(self.values) + 1) * value
+            self.total += value
+        self.values.append(value)
+        if len(self.values) == self.window:
+            self.value = self.numerator / self.denominator
+        return self.value
+
+
+class RSI(Indicator):
+    """
+    Relative Strength Index using Wilder's smoothing.
+    """
+    def __init__(self, window=14, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.prev = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+
+    def update(self, value):
+        if self.prev is None:
+            self.prev = value
+            return self.value
+        change = value - self.prev
+        self.prev = value
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+
+        self.count += 1
+        if self.count <= self.window:
+            # Seed averages with plain mean of first 'window' changes
+            self.avg_gain += gain / self.window
+            self.avg_loss += loss / self.window
+            if self.count < self.window:
+                return self.value
+        else:
+            self.avg_gain = (self.avg_gain * (self.window - 1) + gain) / self.window
+            self.avg_loss = (self.avg_loss * (self.window - 1) + loss) / self.window
+
+        if self.avg_loss == 0:
+            self.value = 100.0
+        else:
+            self.value = 100.0 - 100.0 / (1 + self.avg_gain / self.avg_loss)
+        return self.value
+
+
+class ATR(Indicator):
+    """
+    Average True Range using Wilder's smoothing.
+    Unlike other indicators, needs high, low and close of every candle.
+    """
+    def __init__(self, window=14):
+        Indicator.__init__(self)
+        self.window = window
+        self.prev_close = None
+        self.count = 0
+        self.total = 0.0
+
+    def update_candle(self, candle_open, candle_close, candle_high, candle_low):
+        return self.update(candle_high, candle_low, candle_close)
+
+    def update(self, candle_high, candle_low, candle_close):
+        if self.prev_close is None:
+            true_range = candle_high - candle_low
+        else:
+            true_range = max(candle_high - candle_low,
+                             abs(candle_high - self.prev_close),
+                             abs(candle_low - self.prev_close))
+        self.prev_close = candle_close
+
+        self.count += 1
+        if self.count < self.window:
+            self.total += true_range
+        elif self.count == self.window:
+            self.total += true_range
+            self.value = self.total / self.window
+        else:
+            self.value = (self.value * (self.window - 1) + true_range) / self.window
+        return self.value
+
+
+class BollingerBands(Indicator):
+    """
+    Bollinger Bands - SMA(window) +/- k standard deviations.
+    'value' is a tuple (lower band, middle band, upper band).
+    """
+    def __init__(self, window=20, k=2.0, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.k = k
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def update(self, value):
+        if len(self.values) == self.window:
+            oldest = self.values[0]
+            self.total -= oldest
+            self.total_squares -= oldest * oldest
+        self.values.append(value)
+        self.total += value
+        self.total_squares += value * value
+        if len(self.values) == self.window:
+            mean = self.total / self.window
+            variance = max(self.total_squares / self.window - mean * mean, 0.0)
+            deviation = self.k * math.sqrt(variance)
+            self.value = (mean - deviation, mean, mean + deviation)
+        return self.value
+
+
+class Crossover(object):
+    """
+    Detects crossover of two series, same as the strategies' crossover().
+    update(val1, val2) returns 1 when val1 crosses above val2,
+    -1 when val1 crosses below val2 and 0 otherwise. Never triggers on the
+    first call.
+    """
+    def __init__(self):
+        self.prev_val1 = 0
+        self.prev_val2 = 0
+        self.value = 0
+
+    def update(self, val1, val2):
+        cmp1 = cmp(val1, val2)
+        cmp2 = cmp(self.prev_val1, self.prev_val2)
+        if (not (self.prev_val1 == 0 and self.prev_val2 == 0)):         # don't trigger crossover when called first time
+            if cmp1 > cmp2:
+                self.value = 1
+            elif cmp1 < cmp2:
+                self.value = -1
+            else:
+                self.value = 0
+        else:
+            self.value = 0
+        self.prev_val1, self.prev_val2 = val1, val2
+        return self.value
+
+
+class CrossoverArray(object):
+    """
+    Elementwise Crossover of two arrays, e.g. one value per symbol in
+    portfolio.PortfolioBacktesting. value holds 1, -1 or 0 per element.
+    Elements where either input is NaN give 0 and keep their previous
+    state.
+    """
+    def __init__(self):
+        self.prev_cmps = None
+        self.value = None
+
+    def update(self, val1, val2):
+        val1 = np.asarray(val1, dtype=np.float64)
+        val2 = np.asarray(val2, dtype=np.float64)
+        valid = ~(np.isnan(val1) | np.isnan(val2))
+        cmps = np.sign(np.where(valid, val1 - val2, 0.0))
+        if self.prev_cmps is None:
+            self.prev_cmps = np.full(len(cmps), np.nan)
+        crossed = valid & ~np.isnan(self.prev_cmps)
+        self.value = np.where(crossed, np.sign(cmps - np.where(crossed, self.prev_cmps, 0.0)), 0).astype(np.int8)
+        self.prev_cmps = np.where(valid, cmps, self.prev_cmps)
+        return self.value
+
+
+def sma_array(data, window):
+    """
+    SMA of every prefix of data, i.e. out[i] == SMA(data[:i+1]).
+    Entries for which the SMA is undefined are NaN.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    out = np.full(len(data), np.nan)
+    if len(data) < window:
+        return out
+    # Add values in the same order as sum() would, so that results match
+    # the streaming SMA exactly.
+    total = 0
+    for k in xrange(window):
+        total = total + data[k:len(data) - window + 1 + k]
+    out[window - 1:] = total / float(window)
+    return out
+
+
+def ema_array(data, window):
+    """
+    EMA of every prefix of data, i.e. out[i] == EMA(data[:i+1]).
+    Entries for which the EMA is undefined are NaN.
+    Same operation order as the streaming EMA, so results match exactly.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n = len(data)
+    out = np.full(n, np.nan)
+    if n < 2 * window:
+        return out
+    c = 2.0 / (window + 1)
+    # out[i] is seeded from data[i-2w+1 : i-w+1] and smoothed over
+    # data[i-w+1 : i+1]
+    current_ema = sma_array(data[:n - window], window)[window - 1:]
+    for k in xrange(window):
+        current_ema = (c * data[window + k:n - window + 1 + k]) + ((1 - c) * current_ema)
+    out[2 * window - 1:] = current_ema
+    return out
+
+
+def crossover_array(val1, val2):
+    """
+    Vectorized Crossover: out[i] is the value Crossover.update would return
+    when fed val1[i], val2[i] for every i where both are defined (not NaN).
+    """
+    val1 = np.asarray(val1, dtype=np.float64)
+    val2 = np.asarray(val2, dtype=np.float64)
+    out = np.zeros(len(val1), dtype=np.int8)
+    valid = np.flatnonzero(~(np.isnan(val1) | np.isnan(val2)))
+    if len(valid) < 2:
+        return out
+    cmps = np.sign(val1[valid] - val2[valid])
+    out[valid[1:]] = np.sign(cmps[1:] - cmps[:-1])
+    return out
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Resolving stop loss and target fills with finer grained data (ticks or
+1 second bars) than the candles being backtested.
+
+Within a candle, try_to_close can only assume the stop loss was hit
+before the target, and fills at the candle's extreme. IntrabarFillModel
+(a fill model, see costs.py) instead walks the sub-bars of the candle
+which closed an order, finds which trigger was actually hit first and
+fills at its price -
+
+    store = SubBarStore.write('TATASTEEL.ticks', tick_times, tick_prices)
+    Strategy2(fill_model=IntrabarFillModel(store, period=60)).backtest()
+
+Candles are matched to sub-bars by their time in the CandleSeries
+(backtester.candles.time), not by timeline entries, which may be bar
+numbers (as in Strategy2).
+
+Sub-bars are kept in a directory of .npy columns (time, high, low), which
+are memory-mapped. Only the sub-bars of candles where a trigger is hit
+are located (binary search on time) and read, so the extra cost scales
+with the number of triggered candles, not with the size of the tick
+history. In backtest_vectorized all triggered candles are resolved in one
+pass.
+"""
+
+import os
+
+import numpy as np
+
+from costs import FillModel, TriggerFill
+
+COLUMNS = ('time', 'high', 'low')
+
+# Candle times below this (1971-01-01) are taken to be bar numbers
+MIN_EPOCH_SECONDS = 365 * 24 * 3600
+
+
+def as_epoch_seconds(times):
+    """
+    Timeline entries (datetime64, datetime objects or epoch seconds) as
+    an int64 array of epoch seconds.
+    """
+    times = np.asarray(times)
+    if times.dtype.kind in 'iu':
+        return times.astype(np.int64)
+    return np.asarray(times, dtype='datetime64[s]').astype(np.int64)
+
+
+class SubBarStore(object):
+    """
+    Memory-mapped sub-bars, sorted by time - time (int64, epoch seconds),
+    high and low (float64). Ticks are sub-bars with high == low.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        for column in COLUMNS:
+            setattr(self, column, np.load(os.path.join(directory, column + '.npy'),
+                                          mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def write(cls, directory, time, high, low=None):
+        """
+        Store sub-bars (ticks if low is None, high being their prices) in
+        directory, and open the store. time is sorted if it isn't.
+        """
+        time = as_epoch_seconds(time)
+        high = np.asarray(high, dtype=np.float64)
+        low = high if low is None else np.asarray(low, dtype=np.float64)
+        if np.any(np.diff(time) < 0):
+            order = np.argsort(time, kind='mergesort')
+            time, high, low = time[order], high[order], low[order]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for column, values in zip(COLUMNS, (time, high, low)):
+            np.save(os.path.join(directory, column + '.npy'), values)
+        return cls(directory)
+
+    @classmethod
+    def from_candles(cls, directory, candles):
+        """
+        Store the high and low of a CandleSeries of sub-bars.
+        """
+        return cls.write(directory, candles.time, candles.high, candles.low)
+
+    def locate(self, start, stop):
+        """
+        Index ranges [first, last) of sub-bars with start <= time < stop,
+        for arrays of start and stop times.
+        """
+        return (np.searchsorted(self.time, start, 'left'),
+                np.searchsorted(self.time, stop, 'left'))
+
+
+class IntrabarFillModel(FillModel):
+    """
+    Fills orders at the trigger hit first by the sub-bars of the candle
+    that closed them. period is the candles' timeframe in seconds; a
+    candle at time t covers sub-bars in [t, t + period), or in
+    (t - period, t] with label='right'. Prices are clipped to the sub-bar
+    (a tick gapping through the trigger fills at the tick). Orders whose
+    candle has no sub-bars, or whose sub-bars hit neither trigger, are
+    filled by fill_model (default: at the trigger price).
+    """
+    def __init__(self, store, period, label='left', fill_model=None):
+        if label not in ('left', 'right'):
+            raise ValueError("label has to be either 'left' or 'right'")
+        self.store = store
+        self.period = period
+        self.label = label
+        self.fill_model = TriggerFill() if fill_model is None else fill_model
+
+        # Counters - candles resolved with sub-bars, sub-bars read
+        self.candles_resolved = 0
+        self.sub_bars_read = 0
+
+    def exit_price(self, is_buy, stop_loss_hit, stop_loss, target,
+                   candle_high, candle_low, time=None):
+        if time is None:
+            raise ValueError('IntrabarFillModel needs the time of the candle')
+        price = np.array(self.fill_model.exit_price(is_buy, stop_loss_hit, stop_loss, target,
+                                                    candle_high, candle_low, time),
+                         dtype=np.float64)
+        scalar = price.ndim == 0
+        price = np.atleast_1d(price)
+        count = len(price)
+        is_buy = np.broadcast_to(np.asarray(is_buy, dtype=bool), (count,))
+        stop_loss = np.broadcast_to(np.asarray(stop_loss, dtype=np.float64), (count,))
+        target = np.broadcast_to(np.asarray(target, dtype=np.float64), (count,))
+
+        start = np.atleast_1d(as_epoch_seconds(time))
+        if len(start) and start.min() < MIN_EPOCH_SECONDS:
+            raise ValueError('IntrabarFillModel needs candle times, got %d '
+                             '(a bar number?)' % start.min())
+        if self.label == 'right':
+            start = start - self.period + 1
+        first, last = self.store.locate(start, start + self.period)
+        counts = last - first
+        total = int(counts.sum())
+        self.candles_resolved += int(np.count_nonzero(counts))
+        self.sub_bars_read += total
+        if not total:
+            return price[0] if scalar else price
+
+        # Sub-bars of all candles, concatenated; owner is the order each
+        # belongs to
+        owner = np.repeat(np.arange(count), counts)
+        offsets = np.cumsum(counts) - counts
+        rows = np.arange(total) - offsets[owner] + first[owner]
+        high = self.store.high[rows]
+        low = self.store.low[rows]
+
+        buy = is_buy[owner]
+        sl = stop_loss[owner]
+        tp = target[owner]
+        sl_hit = np.where(buy, sl >= low, sl <= high)
+        tp_hit = np.where(buy, tp <= high, tp >= low)
+        hits = np.flatnonzero(sl_hit | tp_hit)
+        if len(hits):
+            # First hit of every order; the stop loss wins within a sub-bar
+            orders, first_hit = np.unique(owner[hits], return_index=True)
+            hits = hits[first_hit]
+            trigger = np.where(sl_hit[hits], sl[hits], tp[hits])
+            finite = np.isfinite(trigger)
+            price[orders[finite]] = np.clip(trigger[finite], low[hits][finite],
+                                            high[hits][finite])
+        return price[0] if scalar else price
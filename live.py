@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Run a strategy on an incremental feed of candles instead of a history
+loaded up front - the same strategy() code, one bar at a time.
+
+    backtester = Strategy2(candles=warm_up_candles)
+    runner = LiveRunner(backtester)
+    runner.warm_up()                    # backtest the warm up history
+    runner.run(FileReplaySource('pycon-tatasteel-data.csv', speed=600))
+    print runner.latency_percentiles()
+
+A feed is any iterable of bars (time, open, high, low, close[, volume]) -
+a generator, FileReplaySource, dataframe_bars(get_intraday(...)),
+IntradayPollSource. Callback style feeds (sockets, an event loop, a
+thread) can push bars with runner.on_bar(...) instead.
+
+Only the last 'buffer_size' bars are kept (runner.buffer), so memory does
+not grow with the length of a run. Strategies should therefore rely on
+indicators (see indicators.py) or runner.buffer rather than on
+self.candles_* / self.history, which only cover the warm up history.
+"""
+
+import datetime
+import time as _time
+
+import numpy as np
+
+from candles import CandleSeries
+from dataloader import load_candles
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def as_datetime(value):
+    """
+    Bar time as a datetime.datetime (the type backtest() gives strategies),
+    from a datetime, a datetime64, a pandas Timestamp or epoch seconds.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, (int, long, float, np.integer, np.floating)):
+        return EPOCH + datetime.timedelta(seconds=int(value))
+    return np.datetime64(value, 's').tolist()
+
+
+def epoch_seconds(value):
+    if isinstance(value, (int, long, np.integer)):
+        return int(value)
+    delta = as_datetime(value) - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+class CandleBuffer(object):
+    """
+    Ring buffer of the last 'capacity' candles, stored in numpy columns like
+    a CandleSeries.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = dict((field, np.zeros(capacity, dtype=np.int64 if field in ('time', 'volume')
+                                             else np.float64))
+                            for field in CandleSeries.fields)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, time, candle_open, candle_high, candle_low, candle_close, volume=0):
+        k = (self.start + self.count) % self.capacity
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+        columns = self.columns
+        columns['time'][k] = time
+        columns['open'][k] = candle_open
+        columns['high'][k] = candle_high
+        columns['low'][k] = candle_low
+        columns['close'][k] = candle_close
+        columns['volume'][k] = volume
+
+    def column(self, field, n=None):
+        """
+        Last n (default all buffered) values of a column, oldest first (a
+        copy).
+        """
+        if n is None or n > self.count:
+            n = self.count
+        first = (self.start + self.count - n) % self.capacity
+        return np.roll(self.columns[field], -first)[:n]
+
+    def series(self, n=None):
+        """
+        Last n (default all buffered) candles as a CandleSeries, oldest first.
+        """
+        return CandleSeries(*[self.column(field, n) for field in CandleSeries.fields])
+
+
+class LiveRunner(object):
+    """
+    Feeds bars one at a time to an AlgoTradingBacktesting instance and
+    measures the time it takes to process each (order matching,
+    indicators and strategy).
+    Bars get indexes following the backtester's own candles, so orders,
+    statistics and metrics work as in a backtest.
+    """
+    def __init__(self, backtester, buffer_size=10000, latency_samples=100000):
+        self.backtester = backtester
+        self.buffer = CandleBuffer(buffer_size)
+        self.latencies = np.zeros(latency_samples)   # seconds, ring buffer
+        self.bars = 0
+        self.next_index = len(backtester.candles_close)
+
+    def warm_up(self):
+        """
+        Backtest the backtester's own candles (the warm up history), so
+        indicators are ready when live bars arrive.
+        """
+        self.backtester.backtest()
+        candles = self.backtester.candles
+        if candles is not None:
+            tail = candles[max(0, len(candles) - self.buffer.capacity):]
+            for bar in zip(*[getattr(tail, field).tolist() for field in CandleSeries.fields]):
+                self.buffer.append(*bar)
+
+    def on_bar(self, time, candle_open, candle_high, candle_low, candle_close, volume=0):
+        """
+        Process one bar. Returns the time it took, in seconds.
+        """
+        started = _time.time()
+        i = self.next_index
+        self.next_index += 1
+        self.buffer.append(epoch_seconds(time), candle_open, candle_high,
+                           candle_low, candle_close, volume)
+        self.backtester.backtest_candle(i, as_datetime(time), candle_open, candle_close,
+                                        candle_high, candle_low)
+        latency = _time.time() - started
+        self.latencies[self.bars % len(self.latencies)] = latency
+        self.bars += 1
+        return latency
+
+    def run(self, feed, max_bars=None):
+        """
+        Process bars (time, open, high, low, close[, volume]) from an
+        iterable feed until it is exhausted or max_bars bars are processed.
+        """
+        for n, bar in enumerate(feed):
+            if max_bars is not None and n >= max_bars:
+                break
+            self.on_bar(*bar)
+
+    def latency_percentiles(self, percentiles=(50, 90, 99, 100)):
+        """
+        Per bar processing time percentiles, in microseconds, over the last
+        latency_samples bars.
+        """
+        latencies = self.latencies[:min(self.bars, len(self.latencies))]
+        if not len(latencies):
+            return {}
+        return dict(zip(percentiles, np.percentile(latencies, percentiles) * 1e6))
+
+
+class FileReplaySource(object):
+    """
+    Replays candles of a CSV file (see dataloader.load_candles) as a feed.
+    speed is bar time replayed per second of wall time, e.g. 60 plays a
+    minute of bars every second; None replays as fast as possible.
+    """
+    def __init__(self, path, speed=None, start=0, stop=None, **load_options):
+        self.candles = load_candles(path, **load_options)[start:stop]
+        self.speed = speed
+
+    def __iter__(self):
+        candles = self.candles
+        times = candles.time.tolist()
+        if not times:
+            return
+        started = _time.time()
+        first = times[0]
+        for bar in zip(times, candles.open.tolist(), candles.high.tolist(),
+                       candles.low.tolist(), candles.close.tolist(),
+                       candles.volume.tolist()):
+            if self.speed:
+                delay = (bar[0] - first) / float(self.speed) - (_time.time() - started)
+                if delay > 0:
+                    _time.sleep(delay)
+            yield bar
+
+
+def dataframe_bars(df):
+    """
+    Bars of a DataFrame with Open, High, Low, Close (and optionally Volume)
+    columns and a DatetimeIndex, such as google_finance_intraday.get_intraday
+    returns.
+    """
+    volume = df['Volume'] if 'Volume' in df else np.zeros(len(df))
+    times = df.index.values.astype('datetime64[s]').astype(np.int64).tolist()
+    return zip(times, df['Open'].tolist(), df['High'].tolist(), df['Low'].tolist(),
+               df['Close'].tolist(), np.asarray(volume, dtype=np.int64).tolist())
+
+
+class IntradayPollSource(object):
+    """
+    Polls google_finance_intraday.get_intraday every poll_interval seconds
+    (default: period) and yields bars newer than the last one seen. The
+    latest bar of a poll may still be forming, so it is held back until a
+    later poll returns a newer one. Runs until max_polls polls (forever if
+    None).
+    """
+    def __init__(self, ticker, period=60, poll_interval=None, max_polls=None,
+                 get_intraday=None):
+        if get_intraday is None:
+            from google_finance_intraday import get_intraday
+        self.get_intraday = get_intraday
+        self.ticker = ticker
+        self.period = period
+        self.poll_interval = period if poll_interval is None else poll_interval
+        self.max_polls = max_polls
+
+    def __iter__(self):
+        last_time = None
+        polls = 0
+        while self.max_polls is None or polls < self.max_polls:
+            if polls:
+                _time.sleep(self.poll_interval)
+            polls += 1
+            for bar in dataframe_bars(self.get_intraday(self.ticker, self.period, 1))[:-1]:
+                if last_time is None or bar[0] > last_time:
+                    last_time = bar[0]
+                    yield bar
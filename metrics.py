@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Running trade metrics, updated by the backtesting engine as orders are
+opened and closed.
+
+Closed orders are recorded as prefix sums (cumulative profit, wins,
+losses, ...) indexed by the order in which they closed, and bar indexes
+of entries and exits are kept sorted. Statistics as of any bar are then
+two binary searches and a few lookups, and whole per-bar curves (equity,
+drawdown, exposure) are built with numpy in one pass.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class MetricsAccumulator(object):
+    def __init__(self):
+        # Every opened order, in the order they were opened (which is also
+        # ascending entry bar)
+        self.entry_index = array('l')
+        self.signed_quantity = array('d')
+        self.entry_price = array('d')
+        self.exit_index = array('l')        # -1 while open
+        self.positions = {}                 # order id -> position in above
+
+        # Prefix sums over closed orders, in the order they were closed
+        # (which is also ascending exit bar)
+        self.close_index = array('l')
+        self.cum_profit = array('d')
+        self.cum_profit_percent = array('d')
+        self.cum_wins = array('l')
+        self.cum_losses = array('l')
+        self.cum_max_entry_price = array('d')
+        self.cum_max_drawdown = array('d')
+
+        # Current state
+        self.realized_profit = 0.0
+        self.peak_profit = 0.0
+        self.exposure = 0.0                 # gross value of open orders at entry
+
+    def on_open(self, order):
+        self.positions[order.id] = len(self.entry_index)
+        # Missing bar indexes are recorded as -1, as in order.TradeLedger
+        self.entry_index.append(-1 if order.entry_index is None else order.entry_index)
+        self.signed_quantity.append(order.side * order.quantity)
+        self.entry_price.append(order.entry_price)
+        self.exit_index.append(-1)
+        self.exposure += order.quantity * order.entry_price
+
+    def on_close(self, order):
+        exit_index = -1 if order.exit_index is None else order.exit_index
+        self.exit_index[self.positions.pop(order.id)] = exit_index
+        self.exposure -= order.quantity * order.entry_price
+
+        closed = len(self.close_index)
+        self.close_index.append(exit_index)
+        self.realized_profit += order.profit
+        self.cum_profit.append(self.realized_profit)
+        self.cum_profit_percent.append(
+            (self.cum_profit_percent[-1] if closed else 0.0) + order.profit_percent)
+        win = 1 if order.profit >= 0 else 0
+        self.cum_wins.append((self.cum_wins[-1] if closed else 0) + win)
+        self.cum_losses.append((self.cum_losses[-1] if closed else 0) + 1 - win)
+        self.cum_max_entry_price.append(
+            max(self.cum_max_entry_price[-1] if closed else 0.0, order.entry_price))
+        self.peak_profit = max(self.peak_profit, self.realized_profit)
+        self.cum_max_drawdown.append(
+            max(self.cum_max_drawdown[-1] if closed else 0.0,
+                self.peak_profit - self.realized_profit))
+
+    def extend(self, ids, entry_index, signed_quantity, entry_price, exit_index,
+               closed, profit, profit_percent):
+        """
+        Record many orders at once, as on_open for each of them followed by
+        on_close for those closed would. Arguments are arrays over the
+        orders, in the order they were opened; exit_index is -1 for open
+        orders and closed gives positions of the closed ones, in the order
+        they closed.
+        """
+        first = len(self.entry_index)
+        is_open = exit_index < 0
+        self.entry_index.extend(entry_index.tolist())
+        self.signed_quantity.extend(signed_quantity.astype(np.float64).tolist())
+        self.entry_price.extend(entry_price.tolist())
+        self.exit_index.extend(exit_index.tolist())
+        self.positions.update(zip(ids[is_open].tolist(),
+                                  (np.flatnonzero(is_open) + first).tolist()))
+        self.exposure += float(np.abs(signed_quantity[is_open]).dot(entry_price[is_open]))
+        if not len(closed):
+            return
+
+        # Running sums and maxima, seeded with the current ones so that
+        # they come out as on_close computes them
+        def running(function, values, last, initial):
+            seed = getattr(self, last)[-1] if len(getattr(self, last)) else initial
+            return function(np.concatenate([[seed], values]))[1:]
+        wins = (profit[closed] >= 0).astype(np.int_)
+        cum_profit = np.cumsum(np.concatenate([[self.realized_profit], profit[closed]]))[1:]
+        peak_profit = np.maximum.accumulate(np.concatenate([[self.peak_profit], cum_profit]))[1:]
+        self.close_index.extend(exit_index[closed].tolist())
+        self.cum_profit.extend(cum_profit.tolist())
+        self.cum_profit_percent.extend(
+            running(np.cumsum, profit_percent[closed], 'cum_profit_percent', 0.0).tolist())
+        self.cum_wins.extend(running(np.cumsum, wins, 'cum_wins', 0).tolist())
+        self.cum_losses.extend(running(np.cumsum, 1 - wins, 'cum_losses', 0).tolist())
+        self.cum_max_entry_price.extend(
+            running(np.maximum.accumulate, entry_price[closed],
+                    'cum_max_entry_price', 0.0).tolist())
+        self.cum_max_drawdown.extend(
+            running(np.maximum.accumulate, peak_profit - cum_profit,
+                    'cum_max_drawdown', 0.0).tolist())
+        self.realized_profit = float(cum_profit[-1])
+        self.peak_profit = float(peak_profit[-1])
+
+    def statistics(self, i):
+        """
+        Statistics as of the end of bar i - orders closed at or before bar
+        i are executed, orders entered before bar i and not yet closed are
+        open. O(log orders).
+        """
+        executed = bisect_right(self.close_index, i)
+        entered = bisect_left(self.entry_index, i)
+        last = executed - 1
+        return {'executed_trades': executed,
+                'open_trades': entered - executed,
+                'profitable_trades': self.cum_wins[last] if executed else 0,
+                'loss_making_trades': self.cum_losses[last] if executed else 0,
+                'profit': self.cum_profit[last] if executed else 0.0,
+                'profit_percent': self.cum_profit_percent[last] if executed else 0.0,
+                'max_drawdown': self.cum_max_drawdown[last] if executed else 0.0}
+
+    def column(self, name, dtype=np.float64):
+        values = getattr(self, name)
+        if not len(values):
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(values, dtype=dtype)
+
+    def realized_curves(self, n):
+        """
+        Per bar (n bars) realized profit and profit percent - total profit
+        of closed orders relative to the highest entry price among them.
+        """
+        closed = np.searchsorted(self.column('close_index', np.int_), np.arange(n), 'right')
+        profit = np.concatenate([[0.0], self.column('cum_profit')])[closed]
+        max_entry_price = np.concatenate([[1e-10], self.column('cum_max_entry_price')])[closed]
+        return profit, 100.0 * profit / max_entry_price
+
+    def equity_curve(self, candles_close):
+        """
+        Per bar profit marked to market - realized profit plus unrealized
+        profit of orders open at the close of each bar - and its drawdown.
+        """
+        n = len(candles_close)
+        realized, _ = self.realized_curves(n)
+        entry = self.column('entry_index', np.int_)
+        exit = self.column('exit_index', np.int_)
+        quantity = self.column('signed_quantity')
+        basis = quantity * self.column('entry_price')
+
+        # Order entered at bar e is held at the close of bars e..x-1 when it
+        # exits at bar x (intrabar), or till the end if still open
+        exit = np.where(exit < 0, n, exit)
+        position = np.zeros(n + 1)
+        cost = np.zeros(n + 1)
+        np.add.at(position, entry, quantity)
+        np.add.at(position, exit, -quantity)
+        np.add.at(cost, entry, basis)
+        np.add.at(cost, exit, -basis)
+        position = np.cumsum(position)[:n]
+        cost = np.cumsum(cost)[:n]
+
+        equity = realized + position * np.asarray(candles_close, dtype=np.float64) - cost
+        drawdown = np.maximum.accumulate(np.maximum(equity, 0.0)) - equity
+        return equity, drawdown
+
+    def exposure_curve(self, n):
+        """
+        Per bar gross value (at entry price) of orders open at the close of
+        each bar.
+        """
+        entry = self.column('entry_index', np.int_)
+        exit = self.column('exit_index', np.int_)
+        exit = np.where(exit < 0, n, exit)
+        value = np.abs(self.column('signed_quantity')) * self.column('entry_price')
+        exposure = np.zeros(n + 1)
+        np.add.at(exposure, entry, value)
+        np.add.at(exposure, exit, -value)
+        return np.cumsum(exposure)[:n]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Monte Carlo analysis of a backtest's trades - how profit and drawdown
+could have turned out, to size capital with some margin.
+
+A backtest gives one sequence of closed trades. Resampling the profits
+of its ledger gives many more equity curves -
+1. reshuffle: the same trades in random order. Final profit is the same
+   on every path; drawdowns differ.
+2. bootstrap: as many trades as the ledger, drawn with replacement.
+and parameter_jitter reruns the strategy with randomly perturbed
+parameters. Paths are generated and evaluated in numpy batches (one
+(runs, trades) array per batch), spread over a pool of processes.
+
+    backtester = Strategy2()
+    backtester.backtest_vectorized()
+    print confidence_bands(simulate(trade_profits(backtester), 20000, 'bootstrap'))
+    print analyze(backtester)       # both methods
+
+Profit percent and drawdown percent are relative to capital, which
+defaults to the backtest's peak exposure, as in analytics.py.
+Drawdowns here are of closed trade equity (no marking to market).
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas
+
+import analytics
+import optimizer
+
+METHODS = ('reshuffle', 'bootstrap')
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+STATISTICS = ('profit', 'profit_percent', 'max_drawdown', 'max_drawdown_percent')
+JITTER_STATISTICS = ('profit', 'return_percent', 'mtm_max_drawdown', 'mtm_max_drawdown_percent')
+
+# Profits being simulated, for worker processes
+_profits = None
+
+
+def trade_profits(backtester):
+    """
+    Profits of a backtest's closed orders in the order they were closed,
+    and the default capital (see analytics.default_capital).
+    """
+    return backtester.ledger.column('profit').copy(), analytics.default_capital(backtester)
+
+
+def resample(profits, runs, method, rng):
+    """
+    (runs, trades) array of resampled profits.
+    """
+    n = len(profits)
+    if method == 'reshuffle':
+        # Sorting a row of random keys gives a random permutation
+        rows = np.argsort(rng.random_sample((runs, n)), axis=1)
+    elif method == 'bootstrap':
+        rows = rng.randint(0, n, (runs, n))
+    else:
+        raise ValueError('method has to be one of %s' % ', '.join(METHODS))
+    return profits[rows]
+
+
+def path_statistics(paths, capital):
+    """
+    Final profit and max drawdown of every row of paths (profits of
+    trades, in order), as a dict of arrays.
+    """
+    equity = np.cumsum(paths, axis=1)
+    # Peaks start from 0, the equity before the first trade
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), 0.0)
+    max_drawdown = (peak - equity).max(axis=1)
+    profit = equity[:, -1]
+    return {'profit': profit,
+            'profit_percent': 100.0 * profit / capital,
+            'max_drawdown': max_drawdown,
+            'max_drawdown_percent': 100.0 * max_drawdown / capital}
+
+
+def simulate_batch(profits, runs, method, capital, seed):
+    rng = np.random.RandomState(seed)
+    return path_statistics(resample(profits, runs, method, rng), capital)
+
+
+def _simulate_batch(task):
+    runs, method, capital, seed = task
+    return simulate_batch(_profits, runs, method, capital, seed)
+
+
+def simulate(profits, runs=10000, method='reshuffle', capital=None, batch_size=1000,
+             processes=None, seed=0):
+    """
+    Statistics (see path_statistics) of 'runs' resampled equity curves, as
+    a dict of arrays. profits is an array of trade profits, or the
+    (profits, capital) pair of trade_profits. Batches of batch_size runs
+    are simulated on 'processes' worker processes (default: one per core);
+    results depend only on seed and batch_size.
+    """
+    global _profits
+    if isinstance(profits, tuple):
+        profits, default_capital = profits
+        if capital is None:
+            capital = default_capital
+    profits = np.asarray(profits, dtype=np.float64)
+    if capital is None:
+        capital = 1.0
+    if not runs or not len(profits):
+        return dict((name, np.zeros(runs)) for name in STATISTICS)
+
+    tasks = [(min(batch_size, runs - start), method, capital, seed + k)
+             for k, start in enumerate(xrange(0, runs, batch_size))]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes == 1 or len(tasks) == 1:
+        results = [simulate_batch(profits, *task) for task in tasks]
+    else:
+        _profits = profits
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_simulate_batch, tasks)
+        finally:
+            pool.close()
+            pool.join()
+            _profits = None
+    return dict((name, np.concatenate([result[name] for result in results]))
+                for name in STATISTICS)
+
+
+def confidence_bands(results, statistics=STATISTICS, percentiles=DEFAULT_PERCENTILES):
+    """
+    Percentiles and mean of statistics of simulate(), or of columns of a
+    table, as a DataFrame with one row per statistic (NaN without any
+    runs).
+    """
+    rows = []
+    for name in statistics:
+        values = np.asarray(results[name], dtype=np.float64)
+        if not len(values):
+            rows.append({'statistic': name})
+            continue
+        row = dict(('p%g' % p, value) for p, value in
+                   zip(percentiles, np.percentile(values, percentiles)))
+        row['mean'] = values.mean()
+        row['statistic'] = name
+        rows.append(row)
+    return pandas.DataFrame(rows, columns=['statistic', 'mean'] +
+                            ['p%g' % p for p in percentiles]).set_index('statistic')
+
+
+def jittered_parameters(params, jitter, runs, seed=0):
+    """
+    'runs' copies of params with every parameter in jitter multiplied by
+    (1 + jitter[name] * a standard normal draw). Integer parameters are
+    rounded and kept at least 1.
+    """
+    rng = np.random.RandomState(seed)
+    parameter_sets = []
+    for _ in xrange(runs):
+        values = dict(params)
+        for name in sorted(jitter):
+            value = params[name] * (1 + jitter[name] * rng.standard_normal())
+            if isinstance(params[name], (int, long)):
+                value = max(1, int(round(value)))
+            values[name] = value
+        parameter_sets.append(values)
+    return parameter_sets
+
+
+def parameter_jitter(strategy_class, params, jitter, runs=100, vectorized=True,
+                     processes=None, seed=0):
+    """
+    Backtest strategy_class with 'runs' jittered parameter sets (see
+    jittered_parameters, e.g. jitter={'target_percent': 0.2} for a 20%
+    standard deviation) with optimizer.sweep. Returns its table, with
+    analytics - pass it to confidence_bands(table, JITTER_STATISTICS).
+    Drawdowns there are of marked to market equity (see analytics.py).
+    """
+    return optimizer.sweep(strategy_class, jittered_parameters(params, jitter, runs, seed),
+                           'profit', vectorized, processes, analyze=True)
+
+
+def ledger_statistics(backtester):
+    """
+    path_statistics of a backtest's own sequence of trades, as a dict.
+    """
+    profits, capital = trade_profits(backtester)
+    if not len(profits):
+        return dict((name, 0.0) for name in STATISTICS)
+    return dict((name, values[0]) for name, values in
+                path_statistics(profits[None, :], capital).items())
+
+
+def analyze(backtester, runs=10000, methods=METHODS, percentiles=DEFAULT_PERCENTILES,
+            processes=None, seed=0):
+    """
+    Confidence bands of every method for a finished backtest, as a
+    DataFrame indexed by (method, statistic). The backtest's own values
+    are in column 'actual'.
+    """
+    profits, capital = trade_profits(backtester)
+    actual = ledger_statistics(backtester)
+    bands = []
+    for method in methods:
+        band = confidence_bands(simulate((profits, capital), runs, method,
+                                         processes=processes, seed=seed),
+                                STATISTICS, percentiles)
+        band['actual'] = [actual[name] for name in band.index]
+        band.index = pandas.MultiIndex.from_product([[method], band.index],
+                                                    names=['method', 'statistic'])
+        bands.append(band)
+    return pandas.concat(bands)
+
+
+if __name__ == "__main__":
+    from strategy2 import Strategy2
+    backtester = Strategy2()
+    backtester.backtest_vectorized()
+    print analyze(backtester)
+    table = parameter_jitter(Strategy2, {'ema_fast_window': 3, 'ema_slow_window': 15,
+                                         'stop_loss_percent': 1.0, 'target_percent': 0.3},
+                             {'stop_loss_percent': 0.2, 'target_percent': 0.2})
+    print confidence_bands(table, JITTER_STATISTICS)
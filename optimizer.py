@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Parameter sweeps (grid and random search) over AlgoTradingBacktesting
+subclasses, run in parallel on a pool of processes.
+
+Parameters are class attributes of the strategy, e.g. Strategy2's
+ema_fast_window, and every backtest is run on a new instance created as
+strategy_class(**params). Workers are forked from this process after the
+strategy has been instantiated once here, so candle data loaded through
+dataloader.load_candles is inherited (and memory-mapped) by all workers
+instead of being pickled with every task. Only parameters and results
+travel between processes.
+"""
+
+import itertools
+import multiprocessing
+import random
+
+import pandas
+
+import analytics
+import events
+
+# Metrics sorted in ascending order by default - smaller is better.
+LOWER_IS_BETTER = frozenset(['loss_making_trades', 'max_drawdown', 'mtm_max_drawdown',
+                             'mtm_max_drawdown_percent', 'mtm_max_drawdown_duration'])
+
+
+def parameter_grid(param_space):
+    """
+    All combinations of param_space, a dict {parameter: list of values},
+    as a list of dicts.
+    """
+    names = sorted(param_space)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[param_space[name] for name in names])]
+
+
+def random_parameters(param_space, n, seed=None):
+    """
+    n random parameter dicts from param_space. Each value of param_space is
+    either a list of values to choose from, or a (low, high) tuple - a
+    uniform range, of ints if both bounds are ints.
+    """
+    rng = random.Random(seed)
+    names = sorted(param_space)
+    parameter_sets = []
+    for _ in xrange(n):
+        params = {}
+        for name in names:
+            values = param_space[name]
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    params[name] = rng.randint(low, high)
+                else:
+                    params[name] = rng.uniform(low, high)
+            else:
+                params[name] = rng.choice(values)
+        parameter_sets.append(params)
+    return parameter_sets
+
+
+def run_backtest(strategy_class, params, metric='profit', vectorized=False,
+                 quiet=True, analyze=False):
+    """
+    Backtest strategy_class(**params) and return a dict of params,
+    statistics and 'metric' (a key of statistics or of
+    analytics.analyze, or a function called with the finished backtest).
+    Analytics are included when metric is one of them, or with
+    analyze=True. With quiet=True events are not logged.
+    """
+    if quiet:
+        previous_sink = events.set_sink(events.NullSink())
+    try:
+        backtester = strategy_class(**params)
+        if vectorized:
+            backtester.backtest_vectorized()
+        else:
+            backtester.backtest()
+    finally:
+        if quiet:
+            events.set_sink(previous_sink)
+
+    result = dict(params)
+    result.update(evaluate(backtester, metric, analyze))
+    return result
+
+
+def evaluate(backtester, metric='profit', analyze=False):
+    """
+    Statistics of a finished backtest as a dict, with analytics when
+    metric is one of them or with analyze=True, and the value of metric
+    (see run_backtest) as 'metric'.
+    """
+    result = backtester.statistics()
+    if analyze or (not callable(metric) and metric not in result):
+        result.update(analytics.analyze(backtester))
+    if callable(metric):
+        result['metric'] = metric(backtester)
+    else:
+        result['metric'] = result[metric]
+    return result
+
+
+def _run_task(task):
+    strategy_class, params, metric, vectorized, analyze = task
+    return run_backtest(strategy_class, params, metric, vectorized, analyze=analyze)
+
+
+def lower_is_better(metric):
+    """
+    Whether smaller values of metric are better - True for metrics in
+    LOWER_IS_BETTER, False for others and for function metrics.
+    """
+    return not callable(metric) and metric in LOWER_IS_BETTER
+
+
+def sweep(strategy_class, parameter_sets, metric='profit', vectorized=False,
+          processes=None, chunksize=None, analyze=False, ascending=None):
+    """
+    Backtest every parameter dict in parameter_sets on 'processes' worker
+    processes (default: one per core). Returns a pandas DataFrame with one
+    row per backtest - parameters, statistics and metric - sorted by
+    metric, best first: ascending for metrics in LOWER_IS_BETTER,
+    descending for others, unless 'ascending' is given (which is needed for
+    function metrics where smaller is better). An empty parameter_sets
+    gives an empty table.
+    metric is a key of AlgoTradingBacktesting.statistics() or of
+    analytics.analyze() (e.g. 'sharpe_ratio'), or a function (picklable,
+    i.e. defined at module level) of the finished backtest. With
+    analyze=True every row has all analytics.
+    """
+    if ascending is None:
+        ascending = lower_is_better(metric)
+    if not parameter_sets:
+        return pandas.DataFrame(columns=['metric'])
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    # Instantiate once in this process, which checks parameter names and
+    # loads data that forked workers then share.
+    strategy_class(**parameter_sets[0])
+
+    tasks = [(strategy_class, params, metric, vectorized, analyze)
+             for params in parameter_sets]
+    if processes == 1:
+        results = map(_run_task, tasks)
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(tasks) // (processes * 4))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap_unordered(_run_task, tasks, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+
+    table = pandas.DataFrame(results)
+    table = table.sort_values('metric', ascending=ascending).reset_index(drop=True)
+    return table
+
+
+def grid_search(strategy_class, param_space, metric='profit', vectorized=False,
+                processes=None, analyze=False, ascending=None):
+    """
+    Backtest every combination of param_space (see parameter_grid).
+    """
+    return sweep(strategy_class, parameter_grid(param_space), metric,
+                 vectorized, processes, analyze=analyze, ascending=ascending)
+
+
+def random_search(strategy_class, param_space, n, metric='profit',
+                  vectorized=False, processes=None, seed=None, analyze=False,
+                  ascending=None):
+    """
+    Backtest n random parameter sets drawn from param_space
+    (see random_parameters).
+    """
+    return sweep(strategy_class, random_parameters(param_space, n, seed),
+                 metric, vectorized, processes, analyze=analyze,
+                 ascending=ascending)
+
+
+if __name__ == "__main__":
+    from strategy2 import Strategy2
+    print grid_search(Strategy2, {'ema_fast_window': [3, 5, 8],
+                                  'ema_slow_window': [15, 20, 30],
+                                  'stop_loss_percent': [0.5, 1.0, 2.0],
+                                  'target_percent': [0.3, 0.5, 1.0]},
+                      vectorized=True).head(10)
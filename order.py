@@ -5,14 +5,51 @@ Created on Sat Aug 26 21:31:37 2017
 @author: pdagade
 """
 
-import uuid
+from array import array
+import itertools
 
+import numpy as np
+import pandas
+
+import events
+from events import INFO, WARNING
+
+# Codes for Order.side
+BUY = 1
+SELL = -1
+
+order_ids = itertools.count(1)      # unique ids, shared by all orders
+
+
+def reserve_order_ids(n):
+    """
+    The next n order ids, as an array.
+    """
+    return np.fromiter(itertools.islice(order_ids, n), np.int_, n)
+
+
+class Order(object):
+    """
+    An order. Uses __slots__ and small integer codes (side, closed) to keep
+    memory and GC overhead low when strategies create many orders;
+    'type' ('buy'/'sell') and 'position' ('open'/'close') are available as
+    read only properties.
+    entry_index and exit_index are bar indexes of entry and exit, set by
+    the backtesting engine.
+    costs are charges of the order's round trip (see costs.py), deducted
+    from profit.
+    """
+    __slots__ = ('side', 'entry_price', 'quantity', 'entry_time',
+                 'stop_loss_trigger', 'target_trigger', 'id', 'exit_time',
+                 'exit_price', 'profit', 'profit_percent', 'closed',
+                 'entry_index', 'exit_index', 'costs')
 
-class Order:
     def __init__(self, type, entry_price, quantity, entry_time,
                  stop_loss_trigger=None, target_trigger=None):
-        if type == 'buy' or type == 'sell':
-            self.type = type
+        if type == 'buy':
+            self.side = BUY
+        elif type == 'sell':
+            self.side = SELL
         else:
             raise Exception('Type has to be either buy or sell')
         self.entry_price = entry_price
@@ -21,27 +58,57 @@ class Order:
         self.stop_loss_trigger = stop_loss_trigger
         self.target_trigger = target_trigger
 
-        self.id = uuid.uuid4()      # unique random ids
+        self.id = next(order_ids)
         self.exit_time = None
         self.exit_price = None
         self.profit = None
         self.profit_percent = None
-        self.position = 'open'
+        self.closed = False
+        self.entry_index = None
+        self.exit_index = None
+        self.costs = 0.0
+
+    @property
+    def type(self):
+        return 'buy' if self.side == BUY else 'sell'
+
+    @property
+    def position(self):
+        return 'close' if self.closed else 'open'
 
-    def close(self, stock_price, time):
+    def close(self, stock_price, time, costs=0.0):
         """
         Call this methood to close this order.
         """
         self.exit_price = stock_price
         self.exit_time = time
-        self.position = 'close'
+        self.costs = costs
+        self.closed = True
         self.calculate_profit()
-        print '[ID: %s] %sing %d@%f. Profit booked: %f %%' \
-              % (self.id, self.type, self.quantity,
-                 self.exit_price, self.profit_percent)
+        events.sink.log(INFO, '[ID: %s] %sing %d@%f. Profit booked: %f %%',
+                        self.id, self.type, self.quantity,
+                        self.exit_price, self.profit_percent)
+
+    def fill(self, stop_loss_hit, price, candle_high, candle_low, time,
+             fill_model=None, cost_model=None, fill_time=None):
+        """
+        Close this order because a trigger was hit - at price, or where
+        fill_model fills it, less costs of cost_model (see costs.py).
+        fill_time is the candle's time given to fill_model, if time is not
+        one (e.g. a bar number).
+        """
+        if fill_model is not None:
+            price = float(fill_model.exit_price(self.side == BUY, stop_loss_hit,
+                                                self.stop_loss_trigger, self.target_trigger,
+                                                candle_high, candle_low,
+                                                time if fill_time is None else fill_time))
+        costs = 0.0 if cost_model is None else cost_model.order_costs(self, price)
+        self.close(price, time, costs)
 
 
 class BuyOrder(Order):
+    __slots__ = ()
+
     def __init__(self, entry_price, quantity, entry_time,
                  stop_loss_trigger=None, target_trigger=None):
         if stop_loss_trigger and stop_loss_trigger >= entry_price:
@@ -51,41 +118,47 @@ class BuyOrder(Order):
 
         Order.__init__(self, 'buy', entry_price, quantity, entry_time,
                        stop_loss_trigger, target_trigger)
-        print '[ID: %s] Buying %d@%f (New order)' \
-              % (self.id, self.quantity, self.entry_price)
+        events.sink.log(INFO, '[ID: %s] Buying %d@%f (New order)',
+                        self.id, self.quantity, self.entry_price)
 
     def calculate_profit(self):
         """
         Calculate profit after order is closed
         """
-        if self.position == 'close':
-            self.profit = (self.exit_price - self.entry_price)*self.quantity
+        if self.closed:
+            self.profit = (self.exit_price - self.entry_price)*self.quantity - self.costs
             self.profit_percent = (100.0*self.profit/self.quantity)/self.entry_price
         else:
-            print 'WARNING: Calling calculate_profit for open order!'
+            events.sink.log(WARNING, 'WARNING: Calling calculate_profit for open order!')
 
-    def try_to_close(self, candle_high, candle_low, time):
+    def try_to_close(self, candle_high, candle_low, time, fill_model=None, cost_model=None,
+                     fill_time=None):
         """
         Check if an open order can be closed for given stock_price depending on
-        stop_loss_tigger or target_trigger
+        stop_loss_tigger or target_trigger. Fill price and costs come from
+        fill_model and cost_model if given (see costs.py and Order.fill).
         """
-        if self.position == 'open':
+        if not self.closed:
             if self.stop_loss_trigger >= candle_low:
-                print '[ID: %s] Stop loss trigger executed at candle_low %f. Closing...' % (self.id, candle_low)
-                self.close(candle_low, time)
+                events.sink.log(INFO, '[ID: %s] Stop loss trigger executed at candle_low %f. Closing...', self.id, candle_low)
+                self.fill(True, candle_low, candle_high, candle_low, time, fill_model, cost_model,
+                          fill_time)
                 return True
             elif self.target_trigger <= candle_high:
-                print '[ID: %s] Target price trigger executed at candle_high %f. Closing...' % (self.id, candle_high)
-                self.close(candle_high, time)
+                events.sink.log(INFO, '[ID: %s] Target price trigger executed at candle_high %f. Closing...', self.id, candle_high)
+                self.fill(False, candle_high, candle_high, candle_low, time, fill_model, cost_model,
+                          fill_time)
                 return True
             else:
                 return False
         else:
-            print 'Warning: Trying to close an Order which is already closed'
+            events.sink.log(WARNING, 'Warning: Trying to close an Order which is already closed')
             return False
 
 
 class SellOrder(Order):
+    __slots__ = ()
+
     def __init__(self, entry_price, quantity, entry_time,
                  stop_loss_trigger=None, target_trigger=None):
         if stop_loss_trigger and stop_loss_trigger <= entry_price:
@@ -95,33 +168,222 @@ class SellOrder(Order):
 
         Order.__init__(self, 'sell', entry_price, quantity, entry_time,
                        stop_loss_trigger, target_trigger)
-        print '[ID: %s] Selling %d@%f (New order)' \
-              % (self.id, self.quantity, self.entry_price)
+        events.sink.log(INFO, '[ID: %s] Selling %d@%f (New order)',
+                        self.id, self.quantity, self.entry_price)
 
     def calculate_profit(self):
         """
         Calculate profit after order is closed
         """
-        if self.position == 'close':
-            self.profit = (self.entry_price - self.exit_price)*self.quantity
+        if self.closed:
+            self.profit = (self.entry_price - self.exit_price)*self.quantity - self.costs
             self.profit_percent = (100.0*self.profit/self.quantity)/self.entry_price
         else:
-            print 'WARNING: Calling calculate_profit for open order!'
+            events.sink.log(WARNING, 'WARNING: Calling calculate_profit for open order!')
 
-    def try_to_close(self, candle_high, candle_low, time):
+    def try_to_close(self, candle_high, candle_low, time, fill_model=None, cost_model=None,
+                     fill_time=None):
         """
         Check if an open order can be closed for given stock_price depending on
-        stop_loss_tigger or target_trigger
+        stop_loss_tigger or target_trigger. Fill price and costs come from
+        fill_model and cost_model if given (see costs.py and Order.fill).
         """
-        if self.position == 'open':
+        if not self.closed:
             if self.stop_loss_trigger <= candle_high:
-                print '[ID: %s] Stop loss trigger executed at candle_high %f. Closing...' % (self.id, candle_high)
-                self.close(candle_high, time)
+                events.sink.log(INFO, '[ID: %s] Stop loss trigger executed at candle_high %f. Closing...', self.id, candle_high)
+                self.fill(True, candle_high, candle_high, candle_low, time, fill_model, cost_model,
+                          fill_time)
                 return True
             elif self.target_trigger >= candle_low:
-                print '[ID: %s] Target price trigger executed at candle_low %f. Closing...' % (self.id, candle_low)
-                self.close(candle_low, time)
+                events.sink.log(INFO, '[ID: %s] Target price trigger executed at candle_low %f. Closing...', self.id, candle_low)
+                self.fill(False, candle_low, candle_high, candle_low, time, fill_model, cost_model,
+                          fill_time)
                 return True
         else:
-            print 'Warning: Trying to close an Order which is already closed'
+            events.sink.log(WARNING, 'Warning: Trying to close an Order which is already closed')
             return False
+
+
+def build_order(side, **fields):
+    """
+    An open BuyOrder or SellOrder with the given fields, made without
+    checking triggers, drawing an id or logging - for orders whose fields
+    were worked out in bulk (see AlgoTradingBacktesting.backtest_vectorized).
+    """
+    order = object.__new__(BuyOrder if side == BUY else SellOrder)
+    order.side = side
+    order.exit_time = None
+    order.exit_price = None
+    order.profit = None
+    order.profit_percent = None
+    order.closed = False
+    order.entry_index = None
+    order.exit_index = None
+    order.costs = 0.0
+    for name, value in fields.iteritems():
+        setattr(order, name, value)
+    return order
+
+
+def check_triggers(is_buy, entry_price, stop_loss_trigger, target_trigger):
+    """
+    The checks of BuyOrder and SellOrder on arrays of triggers, where
+    missing triggers are -inf (see vectorized.trigger_array).
+    """
+    def given(triggers):
+        return (triggers != -np.inf) & (triggers != 0)
+    messages = ((is_buy & given(stop_loss_trigger) & (stop_loss_trigger >= entry_price),
+                 'Stop loss trigger for buy order should be <= entry_price'),
+                (is_buy & given(target_trigger) & (target_trigger <= entry_price),
+                 'Stop loss trigger for buy order should be >= entry_price'),
+                (~is_buy & given(stop_loss_trigger) & (stop_loss_trigger <= entry_price),
+                 'Stop loss trigger for sell order should be >= entry_price'),
+                (~is_buy & given(target_trigger) & (target_trigger >= entry_price),
+                 'target trigger for sell order should be <= entry_price'))
+    for invalid, message in messages:
+        if invalid.any():
+            raise Exception(message)
+
+
+class OrderColumns(object):
+    """
+    Orders stored as columns (keyword arguments named after Order fields),
+    e.g. closed orders in the order they were closed. Order objects are
+    only built (once) when looked up, so recording many orders costs a few
+    numpy arrays. Missing triggers are NaN. Orders are open unless an
+    exit_index column is given.
+    """
+    def __init__(self, **columns):
+        self.columns = dict((name, np.asarray(values)) for name, values in columns.iteritems())
+        self.orders = {}
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, k):
+        order = self.orders.get(k)
+        if order is None:
+            fields = dict((name, values[k:k + 1].tolist()[0])
+                          for name, values in self.columns.iteritems())
+            for name in ('stop_loss_trigger', 'target_trigger'):
+                if fields[name] != fields[name]:
+                    fields[name] = None
+            order = self.orders[k] = build_order(**fields)
+            order.closed = 'exit_index' in fields
+        return order
+
+
+class ClosedOrders(object):
+    """
+    Closed orders, in the order they were closed. Works like a list of
+    orders, but orders recorded in bulk are kept as OrderColumns.
+    """
+    def __init__(self):
+        self.parts = []
+
+    def append(self, order):
+        if not self.parts or not isinstance(self.parts[-1], list):
+            self.parts.append([])
+        self.parts[-1].append(order)
+
+    def extend_columns(self, **columns):
+        self.parts.append(OrderColumns(**columns))
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            for k in xrange(len(part)):
+                yield part[k]
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in xrange(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if k >= 0:
+            for part in self.parts:
+                if k < len(part):
+                    return part[k]
+                k -= len(part)
+        raise IndexError('closed order index out of range')
+
+
+class TradeLedger(object):
+    """
+    Closed orders stored as columns (one typed array per field), so that
+    they can be exported as a numpy record array or a DataFrame without
+    iterating over order objects. Entry and exit are bar indexes.
+    """
+    columns = (('id', 'l', np.int_),
+               ('side', 'b', np.int8),
+               ('quantity', 'l', np.int_),
+               ('entry_index', 'l', np.int_),
+               ('exit_index', 'l', np.int_),
+               ('entry_price', 'd', np.float64),
+               ('exit_price', 'd', np.float64),
+               ('profit', 'd', np.float64),
+               ('profit_percent', 'd', np.float64),
+               ('costs', 'd', np.float64))
+
+    def __init__(self):
+        self.data = dict((name, array(code)) for name, code, _ in self.columns)
+
+    def __len__(self):
+        return len(self.data['id'])
+
+    def append(self, order):
+        """
+        Record a closed order. Missing bar indexes are recorded as -1.
+        """
+        data = self.data
+        data['id'].append(order.id)
+        data['side'].append(order.side)
+        data['quantity'].append(order.quantity)
+        data['entry_index'].append(-1 if order.entry_index is None else order.entry_index)
+        data['exit_index'].append(-1 if order.exit_index is None else order.exit_index)
+        data['entry_price'].append(order.entry_price)
+        data['exit_price'].append(order.exit_price)
+        data['profit'].append(order.profit)
+        data['profit_percent'].append(order.profit_percent)
+        data['costs'].append(order.costs)
+
+    def extend(self, **columns):
+        """
+        Record many closed orders at once, given one array per column.
+        """
+        for name, code, dtype in self.columns:
+            self.data[name].extend(np.asarray(columns[name], dtype=dtype).tolist())
+
+    def column(self, name):
+        """
+        A column as a numpy array (a view on the ledger's memory; it is
+        invalidated by further appends).
+        """
+        dtype = dict((column, dtype) for column, _, dtype in self.columns)[name]
+        if not len(self):
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(self.data[name], dtype=dtype)
+
+    def to_records(self):
+        """
+        Closed orders as a numpy record array.
+        """
+        return np.rec.fromarrays([self.column(name) for name, _, _ in self.columns],
+                                 names=[name for name, _, _ in self.columns])
+
+    def to_dataframe(self, timeline=None):
+        """
+        Closed orders as a pandas DataFrame. If timeline is given, entry_time
+        and exit_time columns are added by looking up the bar indexes in it.
+        """
+        df = pandas.DataFrame(dict((name, self.column(name).copy())
+                                   for name, _, _ in self.columns),
+                              columns=[name for name, _, _ in self.columns])
+        df['type'] = np.where(df['side'] == BUY, 'buy', 'sell')
+        if timeline is not None:
+            timeline = np.asarray(timeline)
+            df['entry_time'] = timeline[df['entry_index'].values]
+            df['exit_time'] = timeline[df['exit_index'].values]
+        return df
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Open orders indexed by their stop loss and target triggers.
+"""
+
+from collections import OrderedDict
+import heapq
+import itertools
+
+from order import BUY
+
+NEG_INF = float('-inf')
+
+
+def trigger_key(trigger):
+    """
+    Missing (None) triggers are stored as -inf, which compares with prices
+    the same way None does in python 2.
+    """
+    return NEG_INF if trigger is None else trigger
+
+
+class OrderBook(object):
+    """
+    Open orders, in the order they were placed.
+
+    Besides keeping the orders, the book keeps four heaps - stop loss and
+    target triggers of buy and of sell orders - arranged so that the order
+    whose trigger is hit first is on top. pop_triggered() then only looks
+    at orders which get closed by the candle, instead of calling
+    try_to_close on every open order.
+
+    A buy order closes when stop_loss_trigger >= candle_low or
+    target_trigger <= candle_high, a sell order when
+    stop_loss_trigger <= candle_high or target_trigger >= candle_low,
+    which is exactly when BuyOrder/SellOrder.try_to_close would close it.
+    Triggers must not be changed once an order is in the book.
+
+    Orders closed by a heap are left in the other heap and skipped when
+    they surface. A heap is rebuilt without them once they outnumber the
+    open orders it holds, so heaps (and pickled snapshots of the book) stay
+    proportional to the number of open orders.
+    """
+    def __init__(self):
+        self.orders = OrderedDict()     # sequence number -> order
+        self.sequence = itertools.count()
+        self.buy_orders = 0             # open buy orders, the rest are sell
+        self.buy_stop_loss = []         # (-trigger, seq), highest trigger on top
+        self.buy_target = []            # (trigger, seq), lowest trigger on top
+        self.sell_stop_loss = []        # (trigger, seq), lowest trigger on top
+        self.sell_target = []           # (-trigger, seq), highest trigger on top
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        return self.orders.itervalues()
+
+    def __repr__(self):
+        return '<OrderBook: %d open orders>' % len(self.orders)
+
+    def __getstate__(self):
+        # itertools.count can't be pickled - keep its next value instead
+        state = self.__dict__.copy()
+        state['sequence'] = next(self.sequence)
+        self.sequence = itertools.count(state['sequence'])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sequence = itertools.count(state['sequence'])
+
+    def append(self, order):
+        seq = next(self.sequence)
+        self.orders[seq] = order
+        stop_loss = trigger_key(order.stop_loss_trigger)
+        target = trigger_key(order.target_trigger)
+        if order.side == BUY:
+            self.buy_orders += 1
+            heapq.heappush(self.buy_stop_loss, (-stop_loss, seq))
+            heapq.heappush(self.buy_target, (target, seq))
+        else:
+            heapq.heappush(self.sell_stop_loss, (stop_loss, seq))
+            heapq.heappush(self.sell_target, (-target, seq))
+
+    def pop_triggered(self, candle_high, candle_low):
+        """
+        Remove and return orders whose stop loss or target is hit by a
+        candle, latest placed order first (the order in which backtest()
+        has always closed them).
+        """
+        triggered = []
+        orders = self.orders
+        heap = self.buy_stop_loss
+        while heap and -heap[0][0] >= candle_low:
+            triggered.append(heapq.heappop(heap)[1])
+        heap = self.buy_target
+        while heap and heap[0][0] <= candle_high:
+            triggered.append(heapq.heappop(heap)[1])
+        heap = self.sell_stop_loss
+        while heap and heap[0][0] <= candle_high:
+            triggered.append(heapq.heappop(heap)[1])
+        heap = self.sell_target
+        while heap and -heap[0][0] >= candle_low:
+            triggered.append(heapq.heappop(heap)[1])
+
+        if not triggered:
+            return triggered
+        triggered = [seq for seq in set(triggered) if seq in orders]
+        triggered.sort(reverse=True)
+        triggered = [orders.pop(seq) for seq in triggered]
+        self.buy_orders -= sum(1 for order in triggered if order.side == BUY)
+        self.compact()
+        return triggered
+
+    def compact(self):
+        """
+        Rebuild heaps in which closed orders outnumber open ones.
+        """
+        orders = self.orders
+        sell_orders = len(orders) - self.buy_orders
+        for name, live in (('buy_stop_loss', self.buy_orders),
+                           ('buy_target', self.buy_orders),
+                           ('sell_stop_loss', sell_orders),
+                           ('sell_target', sell_orders)):
+            heap = getattr(self, name)
+            if len(heap) > 2 * live:
+                heap = [entry for entry in heap if entry[1] in orders]
+                heapq.heapify(heap)
+                setattr(self, name, heap)
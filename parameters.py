@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Parameters of strategies and models are their class attributes, and can
+be overridden per instance with keyword arguments, e.g.
+Strategy2(ema_fast_window=5).
+"""
+
+
+def set_parameters(instance, params):
+    """
+    Override class attribute parameters of instance with the values in
+    params. Unknown names raise AttributeError.
+    """
+    cls = instance.__class__
+    for name, value in params.iteritems():
+        if not hasattr(cls, name):
+            raise AttributeError('%s has no parameter %s' % (cls.__name__, name))
+        setattr(instance, name, value)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Plots of a finished backtest - stock price and percentage profit against
+the timeline, with statistics.
+
+Long series are decimated before plotting - the min and max of every
+bucket of bars (one bucket per horizontal pixel or so) are kept, which
+looks the same as plotting every bar. Animation frames only update line
+data (set_data) of lines created once, and are drawn with blitting.
+
+On a non-interactive (headless) backend like Agg, or when a path is
+given, figures are rendered straight to files without pyplot - PNG, SVG,
+PDF for plots, MP4 (needs ffmpeg), GIF (needs imagemagick or pillow) or
+HTML for animations. This keeps no global pyplot state, so reports for any
+number of backtests can be rendered in one process.
+"""
+
+import datetime
+
+import numpy as np
+import matplotlib
+import matplotlib.dates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from matplotlib.rcsetup import non_interactive_bk
+
+DEFAULT_MAX_POINTS = 2000       # points per line, after decimation
+TICK_LABELS = 10
+ANIMATION_WRITERS = {'.mp4': ('ffmpeg', 'ffmpeg_file'),
+                     '.gif': ('imagemagick', 'imagemagick_file', 'pillow'),
+                     '.html': ('html',)}
+
+
+def headless():
+    """
+    True if matplotlib uses a backend which can not show windows.
+    """
+    return matplotlib.get_backend().lower() in [backend.lower() for backend in non_interactive_bk]
+
+
+def decimate_minmax(values, buckets):
+    """
+    Indexes of the points to plot for values (at most 2 * buckets) - the
+    minimum and maximum of each of 'buckets' equal runs of values, in
+    order. All indexes are returned if there are fewer than 2 * buckets
+    values.
+    """
+    n = len(values)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    rows = -(-n // size)
+    padded = np.pad(np.asarray(values, dtype=np.float64), (0, rows * size - n), 'edge')
+    padded = padded.reshape(rows, size)
+    offsets = np.arange(rows) * size
+    lowest = padded.argmin(axis=1) + offsets
+    highest = padded.argmax(axis=1) + offsets
+    indexes = np.column_stack([np.minimum(lowest, highest),
+                               np.maximum(lowest, highest)]).ravel()
+    return np.unique(np.minimum(indexes, n - 1))
+
+
+def x_values(timeline):
+    """
+    Timeline as floats for plotting - matplotlib date numbers for
+    datetimes, the values themselves otherwise.
+    """
+    timeline = np.asarray(timeline)
+    if timeline.dtype.kind == 'M':
+        epoch = matplotlib.dates.date2num(datetime.datetime(1970, 1, 1))
+        return timeline.astype('datetime64[s]').astype(np.int64) / 86400.0 + epoch
+    if timeline.dtype == object:
+        return np.asarray(matplotlib.dates.date2num(timeline.tolist()))
+    return timeline.astype(np.float64)
+
+
+def maximize(figure):
+    """
+    Maximize the window of a figure, on backends which know how to.
+    """
+    manager = figure.canvas.manager
+    window = getattr(manager, 'window', None)
+    for maximize_window in (lambda: window.showMaximized(),                 # Qt
+                            lambda: window.state('zoomed'),                 # Tk
+                            lambda: manager.frame.Maximize(True)):          # wx
+        try:
+            maximize_window()
+            return
+        except Exception:
+            pass
+
+
+class BacktestPlot(object):
+    """
+    Figure of a backtest - stock price (top) and percentage profit
+    (bottom), with statistics. The figure is drawn by render(i), showing
+    bars up to i.
+    """
+    def __init__(self, backtester, max_points=DEFAULT_MAX_POINTS, figsize=(16, 9),
+                 interactive=None):
+        if interactive is None:
+            interactive = not headless()
+        self.backtester = backtester
+        self.max_points = max_points
+        self.interactive = interactive
+
+        n = len(backtester.timeline)
+        self.n = n
+        self.x = x_values(backtester.timeline)
+        self.prices = np.asarray(backtester.candles_close, dtype=np.float64)
+        _, self.profit_percents = backtester.metrics.realized_curves(n)
+        buckets = max(1, max_points // 2)
+        self.price_points = decimate_minmax(self.prices, buckets)
+        self.profit_points = decimate_minmax(self.profit_percents, buckets)
+
+        if interactive:
+            import matplotlib.pyplot as plt
+            self.figure = plt.figure(figsize=figsize)
+        else:
+            self.figure = Figure(figsize=figsize)
+            FigureCanvasAgg(self.figure)
+        self.ax1 = self.figure.add_subplot(2, 1, 1)
+        self.ax2 = self.figure.add_subplot(2, 1, 2)
+        self.setup_axes()
+
+    def setup_axes(self):
+        backtester = self.backtester
+        for ax, ylabel, values in ((self.ax1, 'Stock price', self.prices),
+                                   (self.ax2, 'Percentage profit', self.profit_percents)):
+            ax.set_xlabel('Date')
+            ax.set_ylabel(ylabel)
+            if self.n:
+                ax.set_xlim([self.x[0], self.x[-1]])
+                low, high = np.nanmin(values), np.nanmax(values)
+                if low < high:
+                    ax.set_ylim([low, high])
+            if hasattr(backtester, 'timeline_labels'):
+                step = max(1, self.n // TICK_LABELS)
+                ax.set_xticks(self.x[::step])
+                ax.set_xticklabels(backtester.timeline_labels[::step])
+            elif np.asarray(backtester.timeline).dtype.kind in 'MO':
+                locator = matplotlib.dates.AutoDateLocator()
+                ax.xaxis.set_major_locator(locator)
+                ax.xaxis.set_major_formatter(matplotlib.dates.AutoDateFormatter(locator))
+
+        self.price_line, = self.ax1.plot([], [], color='b')
+        self.profit_line, = self.ax2.plot([], [], color='b')
+        # For showing statistics on plot
+        self.plot_text = Rectangle((0, 0), 1.5, 1, fc="w", fill=False, edgecolor='none', linewidth=0)
+        self.legend = self.ax2.legend([self.plot_text], [backtester.get_statistics(-1)],
+                                      loc='upper left')
+        self.figure.tight_layout()
+
+    def visible(self, points, i):
+        """
+        Decimated points up to bar i - whole buckets before i, then every
+        bar of the bucket i is in, so no value after bar i is shown.
+        """
+        k = np.searchsorted(points, i, 'right')
+        start = points[k - 1] + 1 if k else 0
+        return np.concatenate([points[:k], np.arange(start, i + 1)])
+
+    def render(self, i=None):
+        """
+        Update lines and statistics to show bars up to i (default: all).
+        Returns the updated artists.
+        """
+        if i is None:
+            i = self.n - 1
+        price = self.visible(self.price_points, i)
+        profit = self.visible(self.profit_points, i)
+        self.price_line.set_data(self.x[price], self.prices[price])
+        self.profit_line.set_data(self.x[profit], self.profit_percents[profit])
+        self.legend.get_texts()[0].set_text(self.backtester.get_statistics(i))
+        return self.price_line, self.profit_line, self.legend
+
+    def save(self, path, dpi=100):
+        """
+        Render all bars and save to path (format from its extension).
+        """
+        self.render()
+        self.figure.savefig(path, dpi=dpi)
+
+    def show(self):
+        import matplotlib.pyplot as plt
+        self.render()
+        maximize(self.figure)
+        plt.show()
+
+    def frames(self, count):
+        step = max(1, self.n // count)
+        return range(0, self.n, step) + [self.n - 1]
+
+    def animate(self, path=None, frames=100, interval=10, fps=25, dpi=100):
+        """
+        Animate bars appearing over 'frames' frames. With path the animation
+        is saved (.mp4, .gif or anything a matplotlib writer handles),
+        otherwise it is shown in a window until closed.
+        """
+        from matplotlib import animation
+
+        def init():
+            self.price_line.set_data([], [])
+            self.profit_line.set_data([], [])
+            return self.price_line, self.profit_line, self.legend
+
+        anim = animation.FuncAnimation(self.figure, self.render, frames=self.frames(frames),
+                                       init_func=init, interval=interval, blit=True,
+                                       repeat=False)
+        if path is None:
+            import matplotlib.pyplot as plt
+            maximize(self.figure)
+            plt.show()
+        else:
+            anim.save(path, writer=self.writer(path, fps), dpi=dpi)
+        return anim
+
+    def writer(self, path, fps):
+        from matplotlib import animation
+        extension = path[path.rfind('.'):].lower()
+        for name in ANIMATION_WRITERS.get(extension, ()):
+            if animation.writers.is_available(name):
+                return animation.writers[name](fps=fps)
+        raise ValueError('No matplotlib movie writer available for %s files '
+                         '(available: %s)' % (extension, ', '.join(animation.writers.list())))
+
+
+def render_report(backtester, path, max_points=DEFAULT_MAX_POINTS, figsize=(16, 9), dpi=100):
+    """
+    Save the plot of a finished backtest to path without any window
+    (e.g. on batch nodes).
+    """
+    BacktestPlot(backtester, max_points, figsize, interactive=False).save(path, dpi)
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Backtesting one strategy over many symbols at once.
+
+Candles of all symbols are aligned on a shared timeline into 2D arrays of
+shape (bars, symbols), with NaN where a symbol has no candle. The engine
+steps through the timeline once; at every bar strategy() receives one row
+per price field, i.e. the candles of all symbols as numpy arrays, so
+indicators and signals are computed for all symbols in one go. SymbolSMA
+and SymbolEMA below keep a separate window per symbol and skip bars where
+a symbol has no candle; CrossoverArray from indicators.py works on their
+values. Only symbols with open orders are visited when matching stop loss
+and target triggers, and each symbol's orders are kept in an OrderBook.
+
+Example -
+
+    class EMACrossover(PortfolioBacktesting):
+        def read_data(self):
+            for symbol in ('TATASTEEL', 'SBIN'):
+                self.add_symbol(symbol, load_candles(symbol + '.csv'))
+
+        def initialize(self):
+            self.ema_fast = self.add_indicator(SymbolEMA(3, len(self.symbols)))
+            self.ema_slow = self.add_indicator(SymbolEMA(15, len(self.symbols)))
+            self.crossover = CrossoverArray()
+
+        def strategy(self, i, candles_open, candles_close, candles_high, candles_low):
+            crossover = self.crossover.update(self.ema_fast.value, self.ema_slow.value)
+            for k in np.flatnonzero(crossover == 1):
+                self.buy_trade(self.symbols[k], float(candles_close[k]))
+"""
+
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+
+from backtesting import BACKTEST_CHUNK_SIZE, as_list
+from indicators import Indicator
+from metrics import MetricsAccumulator
+from order import BuyOrder, SellOrder, TradeLedger
+from orderbook import OrderBook
+from parameters import set_parameters
+
+
+class SymbolWindow(object):
+    """
+    Last 'length' values of every symbol, as a (length, symbols) ring
+    buffer. NaN values (bars without a candle) are skipped per symbol.
+    """
+    def __init__(self, length, symbols):
+        self.length = length
+        self.values = np.full((length, symbols), np.nan)
+        self.next = np.zeros(symbols, dtype=np.int64)    # next row to write
+        self.count = np.zeros(symbols, dtype=np.int64)
+        self.columns = np.arange(symbols)
+
+    def append(self, row):
+        columns = np.flatnonzero(~np.isnan(row))
+        self.values[self.next[columns], columns] = row[columns]
+        self.next[columns] = (self.next[columns] + 1) % self.length
+        self.count[columns] += 1
+        return columns
+
+    def ordered(self):
+        """
+        Window of every symbol, oldest value first.
+        """
+        rows = (self.next + np.arange(self.length)[:, None]) % self.length
+        return self.values[rows, self.columns]
+
+    @property
+    def full(self):
+        return self.count >= self.length
+
+
+class SymbolSMA(Indicator):
+    """
+    Simple Moving Average per symbol. value is an array with one entry per
+    symbol (NaN until that symbol has 'window' candles). Same results as
+    indicators.SMA run on each symbol's own candles.
+    """
+    def __init__(self, window, symbols, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.values = SymbolWindow(window, symbols)
+        self.value = np.full(symbols, np.nan)
+
+    def update(self, row):
+        if len(self.values.append(row)):
+            total = 0
+            for values in self.values.ordered():
+                total = total + values
+            self.value = np.where(self.values.full, total / float(self.window), np.nan)
+        return self.value
+
+
+class SymbolEMA(Indicator):
+    """
+    Exponential Moving Average per symbol. value is an array with one entry
+    per symbol (NaN until that symbol has 2*window candles). Same results as
+    indicators.EMA run on each symbol's own candles.
+    """
+    def __init__(self, window, symbols, source=None):
+        Indicator.__init__(self, source)
+        self.window = window
+        self.c = 2.0 / (window + 1)
+        self.values = SymbolWindow(2*window, symbols)
+        self.value = np.full(symbols, np.nan)
+
+    def update(self, row):
+        if len(self.values.append(row)):
+            window = self.window
+            c = self.c
+            values = self.values.ordered()
+            current_ema = 0
+            for value in values[:window]:
+                current_ema = current_ema + value
+            current_ema = current_ema / float(window)
+            for value in values[window:]:
+                current_ema = (c * value) + ((1 - c) * current_ema)
+            self.value = np.where(self.values.full, current_ema, np.nan)
+        return self.value
+
+
+class PortfolioBacktesting(object):
+    __metaclass__ = ABCMeta
+
+    # Parameters
+    initial_capital = 1000000.0
+    fill_model = None               # see costs.py
+    cost_model = None
+
+    def __init__(self, **params):
+        set_parameters(self, params)
+
+        # Symbols and their CandleSeries, in the order they were added.
+        # Column k of candles_* holds candles of self.symbols[k].
+        self.symbols = []
+        self.symbol_index = {}
+        self.series = {}
+
+        # Shared timeline (datetime64) and aligned candles, filled by align()
+        self.timeline = None
+        self.candles_open = None
+        self.candles_close = None
+        self.candles_high = None
+        self.candles_low = None
+
+        # For keeping track of orders, per symbol
+        self.open_orders = {}
+        self.closed_orders = {}
+        self.ledgers = {}               # closed orders as columns
+        self.metrics = {}               # running trade metrics
+        self.active_symbols = set()     # symbols with open orders
+
+        # Portfolio level accounting
+        self.cash = self.initial_capital
+        self.positions = None           # signed quantity per symbol
+        self.last_close = None          # last known close per symbol
+        self.equity = None              # per bar
+        self.exposure = None            # per bar, gross value of positions
+        self.peak_equity = self.initial_capital
+        self.max_drawdown = 0.0
+        self.max_exposure = 0.0
+
+        # Used during backtesting
+        self.current_index = None
+        self.current_time = None
+
+        self.indicators = []
+
+        self.read_data()
+        self.align()
+        self.initialize()
+
+    @abstractmethod
+    def read_data(self):
+        """
+        Implement this method to add symbols with self.add_symbol
+        """
+
+    def initialize(self):
+        """
+        Override this method to set up indicators and other state once data
+        is aligned (self.symbols is known).
+        """
+
+    @abstractmethod
+    def strategy(self, i, candles_open, candles_close, candles_high, candles_low):
+        """
+        Implement your algo trading strategy in this method. It is called
+        once per bar with one numpy array per price field, holding the
+        candle of every symbol (NaN for symbols without a candle at this
+        bar). Call self.buy_trade / self.sell_trade with a symbol to place
+        orders.
+        """
+
+    def add_symbol(self, symbol, candles):
+        if symbol in self.series:
+            raise ValueError('Symbol %s added twice' % symbol)
+        self.symbol_index[symbol] = len(self.symbols)
+        self.symbols.append(symbol)
+        self.series[symbol] = candles
+        self.open_orders[symbol] = OrderBook()
+        self.closed_orders[symbol] = []
+        self.ledgers[symbol] = TradeLedger()
+        self.metrics[symbol] = MetricsAccumulator()
+
+    def align(self):
+        """
+        Build the shared timeline (union of all symbols' times) and the
+        (bars, symbols) candle arrays.
+        """
+        times = np.unique(np.concatenate([self.series[symbol].time
+                                          for symbol in self.symbols]))
+        shape = (len(times), len(self.symbols))
+        self.candles_open = np.full(shape, np.nan)
+        self.candles_close = np.full(shape, np.nan)
+        self.candles_high = np.full(shape, np.nan)
+        self.candles_low = np.full(shape, np.nan)
+        for k, symbol in enumerate(self.symbols):
+            candles = self.series[symbol]
+            rows = np.searchsorted(times, candles.time)
+            self.candles_open[rows, k] = candles.open
+            self.candles_close[rows, k] = candles.close
+            self.candles_high[rows, k] = candles.high
+            self.candles_low[rows, k] = candles.low
+        self.timeline = times.view('datetime64[s]')
+
+        self.positions = np.zeros(len(self.symbols))
+        self.last_close = np.full(len(self.symbols), np.nan)
+        self.equity = np.full(len(times), np.nan)
+        self.exposure = np.full(len(times), np.nan)
+
+    def add_indicator(self, indicator):
+        """
+        Register a streaming indicator. It is updated with the rows of all
+        symbols at every bar, before self.strategy is called.
+        """
+        self.indicators.append(indicator)
+        return indicator
+
+    def buy_trade(self, symbol, entry_price, quantity=1,
+                  stop_loss_trigger=None, target_trigger=None):
+        order = BuyOrder(entry_price, quantity, self.current_time,
+                         stop_loss_trigger, target_trigger)
+        self.open_position(symbol, order, quantity)
+        return order
+
+    def sell_trade(self, symbol, entry_price, quantity=1,
+                   stop_loss_trigger=None, target_trigger=None):
+        order = SellOrder(entry_price, quantity, self.current_time,
+                          stop_loss_trigger, target_trigger)
+        self.open_position(symbol, order, -quantity)
+        return order
+
+    def open_position(self, symbol, order, signed_quantity):
+        order.entry_index = self.current_index
+        self.open_orders[symbol].append(order)
+        self.active_symbols.add(symbol)
+        self.positions[self.symbol_index[symbol]] += signed_quantity
+        self.cash -= signed_quantity * order.entry_price
+        self.metrics[symbol].on_open(order)
+
+    def close_position(self, symbol, order):
+        order.exit_index = self.current_index
+        signed_quantity = order.side * order.quantity
+        self.positions[self.symbol_index[symbol]] -= signed_quantity
+        self.cash += signed_quantity * order.exit_price - order.costs
+        self.closed_orders[symbol].append(order)
+        self.ledgers[symbol].append(order)
+        self.metrics[symbol].on_close(order)
+
+    def backtest(self):
+        """
+        Call this method to start backtesting
+        """
+        n = len(self.timeline)
+        for start in xrange(0, n, BACKTEST_CHUNK_SIZE):
+            stop = min(start + BACKTEST_CHUNK_SIZE, n)
+            times = as_list(self.timeline[start:stop])
+            for i in xrange(start, stop):
+                self.backtest_bar(i, times[i - start])
+
+    def backtest_bar(self, i, time):
+        self.current_index = i
+        self.current_time = time
+        candles_open = self.candles_open[i]
+        candles_close = self.candles_close[i]
+        candles_high = self.candles_high[i]
+        candles_low = self.candles_low[i]
+
+        # Try to close open orders of symbols which have them
+        for symbol in list(self.active_symbols):
+            k = self.symbol_index[symbol]
+            candle_high = candles_high[k]
+            if candle_high != candle_high:      # NaN: no candle at this bar
+                continue
+            candle_high = float(candle_high)
+            candle_low = float(candles_low[k])
+            orders = self.open_orders[symbol]
+            for order in orders.pop_triggered(candle_high, candle_low):
+                order.try_to_close(candle_high, candle_low, time,
+                                   self.fill_model, self.cost_model)
+                self.close_position(symbol, order)
+            if not orders:
+                self.active_symbols.discard(symbol)
+
+        # Update indicators with current candles of all symbols
+        for indicator in self.indicators:
+            indicator.update_candle(candles_open, candles_close,
+                                    candles_high, candles_low)
+
+        # Execute strategy (which will generate create open orders)
+        self.strategy(i, candles_open, candles_close, candles_high, candles_low)
+
+        # Mark to market
+        np.copyto(self.last_close, candles_close, where=~np.isnan(candles_close))
+        values = np.where(self.positions != 0, self.positions * self.last_close, 0.0)
+        equity = self.equity[i] = self.cash + values.sum()
+        exposure = self.exposure[i] = np.abs(values).sum()
+        if equity > self.peak_equity:
+            self.peak_equity = equity
+        elif self.peak_equity - equity > self.max_drawdown:
+            self.max_drawdown = self.peak_equity - equity
+        if exposure > self.max_exposure:
+            self.max_exposure = exposure
+
+    def statistics(self):
+        """
+        Get end of simulation statistics as a dict - portfolio level ones,
+        and per symbol trade counts under 'symbols'.
+        """
+        if self.current_index is None:
+            final_equity = self.initial_capital
+        else:
+            final_equity = self.equity[self.current_index]
+        symbols = {}
+        for symbol in self.symbols:
+            stats = self.metrics[symbol].statistics(len(self.timeline))
+            del stats['profit_percent'], stats['max_drawdown']
+            symbols[symbol] = stats
+        return {'initial_capital': self.initial_capital,
+                'final_equity': final_equity,
+                'return_percent': 100.0 * (final_equity / self.initial_capital - 1),
+                'max_drawdown': self.max_drawdown,
+                'max_exposure': self.max_exposure,
+                'executed_trades': sum(s['executed_trades'] for s in symbols.values()),
+                'open_trades': sum(s['open_trades'] for s in symbols.values()),
+                'symbols': symbols}
+
+    def get_statistics(self):
+        stats = self.statistics()
+        lines = ["""
+Portfolio statistics:
+---------------------------
+Initial capital: %(initial_capital)f
+Final equity: %(final_equity)f
+Return: %(return_percent)f %%
+Max drawdown: %(max_drawdown)f
+Max exposure: %(max_exposure)f
+Executed trades: %(executed_trades)d
+Open trades: %(open_trades)d
+""" % stats]
+        for symbol in self.symbols:
+            s = stats['symbols'][symbol]
+            lines.append('%s: executed %d, open %d, profitable %d, loss making %d, profit %f'
+                         % (symbol, s['executed_trades'], s['open_trades'],
+                            s['profitable_trades'], s['loss_making_trades'], s['profit']))
+        return '\n'.join(lines)
+
+    def print_statistics(self):
+        print self.get_statistics()
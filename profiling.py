@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Profiling of AlgoTradingBacktesting.backtest.
+
+    profiler = BacktestProfiler(cprofile=True)
+    backtester.backtest(profiler=profiler)
+    profiler.print_report()
+    profiler.export('profile.json')
+
+The profiled run swaps in an instrumented version of backtest_candle for
+the whole run, so backtest() without a profiler runs exactly as before.
+Every bar's time is split into -
+1. matching: finding and closing orders hit by the candle (order book,
+   try_to_close)
+2. bookkeeping: recording closed orders (record_close - closed orders,
+   ledger, metrics) and setting the current candle
+3. indicators: updating registered indicators
+4. strategy: the strategy() body, including the orders it places
+Time spent logging events (inside matching and strategy) is measured too,
+and counters kept - orders created and closed, most open orders.
+
+Optionally the run is wrapped in cProfile, and in tracemalloc for memory
+allocations when it is available (python 3, or python 2 with the
+pytracemalloc patches).
+"""
+
+from array import array
+import cProfile
+import json
+import pstats
+import StringIO
+import timeit
+
+import numpy as np
+
+import events
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+STAGES = ('matching', 'bookkeeping', 'indicators', 'strategy')
+
+clock = timeit.default_timer
+
+
+class TimingSink(events.Sink):
+    """
+    Passes events to another sink, timing how long it takes.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.level = sink.level
+        self.seconds = 0.0
+        self.count = 0
+
+    def log(self, level, message, *args):
+        started = clock()
+        self.sink.log(level, message, *args)
+        self.seconds += clock() - started
+        self.count += 1
+
+    def flush(self):
+        self.sink.flush()
+
+
+class BacktestProfiler(object):
+    """
+    Collects per bar stage timings and counters of one backtest() run.
+    """
+    def __init__(self, cprofile=False, tracemalloc=False, top=20):
+        self.use_cprofile = cprofile
+        self.use_tracemalloc = tracemalloc
+        self.top = top
+
+        self.timings = dict((stage, array('d')) for stage in STAGES)
+        self.counters = {'bars': 0, 'orders_created': 0, 'orders_closed': 0,
+                         'max_open_orders': 0, 'events_logged': 0}
+        self.logging_seconds = 0.0
+        self.total_seconds = 0.0
+        self.profile = None
+        self.memory_snapshot = None
+
+        self.backtester = None
+        self.sink = None
+        self.previous_sink = None
+        self.started = None
+        self.created_before = 0
+        self.closed_before = 0
+
+    def start(self, backtester):
+        """
+        Called by backtest() before the first bar. Returns the instrumented
+        function processing a candle.
+        """
+        self.backtester = backtester
+        self.created_before = len(backtester.metrics.entry_index)
+        self.closed_before = len(backtester.closed_orders)
+        self.sink = TimingSink(events.sink)
+        self.previous_sink = events.set_sink(self.sink)
+
+        timings = self.timings
+        matching = timings['matching'].append
+        bookkeeping = timings['bookkeeping'].append
+        indicators = timings['indicators'].append
+        strategy = timings['strategy'].append
+        counters = self.counters
+        open_orders = backtester.open_orders
+        set_current_candle = backtester.set_current_candle
+        close_triggered_orders = backtester.close_triggered_orders
+        update_indicators = backtester.update_indicators
+        strategy_function = backtester.strategy
+
+        # record_close is timed through an instance attribute shadowing the
+        # method for the duration of the run
+        record_close = backtester.record_close
+        recording = [0.0]
+
+        def timed_record_close(order):
+            started = clock()
+            record_close(order)
+            recording[0] += clock() - started
+        backtester.record_close = timed_record_close
+
+        def process_candle(i, time, candle_open, candle_close, candle_high, candle_low):
+            t0 = clock()
+            set_current_candle(i, time, candle_open, candle_close, candle_high, candle_low)
+            t1 = clock()
+            recording[0] = 0.0
+            close_triggered_orders()
+            t2 = clock()
+            update_indicators()
+            t3 = clock()
+            strategy_function(i, candle_open, candle_close, candle_high, candle_low)
+            t4 = clock()
+            matching(t2 - t1 - recording[0])
+            bookkeeping(t1 - t0 + recording[0])
+            indicators(t3 - t2)
+            strategy(t4 - t3)
+            if len(open_orders) > counters['max_open_orders']:
+                counters['max_open_orders'] = len(open_orders)
+
+        if self.use_tracemalloc:
+            if tracemalloc is None:
+                events.sink.log(events.WARNING, 'tracemalloc is not available, '
+                                'memory allocations are not traced')
+            else:
+                tracemalloc.start()
+        if self.use_cprofile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started = clock()
+        return process_candle
+
+    def stop(self):
+        """
+        Called by backtest() after the last bar.
+        """
+        self.total_seconds += clock() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+        if self.use_tracemalloc and tracemalloc is not None:
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        backtester = self.backtester
+        del backtester.record_close
+        events.set_sink(self.previous_sink)
+        self.logging_seconds += self.sink.seconds
+        self.counters['events_logged'] += self.sink.count
+        self.counters['bars'] = len(self.timings['strategy'])
+        self.counters['orders_created'] += len(backtester.metrics.entry_index) - self.created_before
+        self.counters['orders_closed'] += len(backtester.closed_orders) - self.closed_before
+
+    def stage_timings(self, stage):
+        values = self.timings[stage]
+        if not len(values):
+            return np.zeros(0)
+        return np.frombuffer(values, dtype=np.float64)
+
+    def summary(self):
+        """
+        Timings and counters as a dict - for every stage total seconds,
+        share of the run, mean and percentiles per bar (microseconds).
+        """
+        stages = {}
+        for stage in STAGES:
+            values = self.stage_timings(stage)
+            stages[stage] = {
+                'seconds': values.sum(),
+                'share_percent': 100.0 * values.sum() / self.total_seconds
+                                 if self.total_seconds else 0.0,
+                'mean_us': values.mean() * 1e6 if len(values) else 0.0,
+                'p50_us': np.percentile(values, 50) * 1e6 if len(values) else 0.0,
+                'p99_us': np.percentile(values, 99) * 1e6 if len(values) else 0.0,
+                'max_us': values.max() * 1e6 if len(values) else 0.0}
+        summary = {'total_seconds': self.total_seconds,
+                   'bars_per_second': self.counters['bars'] / self.total_seconds
+                                      if self.total_seconds else 0.0,
+                   'logging_seconds': self.logging_seconds,
+                   'stages': stages,
+                   'counters': dict(self.counters)}
+        if self.profile is not None:
+            summary['cprofile'] = self.cprofile_report()
+        if self.memory_snapshot is not None:
+            summary['tracemalloc'] = [str(stat) for stat in
+                                      self.memory_snapshot.statistics('lineno')[:self.top]]
+        return summary
+
+    def cprofile_report(self, sort='cumulative'):
+        stream = StringIO.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(self.top)
+        return stream.getvalue()
+
+    def report(self):
+        """
+        Summary formatted for printing.
+        """
+        summary = self.summary()
+        lines = ["""
+Profile:
+---------------------------
+Bars: %d in %.3f s (%.0f bars/s)
+Orders created: %d, closed: %d, most open: %d
+Events logged: %d in %.3f s (included in matching and strategy)
+""" % (self.counters['bars'], summary['total_seconds'], summary['bars_per_second'],
+       self.counters['orders_created'], self.counters['orders_closed'],
+       self.counters['max_open_orders'], self.counters['events_logged'],
+       self.logging_seconds),
+                 '%-12s %10s %7s %10s %10s %10s' % ('stage', 'seconds', '%', 'mean us',
+                                                     'p99 us', 'max us')]
+        for stage in STAGES:
+            s = summary['stages'][stage]
+            lines.append('%-12s %10.4f %7.1f %10.2f %10.2f %10.2f'
+                         % (stage, s['seconds'], s['share_percent'], s['mean_us'],
+                            s['p99_us'], s['max_us']))
+        if 'cprofile' in summary:
+            lines.append(summary['cprofile'])
+        if 'tracemalloc' in summary:
+            lines.append('Top allocations:')
+            lines.extend(summary['tracemalloc'])
+        return '\n'.join(lines)
+
+    def print_report(self):
+        print self.report()
+
+    def export(self, path, profile_path=None):
+        """
+        Write the summary as JSON to path, and the raw cProfile data (for
+        pstats, snakeviz, ...) to profile_path.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        if profile_path is not None and self.profile is not None:
+            self.profile.dump_stats(profile_path)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Resampling of candles to higher timeframes (e.g. 1 minute to 5 minute,
+15 minute, hourly or daily candles).
+
+Each timeframe is built from the base CandleSeries in one pass of numpy
+reductions over runs of base candles (np.maximum.reduceat etc.) and is
+cached per CandleSeries, so every strategy using the same data (see
+dataloader.load_candles, which returns the same CandleSeries for the same
+file) shares it.
+
+A strategy running on base candles must only see higher timeframe candles
+which are complete at the current bar. Timeframe.completed_index maps every
+base bar to the latest such candle -
+
+    hourly = self.timeframe(3600)
+    k = hourly.completed_index[i]       # -1 while no hour is complete
+    if k >= 0:
+        hourly_close = hourly.candles.close[k]
+"""
+
+import weakref
+
+import numpy as np
+
+from candles import CandleSeries
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# CandleSeries -> Resampler
+resamplers = weakref.WeakKeyDictionary()
+
+
+class Timeframe(object):
+    """
+    Candles of one higher timeframe -
+    1. candles: CandleSeries, time is the start of each candle's bucket
+    2. start_index, end_index: range of base candles making up each candle
+    3. completed_index: for every base candle, index of the latest higher
+       timeframe candle complete at its close (-1 if none)
+    """
+    def __init__(self, seconds, candles, start_index, end_index, completed_index):
+        self.seconds = seconds
+        self.candles = candles
+        self.start_index = start_index
+        self.end_index = end_index
+        self.completed_index = completed_index
+
+    def __len__(self):
+        return len(self.candles)
+
+    def __repr__(self):
+        return '<Timeframe: %ds, %d candles>' % (self.seconds, len(self.candles))
+
+    def completed(self, i):
+        """
+        Latest candle complete at base bar i, as a tuple (time, open, high,
+        low, close, volume), or None.
+        """
+        k = self.completed_index[i]
+        return None if k < 0 else self.candles[k]
+
+
+def base_period(candles):
+    """
+    Timeframe of base candles in seconds - the smallest gap between them.
+    """
+    gaps = np.diff(candles.time)
+    gaps = gaps[gaps > 0]
+    return int(gaps.min()) if len(gaps) else 0
+
+
+def resample(candles, seconds, offset=0, period=None):
+    """
+    Resample candles into buckets of 'seconds', aligned to 'offset' seconds
+    past the epoch (e.g. seconds=HOUR, offset=15*MINUTE for hourly candles
+    starting at 09:15, 10:15, ...). period is the base timeframe in
+    seconds, detected if None.
+
+    A higher timeframe candle is complete at the base candle which ends
+    its bucket (time + period reaches the end of the bucket). If base
+    candles stop early (e.g. the market closes before midnight, for daily
+    candles) it is complete only at the first base candle of a later
+    bucket.
+    """
+    if period is None:
+        period = base_period(candles)
+    n = len(candles)
+    if not n:
+        empty = np.zeros(0, dtype=np.int64)
+        return Timeframe(seconds, candles[0:0], empty, empty, empty)
+
+    bucket = (candles.time - offset) // seconds
+    start_index = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]]))
+    end_index = np.append(start_index[1:], n)
+    resampled = CandleSeries(bucket[start_index] * seconds + offset,
+                             candles.open[start_index],
+                             np.maximum.reduceat(candles.high, start_index),
+                             np.minimum.reduceat(candles.low, start_index),
+                             candles.close[end_index - 1],
+                             np.add.reduceat(candles.volume, start_index))
+
+    bucket_end = (bucket[start_index] + 1) * seconds + offset
+    ends_bucket = candles.time[end_index - 1] + period >= bucket_end
+    complete_at = np.where(ends_bucket, end_index - 1, end_index)
+    completed_index = np.searchsorted(complete_at, np.arange(n), 'right') - 1
+    return Timeframe(seconds, resampled, start_index, end_index, completed_index)
+
+
+class Resampler(object):
+    """
+    Timeframes of one CandleSeries, each computed once on first use. The
+    candles are held by a weak reference, so the shared registry does not
+    keep them alive.
+    """
+    def __init__(self, candles):
+        self.candles = weakref.ref(candles)
+        self.period = base_period(candles)
+        self.timeframes = {}
+
+    def timeframe(self, seconds, offset=0):
+        key = (seconds, offset)
+        if key not in self.timeframes:
+            self.timeframes[key] = resample(self.candles(), seconds, offset, self.period)
+        return self.timeframes[key]
+
+
+def resampler(candles):
+    """
+    The shared Resampler of a CandleSeries.
+    """
+    if candles not in resamplers:
+        resamplers[candles] = Resampler(candles)
+    return resamplers[candles]
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Strategies declared as rules instead of code.
+
+A rule is an expression over candle columns, then '->', an action and
+bracket parameters -
+
+    crossover(ema(close, 3), ema(close, 15)) -> buy sl=1% tp=0.3%
+    crossunder(ema(close, 3), ema(close, 15)) -> sell with sl=1%, tp=0.3%
+
+Expressions use python syntax - the columns open, high, low, close and
+volume, numbers, arithmetic, comparisons, and/or/not, and the functions
+in FUNCTIONS (array functions of indicators.py). A rule fires at the bars
+where its expression is true (non-zero and not NaN); crossover is 1 when
+its first argument crosses above the second, crossunder when it crosses
+below. Actions are buy or sell, with optional qty (a whole number,
+default 1), sl (stop loss) and tp (target), in percent of the close
+price.
+
+Rules are compiled into expression trees and evaluated over whole candle
+arrays. Every distinct subexpression is computed once per CandleSeries
+and shared by all rules and specs evaluated on it (see evaluator(); values
+are kept in an ArrayCache of EVALUATOR_CACHE_BYTES, so the least recently
+used are recomputed if many specs don't fit), so
+many variants of a strategy, like
+
+    for fast in (3, 5, 8):
+        SpecStrategy(spec='crossover(ema(close, %d), ema(close, 15)) -> buy' % fast)
+
+cost little more than one. SpecStrategy backtests a spec with either
+backtest() or backtest_vectorized(), which give the same orders; the spec
+STRATEGY2 below reproduces Strategy2.
+"""
+
+import ast
+import re
+import weakref
+
+import numpy as np
+
+from arraycache import ArrayCache
+from backtesting import AlgoTradingBacktesting
+from dataloader import load_candles
+from indicators import crossover_array, ema_array, sma_array
+
+STRATEGY2 = ['crossover(ema(close, 3), ema(close, 15)) -> buy sl=1% tp=0.3%',
+             'crossunder(ema(close, 3), ema(close, 15)) -> sell sl=1% tp=0.3%']
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+FUNCTIONS = {
+    'sma': sma_array,
+    'ema': ema_array,
+    'cross': crossover_array,       # 1 on crossover, -1 on crossunder, else 0
+    'abs': np.abs,
+    'min': np.fmin,
+    'max': np.fmax,
+}
+
+# Number of arguments of every function. The window of sma and ema (their
+# second argument) has to be a positive whole number.
+ARITY = {'sma': 2, 'ema': 2, 'cross': 2, 'crossover': 2, 'crossunder': 2,
+         'abs': 1, 'min': 2, 'max': 2}
+WINDOW_FUNCTIONS = ('sma', 'ema')
+
+OPERATORS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+    ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+    ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+
+# crossover(a, b) is cross(a, b) == 1, so both share cross(a, b)
+CROSSES = {'crossover': 1, 'crossunder': -1}
+
+ACTIONS = ('buy', 'sell')
+RULE_PARAMETERS = {'qty': 'quantity', 'quantity': 'quantity',
+                   'sl': 'stop_loss_percent', 'tp': 'target_percent'}
+RULE_PARAMETER = re.compile(r'^(\w+)=(\d+(?:\.\d*)?|\.\d+)%?$')
+
+# Size of the subexpression values kept by every Evaluator
+EVALUATOR_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class SpecError(ValueError):
+    pass
+
+
+def compile_expression(node):
+    """
+    Expression tree of an ast node, as nested tuples -
+    ('column', name), ('const', value), ('call', name, args...),
+    ('op', operator, left, right), ('and', ...), ('or', ...), ('not', x),
+    ('neg', x). crossover and crossunder become comparisons of cross().
+    Equal subexpressions give equal tuples, which is what evaluation is
+    cached on.
+    """
+    if isinstance(node, ast.Expression):
+        return compile_expression(node.body)
+    if isinstance(node, ast.Name):
+        if node.id not in COLUMNS:
+            raise SpecError('Unknown column %s' % node.id)
+        return ('column', node.id)
+    if isinstance(node, ast.Num):
+        return ('const', node.n)
+    if isinstance(node, ast.Call):
+        name = getattr(node.func, 'id', None)
+        if name not in FUNCTIONS and name not in CROSSES:
+            raise SpecError('Unknown function %s' % name)
+        if node.keywords or node.starargs or node.kwargs:
+            raise SpecError('Only positional arguments are supported')
+        if name in ARITY and len(node.args) != ARITY[name]:
+            raise SpecError('Wrong number of arguments to %s: needs %d, got %d'
+                            % (name, ARITY[name], len(node.args)))
+        args = tuple(compile_expression(arg) for arg in node.args)
+        if name in WINDOW_FUNCTIONS and not (args[1][0] == 'const'
+                                             and args[1][1] == int(args[1][1]) > 0):
+            raise SpecError('Window of %s has to be a positive whole number' % name)
+        if name in CROSSES:
+            return ('op', ast.Eq, ('call', 'cross') + args, ('const', CROSSES[name]))
+        return ('call', name) + args
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return ('op', type(node.op), compile_expression(node.left),
+                compile_expression(node.right))
+    if isinstance(node, ast.Compare):
+        # a < b < c is (a < b) and (b < c)
+        terms = []
+        left = compile_expression(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in OPERATORS:
+                raise SpecError('Unsupported comparison')
+            right = compile_expression(comparator)
+            terms.append(('op', type(op), left, right))
+            left = right
+        return terms[0] if len(terms) == 1 else ('and',) + tuple(terms)
+    if isinstance(node, ast.BoolOp):
+        name = 'and' if isinstance(node.op, ast.And) else 'or'
+        return (name,) + tuple(compile_expression(value) for value in node.values)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ('not', compile_expression(node.operand))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return ('neg', compile_expression(node.operand))
+    raise SpecError('Unsupported expression: %s' % ast.dump(node))
+
+
+def truth(values):
+    """
+    Where values are true - non-zero and not NaN.
+    """
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return (values != 0) & ~np.isnan(values)
+
+
+class Rule(object):
+    """
+    One compiled rule - expression tree, action, quantity and bracket
+    percentages (None for no trigger).
+    """
+    def __init__(self, expression, action, quantity=1, stop_loss_percent=None,
+                 target_percent=None, text=None):
+        self.expression = expression
+        self.action = action
+        self.quantity = quantity
+        self.stop_loss_percent = stop_loss_percent
+        self.target_percent = target_percent
+        self.text = text
+
+    def __repr__(self):
+        return '<Rule: %s>' % self.text
+
+
+def parse_rule(text):
+    """
+    Compile a rule 'expression -> action [with] key=value[%], ...'.
+    """
+    if text.count('->') != 1:
+        raise SpecError("Rule needs exactly one '->': %s" % text)
+    condition, action = text.split('->')
+    try:
+        expression = compile_expression(ast.parse(condition.strip(), mode='eval'))
+    except SyntaxError as e:
+        raise SpecError('Invalid expression %r: %s' % (condition.strip(), e))
+
+    words = re.split(r'[\s,]+', action.strip())
+    if not words or words[0].lower() not in ACTIONS:
+        raise SpecError('Action has to be one of %s: %s' % (', '.join(ACTIONS), text))
+    params = {}
+    for word in words[1:]:
+        if not word or word.lower() == 'with':
+            continue
+        match = RULE_PARAMETER.match(word)
+        if match is None or match.group(1).lower() not in RULE_PARAMETERS:
+            raise SpecError('Invalid rule parameter %r in: %s' % (word, text))
+        params[RULE_PARAMETERS[match.group(1).lower()]] = float(match.group(2))
+    if 'quantity' in params:
+        if params['quantity'] != int(params['quantity']) or params['quantity'] < 1:
+            raise SpecError('qty has to be a positive whole number: %s' % text)
+        params['quantity'] = int(params['quantity'])
+    return Rule(expression, words[0].lower(), text=text.strip(), **params)
+
+
+def parse_spec(spec):
+    """
+    Compile a spec - a rule, a list of rules or a string of rules on
+    separate lines (blank lines and lines starting with # are skipped).
+    """
+    if isinstance(spec, basestring):
+        spec = spec.splitlines()
+    return [parse_rule(line) for line in spec
+            if line.strip() and not line.strip().startswith('#')]
+
+
+class Evaluator(object):
+    """
+    Evaluates expression trees over the columns of a CandleSeries, caching
+    subexpression values in an ArrayCache of max_bytes.
+    """
+    def __init__(self, candles, max_bytes=EVALUATOR_CACHE_BYTES):
+        self.candles = weakref.ref(candles)
+        self.cache = ArrayCache(max_bytes)
+
+    def evaluate(self, expression):
+        if expression[0] == 'const':
+            return expression[1]
+        return self.cache.get(expression, lambda: self.compute(expression))
+
+    def compute(self, expression):
+        kind = expression[0]
+        if kind == 'column':
+            values = np.asarray(getattr(self.candles(), expression[1]), dtype=np.float64)
+        elif kind == 'call':
+            values = FUNCTIONS[expression[1]](*[self.evaluate(arg) for arg in expression[2:]])
+        elif kind == 'op':
+            values = OPERATORS[expression[1]](self.evaluate(expression[2]),
+                                              self.evaluate(expression[3]))
+        elif kind == 'and':
+            values = np.logical_and.reduce([truth(self.evaluate(term)) for term in expression[1:]])
+        elif kind == 'or':
+            values = np.logical_or.reduce([truth(self.evaluate(term)) for term in expression[1:]])
+        elif kind == 'not':
+            values = ~truth(self.evaluate(expression[1]))
+        elif kind == 'neg':
+            values = np.negative(self.evaluate(expression[1]))
+        else:
+            raise SpecError('Unknown expression %r' % (expression,))
+        return values
+
+    def signals(self, rules):
+        """
+        (entries, stop_loss, target) of rules, as AlgoTradingBacktesting.signals
+        returns them. When several rules fire at a bar, the first one wins.
+        """
+        close = np.asarray(self.candles().close, dtype=np.float64)
+        n = len(close)
+        entries = np.zeros(n, dtype=np.int64)
+        stop_loss = np.full(n, np.nan)
+        target = np.full(n, np.nan)
+        for rule in rules:
+            fires = np.broadcast_to(truth(self.evaluate(rule.expression)), (n,)) & (entries == 0)
+            side = 1 if rule.action == 'buy' else -1
+            entries[fires] = side * rule.quantity
+            if rule.stop_loss_percent is not None:
+                stop_loss[fires] = close[fires] * (1 - side * rule.stop_loss_percent / 100.0)
+            if rule.target_percent is not None:
+                target[fires] = close[fires] * (1 + side * rule.target_percent / 100.0)
+        return entries, stop_loss, target
+
+
+# Evaluators of the CandleSeries in use
+evaluators = weakref.WeakKeyDictionary()
+
+
+def evaluator(candles):
+    """
+    The Evaluator of a CandleSeries, shared by everything evaluated on it.
+    """
+    try:
+        return evaluators[candles]
+    except KeyError:
+        evaluators[candles] = Evaluator(candles)
+        return evaluators[candles]
+
+
+class SpecStrategy(AlgoTradingBacktesting):
+    """
+    Backtests the rules of 'spec' (see parse_spec) on the candles of
+    data_path, or on given candles. backtest() places the orders of
+    signals() bar by bar.
+    """
+    data_path = r'pycon-tatasteel-data.csv'
+
+    # Parameters
+    spec = STRATEGY2
+
+    def __init__(self, **params):
+        AlgoTradingBacktesting.__init__(self, **params)
+        self.rules = parse_spec(self.spec)
+        self.entries = None
+
+    def read_data(self):
+        self.set_candles(load_candles(self.data_path))
+
+    def signals(self):
+        return evaluator(self.candles).signals(self.rules)
+
+    def strategy(self, i, candle_open, candle_close, candle_low, candle_high):
+        if self.entries is None:
+            entries, stop_loss, target = self.signals()
+            self.entries = entries.tolist()
+            self.stop_losses = [None if value != value else value for value in stop_loss.tolist()]
+            self.targets = [None if value != value else value for value in target.tolist()]
+        quantity = self.entries[i]
+        if quantity > 0:
+            self.buy_trade(candle_close, quantity, self.stop_losses[i], self.targets[i])
+        elif quantity < 0:
+            self.sell_trade(candle_close, -quantity, self.stop_losses[i], self.targets[i])
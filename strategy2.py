@@ -3,85 +3,63 @@
 @author: Pushpak Dagade
 """
 
-import datetime as dt
-import pandas
+import numpy as np
 
+import events
 from backtesting import AlgoTradingBacktesting
-
-PATH_DATA_POINTS = r'pycon-tatasteel-data.csv'
+from dataloader import load_candles
+from indicators import EMA, ema_array, crossover_array
 
 
 class Strategy2(AlgoTradingBacktesting):
-    def __init__(self):
-        AlgoTradingBacktesting.__init__(self)
-        self.initialize_crossover()
-
-    def read_data(self):
-        self.csv = pandas.read_csv(PATH_DATA_POINTS)
-        self.timeline_labels = [dt.datetime.strptime(date,'%d/%m/%y %H:%M').strftime("%d/%m/%y") for date in self.csv['Date']][::-1]
-        self.timeline = [i for i in xrange(len(self.timeline_labels))]
-        self.candles_open = self.csv['TATASTEEL-EQ O'].tolist()[::-1]
-        self.candles_close = self.csv['TATASTEEL-EQ C'].tolist()[::-1]
-        self.candles_high = self.csv['TATASTEEL-EQ H'].tolist()[::-1]
-        self.candles_low = self.csv['TATASTEEL-EQ L'].tolist()[::-1]
-
-    def sma(self, data, window):
-        """
-        Calculates Simple Moving Average
-        http://fxtrade.oanda.com/learn/forex-indicators/simple-moving-average
-        """
-        if len(data) < window:
-            return None
-        return sum(data[-window:]) / float(window)
+    data_path = r'pycon-tatasteel-data.csv'
 
-    def ema(self, data, window):
-        """
-        Calculates Exponential Moving Average
-        """
-        if len(data) < 2 * window:
-            raise ValueError("data is too short")
-        c = 2.0 / (window + 1)
-        current_ema = self.sma(data[-window*2:-window], window)
-        for value in data[-window:]:
-            current_ema = (c * value) + ((1 - c) * current_ema)
-        return current_ema
+    # Parameters
+    ema_fast_window = 3
+    ema_slow_window = 15
+    stop_loss_percent = 1.0
+    target_percent = 0.3
 
-    def initialize_crossover(self):
-        self.prev_val1 = 0
-        self.prev_val2 = 0
+    def __init__(self, **params):
+        AlgoTradingBacktesting.__init__(self, **params)
+        self.ema_fast = self.add_indicator(EMA(self.ema_fast_window))
+        self.ema_slow = self.add_indicator(EMA(self.ema_slow_window))
 
-    def crossover(self, val1, val2):
-        cmp1 = cmp(val1, val2)
-        cmp2 = cmp(self.prev_val1, self.prev_val2)
-        if (not (self.prev_val1 == 0 and self.prev_val2 == 0)):         # don't trigger crossover when called first time
-            self.prev_val1, self.prev_val2 = val1, val2
-            if cmp1 > cmp2:
-                return 1
-            elif cmp1 < cmp2:
-                return -1
-            else:
-                return 0
-        else:
-            self.prev_val1, self.prev_val2 = val1, val2
-            return 0
+    def read_data(self):
+        candles = load_candles(self.data_path)
+        self.set_candles(candles, timeline=np.arange(len(candles)))
+        self.timeline_labels = candles.labels("%d/%m/%y")
 
     def strategy(self, i, candle_open, candle_close, candle_low, candle_high):
         crossover = 0
-        if i >= 29:      # ema(15) needs atleast 30 points
-            crossover = self.crossover(self.ema(self.candles_close[:i+1], 3), self.ema(self.candles_close[:i+1], 15))
+        if self.ema_fast.ready and self.ema_slow.ready:
+            crossover = self.crossover(self.ema_fast.value, self.ema_slow.value)
             if (crossover == 1):
-                stop_loss = candle_close*(1 - 0.01)
-                target = candle_close*(1 + 0.003)
-                print 'Crossover, BUY: stock_price: %f, stop_loss: %f, target_price: %f' % (candle_close, stop_loss, target)
+                stop_loss = candle_close*(1 - self.stop_loss_percent/100.0)
+                target = candle_close*(1 + self.target_percent/100.0)
+                events.sink.log(events.INFO, 'Crossover, BUY: stock_price: %f, stop_loss: %f, target_price: %f',
+                                candle_close, stop_loss, target)
                 self.buy_trade(entry_price=candle_close, quantity=1,
                                stop_loss_trigger=stop_loss, target_trigger=target)
             elif (crossover == -1):
-                stop_loss = candle_close*(1 + 0.01)
-                target = candle_close*(1 - 0.003)
-                print 'Crossover, SELL: stock_price: %f, stop_loss: %f, target_price: %f' % (candle_close, stop_loss, target)
+                stop_loss = candle_close*(1 + self.stop_loss_percent/100.0)
+                target = candle_close*(1 - self.target_percent/100.0)
+                events.sink.log(events.INFO, 'Crossover, SELL: stock_price: %f, stop_loss: %f, target_price: %f',
+                                candle_close, stop_loss, target)
                 self.sell_trade(entry_price=candle_close, quantity=1,
                                 stop_loss_trigger=stop_loss, target_trigger=target)
 
+    def signals(self):
+        close = np.asarray(self.candles_close, dtype=np.float64)
+        crossover = crossover_array(ema_array(close, self.ema_fast_window),
+                                    ema_array(close, self.ema_slow_window))
+        stop_loss = np.where(crossover == 1, close*(1 - self.stop_loss_percent/100.0),
+                             close*(1 + self.stop_loss_percent/100.0))
+        target = np.where(crossover == 1, close*(1 + self.target_percent/100.0),
+                          close*(1 - self.target_percent/100.0))
+        return crossover, stop_loss, target
+
+
 if __name__ == "__main__":
     algotrading_backtesting = Strategy2()
     algotrading_backtesting.backtest()
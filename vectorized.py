@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Vectorized order matching, used by
+AlgoTradingBacktesting.backtest_vectorized.
+
+Stop loss and target fills follow the same rules as BuyOrder.try_to_close
+and SellOrder.try_to_close -
+1. An order entered at bar i is first checked at bar i+1
+2. Stop loss is checked before target within a bar
+3. Fills happen at candle_low / candle_high, not at the trigger price
+4. A missing (None) trigger compares like None does in python 2, i.e.
+   it is smaller than every price
+"""
+
+import numpy as np
+
+# Largest number of (order, bar) pairs examined in one numpy operation
+MAX_BLOCK_ELEMENTS = 1 << 22
+
+
+def trigger_array(triggers, n):
+    """
+    Convert stop loss / target triggers into a float array where missing
+    triggers (None or NaN) are -inf, which makes every comparison behave
+    the same way as comparisons with None.
+    """
+    if triggers is None:
+        return np.full(n, -np.inf)
+    triggers = np.array(triggers, dtype=np.float64)
+    triggers[np.isnan(triggers)] = -np.inf
+    return triggers
+
+
+def resolve_exits(entry_index, is_buy, stop_loss, target,
+                  candles_high, candles_low, stop=None):
+    """
+    Find exit bar and exit price of every order in bulk.
+
+    entry_index, is_buy, stop_loss and target hold one entry per order.
+    stop_loss and target must already be converted with trigger_array.
+    Only bars before 'stop' are examined (default: all bars).
+
+    Returns (exit_index, exit_price, stop_loss_hit). exit_index is -1 for
+    orders which are still open at 'stop'.
+
+    All pending orders are advanced together, one block of bars at a time.
+    Block width doubles on each pass, so an order open for k bars takes
+    O(log k) passes.
+    """
+    candles_high = np.asarray(candles_high, dtype=np.float64)
+    candles_low = np.asarray(candles_low, dtype=np.float64)
+    n = len(candles_high) if stop is None else stop
+    entry_index = np.asarray(entry_index, dtype=np.int64)
+    count = len(entry_index)
+
+    exit_index = np.full(count, -1, dtype=np.int64)
+    exit_price = np.full(count, np.nan)
+    stop_loss_hit = np.zeros(count, dtype=bool)
+
+    pending = np.flatnonzero(entry_index + 1 < n)
+    offset = 1
+    width = 16
+    while len(pending):
+        width = max(1, min(width, MAX_BLOCK_ELEMENTS // len(pending)))
+        bars = entry_index[pending, None] + offset + np.arange(width)
+        in_range = bars < n
+        bars = np.minimum(bars, n - 1)
+        high = candles_high[bars]
+        low = candles_low[bars]
+
+        buy = is_buy[pending, None]
+        sl = stop_loss[pending, None]
+        tp = target[pending, None]
+        sl_hit = np.where(buy, sl >= low, sl <= high) & in_range
+        tp_hit = np.where(buy, tp <= high, tp >= low) & in_range
+        hit = sl_hit | tp_hit
+
+        first = hit.argmax(axis=1)
+        rows = np.flatnonzero(hit[np.arange(len(pending)), first])
+        if len(rows):
+            orders = pending[rows]
+            cols = first[rows]
+            on_stop_loss = sl_hit[rows, cols]
+            buy = is_buy[orders]
+            exit_index[orders] = bars[rows, cols]
+            # buy orders exit at candle_low on stop loss, candle_high on
+            # target and vice versa for sell orders
+            exit_price[orders] = np.where(buy == on_stop_loss,
+                                          low[rows, cols], high[rows, cols])
+            stop_loss_hit[orders] = on_stop_loss
+
+        still_open = np.ones(len(pending), dtype=bool)
+        still_open[rows] = False
+        still_open &= entry_index[pending] + offset + width < n
+        pending = pending[still_open]
+        offset += width
+        width *= 2
+
+    return exit_index, exit_price, stop_loss_hit
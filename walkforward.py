@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Pushpak Dagade
+
+Walk-forward analysis - optimize parameters on a window of bars (in
+sample), test the best parameters on the window right after it (out of
+sample), move both windows forward and repeat.
+
+Data is loaded and signals (see AlgoTradingBacktesting.signals) are
+computed once per parameter set over the whole series, before any window
+is run. Every in sample and out of sample run is then a vectorized
+backtest of a range of bars (backtest_vectorized(start, stop, signals)),
+with indicators warmed up by the bars before the range. Windows are run
+in parallel on a pool of processes forked after the precomputation, so
+workers share it instead of receiving it with every task.
+
+Orders still open at the end of an in sample or out of sample range are
+closed at the close of its last bar, so every run's profit is complete,
+parameter sets are compared the same way they are tested and no trade
+spans two windows. The last out of sample range may be shorter than the
+others; metrics undefined on it (e.g. a Sharpe ratio of less than two
+days) are NaN, which is logged as a warning and left out of summary().
+
+    wf = WalkForward(Strategy2, {'ema_fast_window': [3, 5, 8],
+                                 'ema_slow_window': [15, 20, 30]},
+                     train=10000, test=2500, metric='sharpe_ratio')
+    table = wf.run()
+    print wf.summary()
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas
+
+import events
+from analytics import bar_times
+from optimizer import evaluate, lower_is_better, parameter_grid
+from order import TradeLedger
+
+# WalkForward being run, for worker processes
+_walk_forward = None
+
+
+def walk_forward_windows(n, train, test, step=None, anchored=False, start=0):
+    """
+    Bar ranges (train_start, train_stop, test_start, test_stop) of every
+    window over n bars. Windows move forward by 'step' bars (default:
+    test). With anchored=True in sample windows all start at 'start' and
+    grow instead of sliding. The last test window may be shorter than
+    'test'.
+    """
+    if step is None:
+        step = test
+    windows = []
+    train_stop = start + train
+    while train_stop < n:
+        train_start = start if anchored else train_stop - train
+        windows.append((train_start, train_stop, train_stop, min(train_stop + test, n)))
+        train_stop += step
+    return windows
+
+
+def _run_window(window):
+    return _walk_forward.run_window(window)
+
+
+class WalkForward(object):
+    """
+    Walk-forward analysis of strategy_class over parameter_sets - a list of
+    parameter dicts, or a dict {parameter: list of values} for all their
+    combinations. metric is what is optimized in sample (see
+    optimizer.evaluate) - minimized if ascending, which defaults to
+    optimizer.lower_is_better(metric), maximized otherwise - and is also
+    reported out of sample.
+    """
+    def __init__(self, strategy_class, parameter_sets, train, test, step=None,
+                 anchored=False, metric='profit', ascending=None):
+        if isinstance(parameter_sets, dict):
+            parameter_sets = parameter_grid(parameter_sets)
+        self.strategy_class = strategy_class
+        self.parameter_sets = parameter_sets
+        self.metric = metric
+        self.ascending = lower_is_better(metric) if ascending is None else ascending
+
+        previous_sink = events.set_sink(events.NullSink())
+        try:
+            self.signals = []
+            for params in parameter_sets:
+                backtester = strategy_class(**params)
+                self.signals.append(backtester.signals())
+        finally:
+            events.set_sink(previous_sink)
+        self.times = bar_times(backtester)
+        self.windows = walk_forward_windows(len(backtester.candles_close), train, test,
+                                            step, anchored)
+        self.table = None
+        self.ledger = None
+
+    def backtest(self, k, start, stop):
+        """
+        Vectorized backtest of parameter set k on bars start..stop-1.
+        """
+        backtester = self.strategy_class(**self.parameter_sets[k])
+        backtester.backtest_vectorized(start, stop, self.signals[k])
+        return backtester
+
+    def run_window(self, window):
+        """
+        Optimize on the in sample range of window and backtest the best
+        parameter set on its out of sample range, closing orders still open
+        at the end of each. Returns a result row and the out of sample trade ledger.
+        """
+        train_start, train_stop, test_start, test_stop = window
+        previous_sink = events.set_sink(events.NullSink())
+        try:
+            scores = []
+            for k in xrange(len(self.parameter_sets)):
+                in_sample = self.backtest(k, train_start, train_stop)
+                in_sample.close_open_orders()
+                scores.append(evaluate(in_sample, self.metric)['metric'])
+            scores = np.array(scores, dtype=np.float64)
+            if self.ascending:
+                best = int(np.argmin(np.where(np.isnan(scores), np.inf, scores)))
+            else:
+                best = int(np.argmax(np.where(np.isnan(scores), -np.inf, scores)))
+            out_of_sample = self.backtest(best, test_start, test_stop)
+            closed_at_end = len(out_of_sample.open_orders)
+            out_of_sample.close_open_orders()
+        finally:
+            events.set_sink(previous_sink)
+
+        row = {'train_start': train_start, 'train_stop': train_stop,
+               'test_start': test_start, 'test_stop': test_stop,
+               'in_sample_metric': scores[best],
+               'closed_at_window_end': closed_at_end}
+        if self.times is not None:
+            row['test_start_time'] = self.times[test_start]
+            row['test_end_time'] = self.times[test_stop - 1]
+        row.update(self.parameter_sets[best])
+        result = evaluate(out_of_sample, self.metric)
+        row['out_of_sample_metric'] = result.pop('metric')
+        row.update(result)
+        if np.isnan(row['out_of_sample_metric']):
+            events.sink.log(events.WARNING,
+                            'WARNING: %s is undefined out of sample on bars %d..%d',
+                            self.metric, test_start, test_stop - 1)
+        return row, out_of_sample.ledger
+
+    def run(self, processes=None):
+        """
+        Run every window on 'processes' worker processes (default: one per
+        core). Returns a DataFrame with one row per window - its bars,
+        the best parameters, in and out of sample metric and out of sample
+        statistics. Out of sample trades of all windows are collected in
+        self.ledger.
+        """
+        global _walk_forward
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes == 1:
+            results = map(self.run_window, self.windows)
+        else:
+            _walk_forward = self
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_run_window, self.windows)
+            finally:
+                pool.close()
+                pool.join()
+                _walk_forward = None
+
+        self.table = pandas.DataFrame([row for row, _ in results])
+        self.ledger = TradeLedger()
+        for _, ledger in results:
+            self.ledger.extend(**dict((name, ledger.column(name))
+                                      for name, _, _ in TradeLedger.columns))
+        return self.table
+
+    def summary(self):
+        """
+        Out of sample results of all windows together, as a dict.
+        Efficiency is out of sample metric per bar over in sample metric
+        per bar (meaningful for metrics which add up over time, like
+        profit). Windows where a metric is NaN are left out of its mean and
+        of efficiency.
+        """
+        table = self.table
+        profit = self.ledger.column('profit')
+        in_sample = table['in_sample_metric'].notnull()
+        out_of_sample = table['out_of_sample_metric'].notnull()
+        in_sample_per_bar = (table['in_sample_metric'][in_sample].sum()
+                             / (table['train_stop'] - table['train_start'])[in_sample].sum())
+        out_of_sample_per_bar = (table['out_of_sample_metric'][out_of_sample].sum()
+                                 / (table['test_stop'] - table['test_start'])[out_of_sample].sum())
+        return {'windows': len(table),
+                'windows_without_metric': int((~out_of_sample).sum()),
+                'executed_trades': len(profit),
+                'profitable_trades': int((profit >= 0).sum()),
+                'loss_making_trades': int((profit < 0).sum()),
+                'profit': profit.sum(),
+                'trades_closed_at_window_ends': int(table['closed_at_window_end'].sum()),
+                'mean_in_sample_metric': table['in_sample_metric'].mean(),
+                'mean_out_of_sample_metric': table['out_of_sample_metric'].mean(),
+                'efficiency': (out_of_sample_per_bar / in_sample_per_bar
+                               if in_sample_per_bar else np.nan)}
+
+
+if __name__ == "__main__":
+    from strategy2 import Strategy2
+    wf = WalkForward(Strategy2, {'ema_fast_window': [3, 5, 8],
+                                 'ema_slow_window': [15, 20, 30],
+                                 'target_percent': [0.3, 0.5]},
+                     train=10000, test=2500)
+    print wf.run()
+    print wf.summary()